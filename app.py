@@ -1,8 +1,5 @@
 import streamlit as st
-import sqlite3
 import pandas as pd
-import json
-import time
 from datetime import date
 import os
 import sys
@@ -53,6 +50,8 @@ st.set_page_config(
 # [상태 저장소] 체크박스 상태, 추천 결과를 저장하기 위해 초기화
 if 'recommendation' not in st.session_state:
     st.session_state.recommendation = ""
+if 'meal_plan' not in st.session_state:
+    st.session_state.meal_plan = None
 if 'tasks_checked' not in st.session_state:
     st.session_state.tasks_checked = 0
 
@@ -78,20 +77,26 @@ def add_user_to_db(profile_data):
     INSERT INTO users (username, preferences, restrictions_allergies, restrictions_other, goals, budget) 
     VALUES (?, ?, ?, ?, ?, ?)
     """
-    conn = None
-    try:
-        conn = sqlite3.connect(backend.DB_PATH)
+    # 오류 발생 시 db_write가 롤백하고 오류를 다시 발생시켜 상위(UI)에서 처리
+    with backend.db_write() as conn:
         cursor = conn.cursor()
         cursor.execute(query, profile_data)
-        conn.commit()
-    except Exception as e:
-        # 오류 발생 시, 롤백하고 오류를 다시 발생시켜 상위(UI)에서 처리
-        if conn:
-            conn.rollback()
-        raise e
-    finally:
-        if conn:
-            conn.close()
+
+# --- 3-1. [신규] 스트리밍 추천 미리보기 ---
+
+def render_match_preview(box, rec_text, candidates_df):
+    """
+    스트리밍 중 지금까지 받은 텍스트에서 제목이 완성된 레시피를 등장 순서대로 표시합니다.
+    (위젯 없이 글자만 그림 -> 완료 후 아래 '상세 정보' 섹션과 위젯 Key가 겹치지 않음)
+    """
+    matches = sorted(backend.match_recommended_recipes(rec_text, candidates_df), key=lambda m: m['position'])
+    if not matches:
+        return
+    with box.container():
+        st.markdown("##### 🔍 추천된 레시피")
+        for match in matches:
+            calories = match['calories'] if match['calories'] != "정보 없음" else "열량 계산 중..."
+            st.markdown(f"- **{match['row']['RCP_TTL']}** · {calories}")
 
 # --- 4. Streamlit UI 그리기 ---
 
@@ -102,20 +107,18 @@ st.caption(f"오늘 날짜: {date.today().strftime('%Y년 %m월 %d일')}")
 tab1, tab2, tab3 = st.tabs([" 🧑‍🍳 식단 추천받기 ", " 📝 신규 프로필 가입 ", " 📈 마이페이지 "])
 
 # [신규] 앱이 시작될 때 DB 테이블 셋업 함수를 한 번 호출
-# (앱이 실행될 때마다 호출되지만, 'CREATE TABLE IF NOT EXISTS'이므로 안전합니다)
+# (화면을 다시 그릴 때마다 호출되지만, 스키마 마이그레이션은 프로세스당 한 번만 실행됩니다)
+# (DB 연결은 스레드별로 재사용되는 공유 연결 -> 닫지 않음)
 try:
-    conn = sqlite3.connect(backend.DB_PATH)
-    backend.setup_database(conn)
+    with backend.db_connection() as conn:
+        backend.setup_database(conn)
 except Exception as e:
     st.error(f"DB 셋업 실패: {e}")
-finally:
-    if 'conn' in locals() and conn:
-        conn.close()
 
 # --- 3A. [추천받기] 탭 ---
 with tab1:
     try:
-        conn = sqlite3.connect(backend.DB_PATH) # 4단계 파일의 DB_PATH 변수 사용
+        conn = backend.get_db_connection() # 4단계 파일의 DB_PATH 공유 연결
         
         # 3A-1. 사용자 선택 (드롭다운)
         user_list = get_user_list(conn)
@@ -166,110 +169,61 @@ with tab1:
         if st.button("✨ AI로 오늘의 식단 추천받기"):
             if profile:
                 st.session_state.recommendation = ""
+                st.session_state.meal_plan = None
                 st.session_state.tasks_checked = 0
                 st.session_state.votes = {}
                 
-                # [단계 1] 1차 필터링 (DB에서 안전한 레시피 거르기)
-                with st.spinner("1. 기본 데이터 필터링 중..."):
-                    try:
-                        restrictions = backend.parse_restrictions(profile)
-                        filtered_recipes = backend.recommend_recipes_by_filter(conn, profile, restrictions)
-                    except Exception as e:
-                        st.error(f"필터링 오류: {e}")
-                        filtered_recipes = pd.DataFrame()
-
-                if filtered_recipes.empty:
-                    st.error("1차 필터링 결과, 추천할 레시피가 없습니다.")
+                # [단계 1~4] 필터링 -> 키워드 추출 -> 후보군(취향20+기분20+랜덤10) -> Gemini 식단
+                # (백엔드 파이프라인이 서로 의존하지 않는 단계를 동시에 실행)
+                stage_box = st.empty()
+                with st.spinner("AI가 오늘의 식단을 준비하고 있습니다..."):
+                    pipeline_result = backend.recommend_meal_plan(
+                        backend.YOUR_API_KEY,
+                        profile,
+                        today_date_str,
+                        mood,
+                        free_text,
+                        on_stage=stage_box.caption,
+                        stream=True
+                    )
+                stage_box.empty()
+                
+                if pipeline_result['keywords']:
+                    st.toast(f"💡 키워드: {pipeline_result['keywords']}")
+                
+                if pipeline_result['error']:
+                    st.error(pipeline_result['error'])
                 else:
-                    # [단계 2] NLP 키워드 추출 (★여기서 딱 한 번만 실행!★)
-                    dynamic_keywords = ""
-                    if free_text:
-                        with st.spinner("2. AI가 기분을 분석하는 중... 🧠"):
-                            try:
-                                # 여기서 추출한 'dynamic_keywords'를 아래에서 계속 씁니다.
-                                dynamic_keywords = backend.extract_keywords_with_gemini(
-                                    backend.YOUR_API_KEY, 
-                                    free_text
-                                )
-                                if dynamic_keywords:
-                                    st.toast(f"💡 키워드: {dynamic_keywords}")
-                                    time.sleep(1) # API 과부하 방지용 1초 휴식
-                            except Exception as e:
-                                print(f"키워드 추출 실패 (무시함): {e}")
-
-                    # [단계 3] 후보군 선정 (밸런싱 로직)
-                    with st.spinner("3. 최적의 후보군(ML) + 의외의 발견(Random) 선정 중..."):
-                        try:
-                            # A. [이성적 추천] 프로필 기반 (20개)
-                            candidates_base = backend.get_smart_candidates(
-                                profile, 
-                                filtered_recipes, 
-                                top_n=20, 
-                                dynamic_keywords="" 
-                            )
-                            
-                            # B. [감성적 추천] 동적 키워드 기반 (20개)
-                            candidates_mood = backend.get_smart_candidates(
-                                profile, 
-                                filtered_recipes, 
-                                top_n=20, 
-                                dynamic_keywords=dynamic_keywords 
-                            )
-                            
-                            # C. [의외성 추천] 완전 랜덤 (10개) - 킬링 파트!
-                            # (이미 A, B에서 뽑힌 건 제외하고 뽑아야 함)
-                            current_selected_ids = pd.concat([candidates_base, candidates_mood])['RCP_SNO']
-                            
-                            # A와 B에 없는 것들만 남김
-                            remaining_for_random = filtered_recipes[~filtered_recipes['RCP_SNO'].isin(current_selected_ids)]
-                            
-                            if not remaining_for_random.empty:
-                                # 남은 것 중 10개 랜덤 (부족하면 남은 거 다)
-                                random_count = min(10, len(remaining_for_random))
-                                candidates_random = remaining_for_random.sample(n=random_count, random_state=None) # random_state 없어야 매번 바뀜
-                            else:
-                                candidates_random = pd.DataFrame()
-
-                            # D. 최종 합치기 (20 + 20 + 10 = 50개)
-                            candidates_mixed = pd.concat([
-                                candidates_base, 
-                                candidates_mood, 
-                                candidates_random
-                            ]).drop_duplicates(subset=['RCP_SNO'])
-                            
-                            # (혹시라도 중복 제거 후 50개가 안 되면 채우는 안전장치)
-                            target_total = 50
-                            if len(candidates_mixed) < target_total:
-                                remaining = filtered_recipes[~filtered_recipes['RCP_SNO'].isin(candidates_mixed['RCP_SNO'])]
-                                if not remaining.empty:
-                                    fill_count = min(target_total - len(candidates_mixed), len(remaining))
-                                    fill = remaining.sample(n=fill_count, random_state=42)
-                                    candidates_mixed = pd.concat([candidates_mixed, fill])
+                    # [단계 4] 식단을 생성되는 대로 바로 보여주기 (스트리밍)
+                    # JSON 응답이면 완성된 메뉴 항목부터 그리고,
+                    # Markdown 응답이면 원문 + 제목이 완성된 레시피를 아래에 붙임 (상세 정보는 완료 후 표시)
+                    candidates_mixed = pipeline_result['candidates']
+                    stream_box = st.empty()
+                    preview_box = st.empty()
+                    recommendation_text = ""
+                    # (Gemini 차단 중(간이 모드)이면 스트림 없이 바로 아래에서 간이 식단 표시)
+                    with st.spinner("4. AI 영양사가 식단을 작성 중입니다... 🥗"):
+                        for chunk in pipeline_result['recommendation_stream'] or []:
+                            recommendation_text += chunk
+                            partial_plan = backend.parse_meal_plan(recommendation_text, candidates_mixed, partial=True)
+                            if partial_plan is not None:
+                                stream_box.markdown(backend.meal_plan_to_markdown(partial_plan).replace('\n', '  \n') + " ▌")
                             else:
-                                candidates_mixed = candidates_mixed.head(target_total)
-
-                            print(f"🚀 최종 Gemini 전송 개수: {len(candidates_mixed)}개 (취향20+기분20+랜덤10)")
-
-                            # [단계 4] 최종 Gemini 추천
-                            with st.spinner("4. AI 영양사가 식단을 작성 중입니다... 🥗"):
-                                recommendation_text = backend.get_gemini_recommendation(
-                                    backend.YOUR_API_KEY, 
-                                    profile,
-                                    candidates_mixed,
-                                    today_date_str, 
-                                    mood,           
-                                    free_text       
-                                )
-                            
-                            if recommendation_text:
-                                st.session_state.recommendation = recommendation_text
-                                st.session_state.candidates_df = candidates_mixed
-                                st.success("AI 추천이 완료되었습니다!")
-                            else:
-                                st.error("Gemini API 호출에 실패했습니다.")
-                                
-                        except Exception as e:
-                            st.error(f"추천 생성 중 오류: {e}")
+                                stream_box.markdown(recommendation_text.replace('\n', '  \n') + " ▌")
+                                render_match_preview(preview_box, recommendation_text, candidates_mixed)
+                    stream_box.empty()
+                    preview_box.empty()
+                    
+                    # 응답이 없거나 중간에 끊긴 JSON이면 ML 상위 후보로 만든 간이 식단으로 대체
+                    meal_plan = backend.resolve_meal_plan(recommendation_text, candidates_mixed)
+                    if meal_plan and meal_plan['degraded']:
+                        recommendation_text = backend.meal_plan_to_markdown(meal_plan)
+                        st.warning("AI 영양사 연결이 원활하지 않아 간이 식단을 보여드립니다. 잠시 후 다시 시도해주세요.")
+                    else:
+                        st.success("AI 추천이 완료되었습니다!")
+                    st.session_state.recommendation = recommendation_text
+                    st.session_state.meal_plan = meal_plan
+                    st.session_state.candidates_df = candidates_mixed
 
             else:
                 st.error("프로필을 불러올 수 없습니다.")
@@ -280,9 +234,16 @@ with tab1:
             st.divider() # 구분선
             st.subheader(f"🎉 {profile['username']}님을 위한 AI 추천 식단")
         
+            # JSON 응답은 해석한 식단 객체로 그리고, 해석에 실패하면 AI가 보낸 Markdown 그대로 표시
+            meal_plan = st.session_state.meal_plan
+            if meal_plan:
+                recommendation_markdown = backend.meal_plan_to_markdown(meal_plan)
+            else:
+                recommendation_markdown = st.session_state.recommendation
+            
             # [수정 2]
             # AI가 보낸 줄바꿈(\n)을 Markdown 강제 줄바꿈(공백2개+\n)으로 변경
-            formatted_text = st.session_state.recommendation.replace('\n', '  \n')
+            formatted_text = recommendation_markdown.replace('\n', '  \n')
             st.markdown(formatted_text) 
         
             st.divider() # 다음 섹션 구분선
@@ -301,161 +262,123 @@ with tab1:
             candidates_df = st.session_state.get('candidates_df', pd.DataFrame())
 
             if not candidates_df.empty:
-                import re 
-                displayed_sno = set() 
+                if meal_plan:
+                    # JSON 응답: RCP_SNO로 이미 후보 행과 연결됨 (열량도 숫자로 받음)
+                    matches = meal_plan['meals']
+                else:
+                    # Markdown 응답: 하이브리드 매칭(원본 제목 -> 핵심 요리명) + 칼로리 파싱은 백엔드에서 수행
+                    matches = backend.match_recommended_recipes(rec_text, candidates_df)
+                displayed_sno = {match['row']['RCP_SNO'] for match in matches}
                 
-                for index, row in candidates_df.iterrows():
-                    
+                # [핵심] 조리법: DB에서 한 번에 확인 -> 없는 것만 동시에 생성 -> 한 번에 저장
+                with st.spinner("조리법을 준비하는 중입니다... 🍳"):
+                    with backend.db_connection() as conn:
+                        steps_by_id = backend.get_recipe_steps_batch(
+                            conn,
+                            backend.YOUR_API_KEY,
+                            [match['row'] for match in matches],
+                            user=profile['user_id']
+                        )
+                
+                for match in matches:
+                    row = match['row']
                     recipe_id = row['RCP_SNO']
-                    recipe_title_full = str(row['RCP_TTL']) # 1. 원본 제목 (예: "[단호박...]")
-                    clean_name = str(row['CKG_NM'])      # 2. 핵심 요리명 (예: "단호박에그슬럿")
-                    
-                    # --- [핵심] 하이브리드 매칭 ---
-                    match_found = False
-                    
-                    # 1. AI 응답에 '원본 제목'이 통째로 있는지 확인
-                    if recipe_title_full in rec_text:
-                        match_found = True
+                    recipe_title_full = str(row['RCP_TTL'])
+                    original_cal_str = match['calories']
                     
-                    # 2. 1번이 실패하면, '핵심 요리명'이 있는지 재확인
-                    #    (단, 요리명이 유효한 경우만)
-                    elif (pd.notna(clean_name) and len(clean_name) > 1) and (clean_name in rec_text):
-                        match_found = True
-                    # ------------------------------
-
-                    # 3. 둘 중 하나라도 성공하고, 아직 표시되지 않았다면
-                    if match_found and recipe_id not in displayed_sno:
-                        displayed_sno.add(recipe_id)
+                    with st.expander(f"**{recipe_title_full}** (상세보기)"):
+                        
+                        # (1) 재료 정보 표시
+                        st.markdown("##### 🥑 주요 재료")
+                        # (후보 행의 'ingredients' = 카탈로그 재료 사전에서 복원한 dict, JSON 파싱 없음)
+                        ingredients_dict = row.get('ingredients')
+                        if ingredients_dict:
+                            st.dataframe(pd.Series(ingredients_dict), width='stretch')
+                        else:
+                            st.text("재료 정보 없음")
+                            
+                        # (2) 조리법 (수정된 부분)
+                        st.markdown("##### 🍳 조리 순서")
+                        
+                        # (위에서 일괄로 준비한 조리법)
+                        st.write(steps_by_id.get(recipe_id, "조리법 정보를 불러올 수 없습니다.")) # 결과 출력
                         
-                        # 칼로리 파싱
-                        import re
-                        original_cal_str = "정보 없음"
+                        # (3) 기타 정보 표시
+                        st.markdown("#####  E.T.C")
+                        st.text(f"조리법: {row['CKG_MTH_ACTO_NM']} | 소요시간: {row['CKG_TIME_NM']} | 인분: {row['CKG_INBUN_NM']}")
                         
-                        try:
-                            # 1. 비교할 제목들 준비 (특수문자 이스케이프 처리)
-                            # AI가 원본 제목을 썼을 수도, 핵심 요리명만 썼을 수도 있음
-                            escaped_full_title = re.escape(recipe_title_full)
-                            escaped_clean_name = re.escape(clean_name)
+                        # -------------------------------------------------------
+                        # 동적 프롬포팅 AI 레시피 변형
+                        # -------------------------------------------------------
+                        st.divider()
+                        st.markdown("##### 💬 AI 레시피 변형 (Generative Mode)")
                             
-                            # 2. 정규표현식 패턴:
-                            # "제목" 뒤에 나오는 내용 중 가장 먼저 발견되는 "숫자+kcal" 패턴 찾기
-                            # [\d,]+ : 숫자와 쉼표(,)가 1개 이상 있음 (예: 1,000)
-                            # \s* : 공백이 0개 이상 있음
-                            # kcal   : 'kcal' 글자 (대소문자 무시)
+                        # 1. 변형 옵션 선택 (Selectbox + Custom Input)
+                        mod_option = st.selectbox(
+                            "어떻게 바꿔드릴까요?",
+                            [
+                                "선택하세요",
+                                "🥣 1인분으로 양 조절해줘",
+                                "🧂 저염식 버전으로 바꿔줘",
+                                "🍎 다이어트 버전으로 바꿔줘",
+                                "👶 아이도 먹을 수 있게 맵지 않게 해줘",
+                                "🍳 자취생용 초간단 버전으로 바꿔줘",
+                                "📝 (직접 입력)"
+                            ],
+                            key=f"mod_sel_{recipe_id}" # 고유 Key 필수
+                        )
                             
-                            # 우선순위 1: 원본 제목 뒤에서 찾기
-                            pattern_1 = rf"{escaped_full_title}.*?([\d,]+\s*kcal)"
-                            match = re.search(pattern_1, rec_text, re.DOTALL | re.IGNORECASE)
+                        custom_mod = ""
+                        if mod_option == "📝 (직접 입력)":
+                            custom_mod = st.text_input("원하는 요청사항을 입력하세요:", key=f"mod_txt_{recipe_id}")
+                        
+                        # 2. 변형 버튼
+                        if st.button("✨ AI로 레시피 다시 쓰기", key=f"mod_btn_{recipe_id}"):
+                            # 실제 요청 내용 결정
+                            final_request = custom_mod if mod_option == "📝 (직접 입력)" else mod_option
                             
-                            # 우선순위 2: 실패하면 핵심 요리명 뒤에서 찾기
-                            if not match:
-                                pattern_2 = rf"{escaped_clean_name}.*?([\d,]+\s*kcal)"
-                                match = re.search(pattern_2, rec_text, re.DOTALL | re.IGNORECASE)
+                            if final_request and final_request != "선택하세요":
+                                with st.spinner("AI가 새로운 레시피를 생성 중입니다... 🍳"):
+                                    # 백엔드 함수 호출
+                                    modified_result = backend.modify_recipe_with_gemini(
+                                        backend.YOUR_API_KEY,
+                                        recipe_title_full,
+                                        row.get('ingredients'),
+                                        final_request,
+                                        original_cal_str,
+                                        user=profile['user_id']
+                                    )
+                                    
+                                    if modified_result:
+                                        st.success("생성 완료!")
+                                        st.markdown("---")
+                                        st.markdown(modified_result) # 결과 출력
+                                    else:
+                                        st.error("변형에 실패했습니다. 다시 시도해주세요.")
+                            else:
+                                st.warning("변형 옵션을 선택하거나 입력해주세요.")
 
-                            if match:
-                                original_cal_str = match.group(1) # "500 kcal" 또는 "1,000kcal" 추출
-                                
-                        except Exception as e:
-                            print(f"칼로리 파싱 에러: {e}")
+                        # [기능 3] 보팅 버튼
+                        st.markdown("##### ⭐ 평가하기")
+                        key_like = f"like_{recipe_id}"
+                        key_dislike = f"dislike_{recipe_id}"
                         
-                        with st.expander(f"**{recipe_title_full}** (상세보기)"):
-                            
-                            # (1) 재료 정보 표시
-                            st.markdown("##### 🥑 주요 재료")
-                            try:
-                                ingredients_dict = json.loads(row['ingredients_json'])
-                                st.dataframe(pd.Series(ingredients_dict), width='stretch')
-                            except:
-                                st.text(row['ingredients_json'])
-                                
-                            # (2) 조리법 (수정된 부분)
-                            st.markdown("##### 🍳 조리 순서")
-                            
-                            # [핵심] DB 확인 -> 없으면 생성 -> 저장 -> 반환
-                            with sqlite3.connect(backend.DB_PATH) as conn:
-                                steps_text = backend.get_or_create_recipe_steps(
-                                    conn, 
-                                    backend.YOUR_API_KEY,
-                                    recipe_id,
-                                    recipe_title_full,
-                                    row['ingredients_json']
-                                )
-                            st.write(steps_text) # 결과 출력
-                            
-                            # (3) 기타 정보 표시
-                            st.markdown("#####  E.T.C")
-                            st.text(f"조리법: {row['CKG_MTH_ACTO_NM']} | 소요시간: {row['CKG_TIME_NM']} | 인분: {row['CKG_INBUN_NM']}")
-                            
-                            # -------------------------------------------------------
-                            # 동적 프롬포팅 AI 레시피 변형
-                            # -------------------------------------------------------
-                            st.divider()
-                            st.markdown("##### 💬 AI 레시피 변형 (Generative Mode)")
-                                
-                            # 1. 변형 옵션 선택 (Selectbox + Custom Input)
-                            mod_option = st.selectbox(
-                                "어떻게 바꿔드릴까요?",
-                                [
-                                    "선택하세요",
-                                    "🥣 1인분으로 양 조절해줘",
-                                    "🧂 저염식 버전으로 바꿔줘",
-                                    "🍎 다이어트 버전으로 바꿔줘",
-                                    "👶 아이도 먹을 수 있게 맵지 않게 해줘",
-                                    "🍳 자취생용 초간단 버전으로 바꿔줘",
-                                    "📝 (직접 입력)"
-                                ],
-                                key=f"mod_sel_{recipe_id}" # 고유 Key 필수
-                            )
-                                
-                            custom_mod = ""
-                            if mod_option == "📝 (직접 입력)":
-                                custom_mod = st.text_input("원하는 요청사항을 입력하세요:", key=f"mod_txt_{recipe_id}")
-                            
-                            # 2. 변형 버튼
-                            if st.button("✨ AI로 레시피 다시 쓰기", key=f"mod_btn_{recipe_id}"):
-                                # 실제 요청 내용 결정
-                                final_request = custom_mod if mod_option == "📝 (직접 입력)" else mod_option
+                        col1, col2, _ = st.columns([1, 1, 5])
+                        
+                        # [수정] 버튼 클릭 시 backend.queue_vote 함수 호출 (모아 쓰기 -> 클릭은 바로 끝남)
+                        if col1.button("👍 Like", key=key_like):
+                            backend.queue_vote(profile['user_id'], recipe_id, "Like")
+                            st.toast(f"'{recipe_title_full}' 👍 추천! (저장됨)")
                                 
-                                if final_request and final_request != "선택하세요":
-                                    with st.spinner("AI가 새로운 레시피를 생성 중입니다... 🍳"):
-                                        # 백엔드 함수 호출
-                                        modified_result = backend.modify_recipe_with_gemini(
-                                            backend.YOUR_API_KEY,
-                                            recipe_title_full,
-                                            row['ingredients_json'],
-                                            final_request,
-                                            original_cal_str
-                                        )
-                                        
-                                        if modified_result:
-                                            st.success("생성 완료!")
-                                            st.markdown("---")
-                                            st.markdown(modified_result) # 결과 출력
-                                        else:
-                                            st.error("변형에 실패했습니다. 다시 시도해주세요.")
-                                else:
-                                    st.warning("변형 옵션을 선택하거나 입력해주세요.")
-
-                            # [기능 3] 보팅 버튼
-                            st.markdown("##### ⭐ 평가하기")
-                            key_like = f"like_{recipe_id}"
-                            key_dislike = f"dislike_{recipe_id}"
-                            
-                            col1, col2, _ = st.columns([1, 1, 5])
-                            
-                            # [수정] 버튼 클릭 시 backend.save_vote 함수 호출
-                            if col1.button("👍 Like", key=key_like):
-                                with sqlite3.connect(backend.DB_PATH) as conn:
-                                    backend.save_vote(conn, profile['user_id'], recipe_id, "Like")
-                                st.toast(f"'{recipe_title_full}' 👍 추천! (저장됨)")
-                                    
-                            if col2.button("👎 Dislike", key=key_dislike):
-                                with sqlite3.connect(backend.DB_PATH) as conn:
-                                    backend.save_vote(conn, profile['user_id'], recipe_id, "Dislike")
-                                st.toast(f"'{recipe_title_full}' 👎 비추천 (저장됨)")
+                        if col2.button("👎 Dislike", key=key_dislike):
+                            backend.queue_vote(profile['user_id'], recipe_id, "Dislike")
+                            st.toast(f"'{recipe_title_full}' 👎 비추천 (저장됨)")
                 
                 # 4. 만약 7개 중 일부만 매칭되었다면 (디버깅)
-                if len(displayed_sno) < 7 and len(displayed_sno) > 0:
+                if meal_plan:
+                    if meal_plan['dropped']:
+                        st.warning(f"AI 응답 중 {meal_plan['dropped']}개 항목은 후보군에 없는 레시피라 제외했습니다.")
+                elif len(displayed_sno) < 7 and len(displayed_sno) > 0:
                     st.warning(f"AI가 7개를 추천했지만, {len(displayed_sno)}개만 후보군과 매칭되었습니다.")
                 elif len(displayed_sno) == 0:
                     st.error("AI가 추천한 레시피를 후보군(100개)과 매칭하는 데 실패했습니다.")
@@ -467,12 +390,12 @@ with tab1:
             st.subheader("🗓️ 7일 실천 리워드")
             
             # [수정] DB에서 현재 달성 횟수를 불러옴
-            with sqlite3.connect(backend.DB_PATH) as conn:
+            with backend.db_connection() as conn:
                 checked_count = backend.get_my_rewards(conn, profile['user_id'])
             
             tasks = [f"{i+1}일차: 식단 실천 완료" for i in range(7)]
             
-            # [수정] 체크박스를 누를 때마다 DB에 즉시 저장
+            # [수정] 체크박스를 누를 때마다 DB에 저장 (모아 쓰기)
             # (st.checkbox는 on_change 콜백을 지원함)
             def on_checkbox_change(user_id, i):
                 # on_change 콜백이 실행되는 시점에, st.session_state의 'key'에는
@@ -483,8 +406,8 @@ with tab1:
                     if st.session_state.get(f"task_{j}", False): # .get으로 안전하게 접근
                         current_checks += 1
                 
-                with sqlite3.connect(backend.DB_PATH) as conn:
-                    backend.save_reward(conn, user_id, current_checks)
+                # (연속으로 토글해도 사용자별 마지막 값만 모아서 저장)
+                backend.queue_reward(user_id, current_checks)
 
             cols = st.columns(4)
             for i, task in enumerate(tasks):
@@ -506,9 +429,6 @@ with tab1:
 
     except Exception as e:
         st.error(f"DB 연결 실패: {e}")
-    finally:
-        if 'conn' in locals() and conn:
-            conn.close()
             
             
 # --- 3B. [신규 가입] 탭 (체크박스 형태로 수정) ---
@@ -620,7 +540,7 @@ with tab3:
         # --- 2. 내가 '좋아요' 한 레시피 ---
         with col1:
             st.markdown("#### 👍 내가 '좋아요' 한 레시피")
-            with sqlite3.connect(backend.DB_PATH) as conn:
+            with backend.db_connection() as conn:
                 liked_recipes_df = backend.get_my_votes(conn, profile['user_id'])
             
             if liked_recipes_df.empty:
@@ -631,7 +551,7 @@ with tab3:
         # --- 3. 나의 '달성 기록' ---
         with col2:
             st.markdown("#### 🏆 나의 7일 달성 기록")
-            with sqlite3.connect(backend.DB_PATH) as conn:
+            with backend.db_connection() as conn:
                 current_rewards = backend.get_my_rewards(conn, profile['user_id'])
             
             st.metric(label="현재 달성일", value=f"{current_rewards} / 7 일")
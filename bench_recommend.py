@@ -0,0 +1,575 @@
+"""
+BobFit 추천 파이프라인 성능 측정 스크립트 (DB / API 키 없이 합성 데이터로 실행)
+
+사용법:
+    python bench_recommend.py matcher
+    python bench_recommend.py bitmap
+    python bench_recommend.py scoring
+    python bench_recommend.py inverted
+    python bench_recommend.py parity      # 역색인 정합성 검사만 (실패하면 종료 코드 1)
+    python bench_recommend.py lsa
+    python bench_recommend.py segments
+    python bench_recommend.py keywords
+    python bench_recommend.py breaker     # 서킷 브레이커 회복/집계 규칙 검사 (실패하면 종료 코드 1)
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import recommend_gemini as backend
+
+
+# --- 1. 합성 데이터 생성 ---
+
+def _all_restriction_keywords():
+    """RESTRICTION_MAP 전체 키워드 (중복 제거, 순서 고정)"""
+    keywords = set()
+    for values in backend.RESTRICTION_MAP.values():
+        keywords.update(values)
+    return sorted(keywords)
+
+def make_ingredient_jsons(n_recipes, seed=42):
+    """'국물용 멸치', '두부 1모' 같은 재료명을 흉내 낸 ingredients_json 목록 생성"""
+    rng = random.Random(seed)
+    base_words = _all_restriction_keywords() + [
+        '대파', '양파', '마늘', '감자', '당근', '애호박', '시금치', '버섯', '쌀', '김치',
+        '소금', '설탕', '참기름', '들기름', '후추', '고춧가루', '식초', '물엿', '깨', '부추',
+    ]
+    prefixes = ['', '', '', '국물용 ', '다진 ', '손질한 ', '냉동 ', '무염 ']
+    jsons = []
+    for _ in range(n_recipes):
+        names = {
+            rng.choice(prefixes) + rng.choice(base_words): f"{rng.randint(1, 3)}개"
+            for _ in range(rng.randint(4, 12))
+        }
+        jsons.append(json.dumps(names, ensure_ascii=False))
+    return jsons
+
+
+def make_temp_db(n_recipes, seed=42):
+    """합성 recipes 테이블을 가진 임시 SQLite DB를 만들고 backend.DB_PATH를 그쪽으로 돌림"""
+    rng = random.Random(seed)
+    db_dir = tempfile.mkdtemp(prefix="bobfit_bench_")
+    db_path = os.path.join(db_dir, "recipe_db.sqlite")
+    conn = sqlite3.connect(db_path)
+    conn.execute("""
+    CREATE TABLE recipes (
+        RCP_SNO INTEGER PRIMARY KEY, RCP_TTL TEXT, CKG_NM TEXT, CKG_MTH_ACTO_NM TEXT,
+        CKG_TIME_NM TEXT, CKG_INBUN_NM TEXT, ingredients_json TEXT,
+        estimated_price INTEGER, recipe_steps TEXT
+    )""")
+    dishes = ['된장찌개', '김치볶음밥', '계란말이', '잡채', '떡볶이', '국수', '파스타', '샐러드', '비빔밥', '전골']
+    times = ['5분이내', '10분이내', '15분이내', '30분이내', '60분이내', '90분이내', '2시간이내', '2시간이상']
+    rows = []
+    for i, js in enumerate(make_ingredient_jsons(n_recipes, seed=seed)):
+        dish = rng.choice(dishes)
+        rows.append((
+            i + 1, f"[{dish}] 초간단 {dish} {i}", dish, rng.choice(['볶음', '끓이기', '찜', '무침']),
+            rng.choice(times), f"{rng.randint(1, 4)}인분", js, rng.choice([0, 5000, 12000, 30000]), None,
+        ))
+    conn.executemany("INSERT INTO recipes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+    conn.commit()
+    conn.close()
+    backend.DB_PATH = db_path
+    return db_path
+
+@contextlib.contextmanager
+def quiet():
+    """백엔드의 진행 로그(print)를 잠시 숨김"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+BENCH_PROFILE = {
+    'username': '벤치', 'preferences': '두부, 대파, 김치', 'goals': '단백질 섭취 버섯',
+    'restrictions_allergies': '없음', 'restrictions_other': '없음', 'budget': 0,
+}
+
+def _median_ms(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return timings[len(timings) // 2] * 1000
+
+
+# --- 2. 금지 재료 매처 벤치마크 ---
+
+def _legacy_is_safe(ingredient_names, restrictions):
+    """(비교용) 기존 '키워드 x 재료명' 이중 루프"""
+    for restriction in restrictions:
+        for name in ingredient_names:
+            if restriction in name:
+                return False
+    return True
+
+def _time_filter(jsons, restrictions, use_matcher):
+    parsed = [list(json.loads(js).keys()) for js in jsons]
+    start = time.perf_counter()
+    if use_matcher:
+        matcher = backend.get_restriction_matcher(restrictions)
+        safe = [not matcher.search(backend.INGREDIENT_SEPARATOR.join(names)) for names in parsed]
+    else:
+        safe = [_legacy_is_safe(names, restrictions) for names in parsed]
+    return time.perf_counter() - start, sum(safe)
+
+def bench_matcher(args):
+    keywords = _all_restriction_keywords()
+    rng = random.Random(0)
+
+    print(f"[1] 키워드 수에 따른 변화 (레시피 {args.recipes:,}개)")
+    print(f"{'keywords':>9} {'legacy(ms)':>11} {'matcher(ms)':>12} {'speedup':>8}")
+    jsons = make_ingredient_jsons(args.recipes)
+    for k in (5, 20, 50, 100, 200, len(keywords)):
+        restrictions = rng.sample(keywords, min(k, len(keywords)))
+        legacy_t, legacy_safe = _time_filter(jsons, restrictions, use_matcher=False)
+        matcher_t, matcher_safe = _time_filter(jsons, restrictions, use_matcher=True)
+        assert legacy_safe == matcher_safe, "매처 결과가 기존 로직과 다릅니다!"
+        print(f"{len(restrictions):>9} {legacy_t * 1000:>11.1f} {matcher_t * 1000:>12.1f} {legacy_t / matcher_t:>7.1f}x")
+
+    restrictions = rng.sample(keywords, min(100, len(keywords)))
+    print(f"\n[2] 레시피 수에 따른 변화 (키워드 {len(restrictions)}개)")
+    print(f"{'recipes':>9} {'legacy(ms)':>11} {'matcher(ms)':>12} {'speedup':>8}")
+    for n in sorted({1_000, 5_000, 20_000, args.recipes * 4}):
+        jsons = make_ingredient_jsons(n)
+        legacy_t, legacy_safe = _time_filter(jsons, restrictions, use_matcher=False)
+        matcher_t, matcher_safe = _time_filter(jsons, restrictions, use_matcher=True)
+        assert legacy_safe == matcher_safe, "매처 결과가 기존 로직과 다릅니다!"
+        print(f"{n:>9,} {legacy_t * 1000:>11.1f} {matcher_t * 1000:>12.1f} {legacy_t / matcher_t:>7.1f}x")
+
+
+# --- 3. 금지 재료 비트맵 인덱스 벤치마크 ---
+
+def _vegan_restrictions():
+    profile = {'restrictions_allergies': '갑각류, 복숭아 통조림', 'restrictions_other': '비건'}
+    return backend.parse_restrictions(profile)
+
+def bench_bitmap(args):
+    import pandas as pd
+
+    jsons = make_ingredient_jsons(args.recipes)
+    recipes_df = pd.DataFrame({'RCP_SNO': range(len(jsons)), 'ingredients_json': jsons})
+    restrictions = _vegan_restrictions()
+
+    start = time.perf_counter()
+    index = backend.RestrictionIndex.from_frame(recipes_df)
+    build_t = time.perf_counter() - start
+    print(f"인덱스 생성 (레시피 {args.recipes:,}개, 카탈로그 버전당 1회): {build_t * 1000:.1f} ms")
+
+    # 첫 요청: 맵에 없는 자유 입력 키워드를 스캔해서 인덱스에 메모이즈
+    start = time.perf_counter()
+    index.blocked_mask(restrictions)
+    first_t = time.perf_counter() - start
+
+    timings = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        blocked = index.blocked_mask(restrictions)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+
+    matcher_t, matcher_safe = _time_filter(jsons, restrictions, use_matcher=True)
+    assert matcher_safe == int((~blocked).sum()), "비트맵 결과가 매처 스캔과 다릅니다!"
+
+    print(f"금지 키워드 {len(restrictions)}개 -> 안전한 레시피 {matcher_safe:,}개")
+    print(f"  첫 요청 (자유 입력 메모이즈 포함): {first_t * 1000:.2f} ms")
+    print(f"  비트맵 OR + NOT (중앙값):          {timings[len(timings) // 2] * 1000:.3f} ms")
+    print(f"  (비교) 매처로 전체 스캔:            {matcher_t * 1000:.1f} ms")
+
+
+# --- 4. 후보군 채점 (쿼리별 호출 vs 배치) 벤치마크 ---
+
+def bench_scoring(args):
+    make_temp_db(args.recipes)
+    with quiet():
+        conn = sqlite3.connect(backend.DB_PATH)
+        filtered = backend.recommend_recipes_by_filter(conn, BENCH_PROFILE, [])
+        conn.close()
+        backend.get_tfidf_index() # 인덱스 학습/로드는 측정에서 제외
+
+    print(f"레시피 {len(filtered):,}개, 쿼리당 top_n={args.top_n}")
+    print(f"{'queries':>8} {'separate(ms)':>13} {'batch(ms)':>10} {'speedup':>8}")
+    variants = ["", "국물 찌개 김치", "매운 고추장", "간편식 계란", "버섯 두부"]
+    for n_queries in range(1, len(variants) + 1):
+        queries = variants[:n_queries]
+
+        def separate():
+            with quiet():
+                for keywords in queries:
+                    backend.get_smart_candidates(BENCH_PROFILE, filtered, top_n=args.top_n, dynamic_keywords=keywords)
+
+        def batch():
+            with quiet():
+                backend.get_smart_candidates_batch(BENCH_PROFILE, filtered, queries, top_n=args.top_n)
+
+        separate_ms = _median_ms(separate, args.repeat)
+        batch_ms = _median_ms(batch, args.repeat)
+        print(f"{n_queries:>8} {separate_ms:>13.1f} {batch_ms:>10.1f} {separate_ms / batch_ms:>7.1f}x")
+
+
+# --- 5. 역색인 top-k 검색 (정확성 + 속도) ---
+
+def _reference_top_k(tfidf_index, query_vector, allowed_positions, k):
+    """(기준) 기존 sklearn 방식: 허용된 행 전체와 cosine_similarity 후 정렬"""
+    from sklearn.metrics.pairwise import cosine_similarity
+    sims = cosine_similarity(query_vector, tfidf_index.rows(allowed_positions))[0]
+    order = np.lexsort((np.arange(len(sims)), -sims))[:k]
+    return allowed_positions[order], sims[order]
+
+SCORE_TOLERANCE = 1e-6
+
+def check_inverted_parity(n_recipes=20_000, n_queries=200, k=20, seed=7):
+    """
+    역색인 검색 결과가 기존 sklearn 코사인 순위와 같은지 검사합니다.
+    (TF-IDF 행렬이 float32이고 합산 순서도 달라서, 점수 차이가 SCORE_TOLERANCE 이내인
+     '사실상 동점'끼리는 순서가 바뀌어도 허용)
+    """
+    make_temp_db(n_recipes)
+    with quiet():
+        catalog = backend.get_recipe_catalog()
+        tfidf_index = backend.get_tfidf_index(catalog)
+    inverted = tfidf_index.inverted
+    rng = random.Random(seed)
+    vocabulary = tfidf_index.vocabulary
+    restriction_sets = [[]] + [rng.sample(_all_restriction_keywords(), rng.randint(5, 80)) for _ in range(5)]
+
+    for _ in range(n_queries):
+        words = rng.sample(vocabulary, rng.randint(1, min(30, len(vocabulary))))
+        query_vector = tfidf_index.transform([" ".join(words * rng.randint(1, 3))])
+        allow = ~catalog.restriction_index.blocked_mask(rng.choice(restriction_sets))
+        query_k = rng.choice([1, 5, k, 100])
+
+        expected_rows, expected_scores = _reference_top_k(tfidf_index, query_vector, np.flatnonzero(allow), query_k)
+        got_rows, got_scores = inverted.search(query_vector, query_k, allow)
+
+        assert len(got_rows) == len(expected_rows), "역색인 결과 개수가 다릅니다!"
+        assert np.allclose(got_scores, expected_scores, rtol=0, atol=SCORE_TOLERANCE), "역색인 점수가 기존 코사인 점수와 다릅니다!"
+        # 순서가 다른 자리는 '사실상 동점'이어야 하고, k등 점수보다 확실히 높은 행들은 정확히 같아야 함
+        differs = got_rows != expected_rows
+        assert np.allclose(got_scores[differs], expected_scores[differs], rtol=0, atol=SCORE_TOLERANCE)
+        if len(expected_scores):
+            cutoff = expected_scores[-1] + SCORE_TOLERANCE
+            assert set(got_rows[got_scores > cutoff]) == set(expected_rows[expected_scores > cutoff]), \
+                "역색인 top-k가 기존 코사인 순위와 다릅니다!"
+    print(f"✅ 정합성 검사 통과: 쿼리 {n_queries}개 (레시피 {n_recipes:,}개, 허용 마스크 {len(restriction_sets)}종)")
+
+def run_parity(args):
+    """역색인 정합성 검사만 실행 (CI 등에서 단독 실행, 불일치면 종료 코드 1)"""
+    try:
+        check_inverted_parity(n_recipes=args.recipes, n_queries=args.queries)
+    except AssertionError as e:
+        print(f"❌ 정합성 검사 실패: {e}")
+        sys.exit(1)
+
+def bench_inverted(args):
+    check_inverted_parity(n_recipes=min(args.recipes, 20_000))
+
+    make_temp_db(args.recipes)
+    with quiet():
+        conn = sqlite3.connect(backend.DB_PATH)
+        filtered = backend.recommend_recipes_by_filter(conn, BENCH_PROFILE, backend.RESTRICTION_MAP['해산물'])
+        conn.close()
+        backend.get_tfidf_index().inverted # 인덱스 생성은 측정에서 제외
+
+    print(f"\n레시피 {args.recipes:,}개 중 허용 {len(filtered):,}개, 쿼리 2개(프로필 / 프로필+키워드), top_n={args.top_n}")
+    for ranking in ('tfidf', 'inverted'):
+        def run():
+            with quiet():
+                backend.get_smart_candidates_batch(
+                    BENCH_PROFILE, filtered, ["", "국물 김치 두부"], top_n=args.top_n, ranking=ranking
+                )
+        print(f"  {ranking:>8}: {_median_ms(run, args.repeat):.1f} ms")
+
+
+# --- 6. 채점 방식별 지연시간 + 메모리 (tfidf / inverted / lsa) ---
+
+def bench_lsa(args):
+    make_temp_db(args.recipes)
+    with quiet():
+        catalog = backend.get_recipe_catalog()
+        tfidf_index = backend.get_tfidf_index(catalog)
+        tfidf_index.inverted
+        start = time.perf_counter()
+        backend.build_lsa_index(catalog, args.components)
+        lsa_build_s = time.perf_counter() - start
+        conn = sqlite3.connect(backend.DB_PATH)
+        filtered = backend.recommend_recipes_by_filter(conn, BENCH_PROFILE, [])
+        conn.close()
+
+    matrix = tfidf_index.matrix
+    inverted = tfidf_index.inverted
+    lsa_index = backend.get_lsa_index(catalog)
+    memory_mb = {
+        'tfidf': (matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes) / 1024 / 1024,
+        'inverted': (inverted.postings_rows.nbytes + inverted.postings_weights.nbytes
+                     + inverted.postings_ptr.nbytes) / 1024 / 1024,
+        'lsa': lsa_index.vectors.nbytes / 1024 / 1024,
+    }
+
+    print(f"레시피 {len(filtered):,}개, 쿼리 2개(프로필 / 프로필+키워드), top_n={args.top_n}, "
+          f"LSA {lsa_index.vectors.shape[1]}차원 (오프라인 생성 {lsa_build_s:.1f} s)")
+    print(f"{'ranking':>9} {'latency(ms)':>12} {'index(MB)':>10}")
+    for ranking in ('tfidf', 'inverted', 'lsa'):
+        def run():
+            with quiet():
+                backend.get_smart_candidates_batch(
+                    BENCH_PROFILE, filtered, ["", "국물 찌개 얼큰한"], top_n=args.top_n, ranking=ranking
+                )
+        print(f"{ranking:>9} {_median_ms(run, args.repeat):>12.1f} {memory_mb[ranking]:>10.1f}")
+
+
+# --- 7. 새 레시피 추가 시 인덱스 갱신 (delta 세그먼트 vs 전체 재생성) ---
+
+def _insert_recipes(db_path, n_recipes, first_sno, seed):
+    """make_temp_db와 같은 형식의 레시피 n개를 추가 (RCP_SNO는 first_sno부터)"""
+    conn = sqlite3.connect(db_path)
+    rows = [
+        (first_sno + i, f"[신메뉴] 추가 레시피 {i}", '국수', '볶음', '30분이내', '1인분', js, 5000)
+        for i, js in enumerate(make_ingredient_jsons(n_recipes, seed=seed))
+    ]
+    conn.executemany(
+        "INSERT INTO recipes (RCP_SNO, RCP_TTL, CKG_NM, CKG_MTH_ACTO_NM, CKG_TIME_NM, CKG_INBUN_NM, "
+        "ingredients_json, estimated_price) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows
+    )
+    conn.commit()
+    conn.close()
+
+def _refresh_indexes():
+    """요청 1건이 보는 것과 같은 순서로 카탈로그 -> 금지 재료 비트맵 -> TF-IDF(+역색인) 갱신"""
+    catalog = backend.get_recipe_catalog()
+    catalog.restriction_index.blocked_mask(_vegan_restrictions())
+    tfidf_index = backend.get_tfidf_index(catalog)
+    tfidf_index.inverted, tfidf_index.delta_inverted
+    return catalog, tfidf_index
+
+def bench_segments(args):
+    db_path = make_temp_db(args.recipes)
+    backend.SEGMENT_MERGE_MIN_ROWS = 10 ** 9 # 측정 중에는 백그라운드 병합 X
+    with quiet():
+        _refresh_indexes()
+
+    print(f"레시피 {args.recipes:,}개에 새 레시피 추가 후 첫 요청의 인덱스 갱신 시간")
+    print(f"{'added':>7} {'delta(ms)':>10} {'full(ms)':>9} {'speedup':>8}")
+    next_sno = args.recipes + 1
+    for n_added in (1, 10, 100, 1000):
+        _insert_recipes(db_path, n_added, next_sno, seed=n_added)
+        next_sno += n_added
+        with quiet():
+            start = time.perf_counter()
+            catalog, tfidf_index = _refresh_indexes()
+            delta_ms = (time.perf_counter() - start) * 1000
+
+            # 정합성: delta 세그먼트까지 합친 역색인 top-k == 전체 행과 내적 후 정렬
+            allow = ~catalog.restriction_index.blocked_mask(_vegan_restrictions())
+            query_vector = tfidf_index.transform(["두부 대파 김치 버섯 " * 2])
+            allowed = np.flatnonzero(allow)
+            sims = (tfidf_index.rows(allowed) @ query_vector.T).toarray().ravel()
+            expected = np.sort(sims)[::-1][:args.top_n]
+            _, got = tfidf_index.search(query_vector, args.top_n, allow)
+            assert np.allclose(got, expected, rtol=0, atol=SCORE_TOLERANCE), "delta 세그먼트 검색 결과가 다릅니다!"
+
+            # (비교) 캐시를 비우고 전체 다시 읽기 + 재학습
+            backend._CATALOG_CACHE.clear()
+            backend._TFIDF_CACHE.clear()
+            shutil.rmtree(backend.get_index_dir(catalog.db_file), ignore_errors=True)
+            start = time.perf_counter()
+            _refresh_indexes()
+            full_ms = (time.perf_counter() - start) * 1000
+        print(f"{n_added:>7,} {delta_ms:>10.1f} {full_ms:>9.1f} {full_ms / delta_ms:>7.1f}x")
+
+
+# --- 8. 자율 입력 키워드 확장 (로컬 사전 처리율 + 메모 적중률) ---
+
+# 앱에 실제로 들어올 법한 자율 입력 (앞쪽일수록 자주 나옴)
+SAMPLE_FREE_TEXTS = [
+    "비 와서 국물 땡겨", "면류가 먹고 싶어", "스트레스 받아서 매운거", "간단하게 먹고 싶어",
+    "다이어트 중이라 가볍게", "오늘은 김치볶음밥 해줘", "고기 먹고 싶다", "더워서 시원한 거",
+    "두부랑 계란으로 뭔가 만들어줘", "달달한 디저트", "엄마가 해주던 그 맛", "퇴근하고 혼술 안주",
+    "해산물 요리 추천해줘", "든든하게 밥", "비 오니까 따뜻한 국물 땡겨",
+]
+
+def bench_keywords(args):
+    make_temp_db(args.recipes)
+    rng = random.Random(3)
+    weights = [1 / (rank + 1) for rank in range(len(SAMPLE_FREE_TEXTS))] # 자주 나오는 요청에 치우친 분포
+    requests = rng.choices(SAMPLE_FREE_TEXTS, weights=weights, k=args.requests)
+    with quiet():
+        backend.get_keyword_expander() # 사전 준비(카탈로그 로드) 시간은 제외
+    
+    print(f"자율 입력 {len(SAMPLE_FREE_TEXTS)}종, 요청 {args.requests:,}건 (레시피 {args.recipes:,}개 카탈로그 사전)")
+    print(f"{'input':<24} {'result':<8} keywords")
+    with quiet():
+        results = {text: backend.expand_keywords_locally(text) for text in SAMPLE_FREE_TEXTS}
+    for text, keywords in results.items():
+        print(f"{text:<24} {'local' if keywords is not None else 'gemini':<8} {keywords or ''}")
+    
+    backend._KEYWORD_STATS.update(requests=0, memo_hits=0, local=0, llm=0)
+    with quiet():
+        start = time.perf_counter()
+        for text in requests:
+            backend.expand_keywords_locally(text)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+    stats = backend.keyword_expansion_stats()
+    print(f"\n로컬 처리율 {stats['local_rate']:.1%} (Gemini 호출 {stats['llm']:,}건 / {stats['requests']:,}건), "
+          f"메모 적중률 {stats['memo_hit_rate']:.1%}, 요청당 {elapsed_ms / len(requests):.3f}ms")
+
+
+# --- 9. Gemini 서킷 브레이커 회복 검사 (가짜 클라이언트, API 키 없이) ---
+
+class _FakeGeminiClient:
+    """generate()가 정해둔 오류를 내거나 'ok'를 돌려주는 가짜 Gemini 클라이언트"""
+    model_name = "fake-gemini"
+    timeout = None
+    
+    def __init__(self, error=None):
+        self.error = error
+    
+    def generate(self, prompt, timeout=None, **kwargs):
+        if self.error is not None:
+            raise self.error
+        return "ok"
+
+def check_breaker_recovery(cooldown=0.05):
+    """
+    half-open 시험 호출이 속도 제한 대기 시간 초과로 끝나도 브레이커가 half-open에 갇히지 않는지 검사
+    (open -> 대기 -> 시험 호출이 순서를 못 받고 시간 초과 -> 다음 호출이 다시 시험 호출로 허용 -> 성공하면 closed)
+    """
+    saved = backend._GEMINI_BREAKER, backend._GEMINI_RATE_LIMITER
+    breaker = backend._GEMINI_BREAKER = backend.CircuitBreaker(threshold=1, cooldown=cooldown, name="bench")
+    backend._GEMINI_RATE_LIMITER = backend.GeminiRateLimiter(rate_per_minute=6000, burst=10, background_reserve=0)
+    try:
+        with quiet():
+            with contextlib.suppress(TimeoutError):
+                backend.generate_with_retry(_FakeGeminiClient(TimeoutError("fake")), "p", label="bench")
+        assert breaker.state == "open", "실패 후 브레이커가 열리지 않았습니다!"
+        
+        time.sleep(cooldown)
+        backend._GEMINI_RATE_LIMITER = backend.GeminiRateLimiter(rate_per_minute=1, burst=1, background_reserve=0)
+        backend._GEMINI_RATE_LIMITER.acquire(backend.PRIORITY_INTERACTIVE) # 토큰을 비워서 다음 호출이 시간 초과되게
+        with quiet():
+            with contextlib.suppress(backend.GeminiRateLimitTimeout):
+                backend.generate_with_retry(_FakeGeminiClient(), "p", deadline=0.01, label="bench")
+        assert breaker.state == "half_open", f"시간 초과 후 브레이커 상태가 이상합니다: {breaker.state}"
+        
+        backend._GEMINI_RATE_LIMITER = backend.GeminiRateLimiter(rate_per_minute=6000, burst=10, background_reserve=0)
+        with quiet():
+            try:
+                response = backend.generate_with_retry(_FakeGeminiClient(), "p", label="bench")
+            except backend.GeminiUnavailableError:
+                response = None
+        assert response == "ok" and breaker.state == "closed", "시험 호출 자리가 반납되지 않아 브레이커가 half-open에 갇혔습니다!"
+    finally:
+        backend._GEMINI_BREAKER, backend._GEMINI_RATE_LIMITER = saved
+    print("✅ 브레이커 검사 통과: 속도 제한 시간 초과 후에도 half-open 시험 호출이 다시 허용됨")
+
+def check_breaker_ignores_non_transient(cooldown=0.05):
+    """
+    일시 오류가 아닌 오류(잘못된 요청, 클라이언트 코드 버그 등)가 브레이커 상태를 바꾸지 않는지 검사
+    - closed: 연속 실패 횟수를 초기화하지 않음 / half-open: 닫지 않고 시험 호출 자리만 반납
+    - 스트리밍 결과 기록(record_stream_result)도 같은 규칙
+    """
+    saved = backend._GEMINI_BREAKER, backend._GEMINI_RATE_LIMITER
+    breaker = backend._GEMINI_BREAKER = backend.CircuitBreaker(threshold=2, cooldown=cooldown, name="bench")
+    backend._GEMINI_RATE_LIMITER = backend.GeminiRateLimiter(rate_per_minute=6000, burst=10, background_reserve=0)
+    transient, local_bug = _FakeGeminiClient(TimeoutError("fake")), _FakeGeminiClient(TypeError("fake"))
+    try:
+        with quiet():
+            with contextlib.suppress(TimeoutError):
+                backend.generate_with_retry(transient, "p", deadline=0.01, label="bench")
+            with contextlib.suppress(TypeError):
+                backend.generate_with_retry(local_bug, "p", label="bench")
+        assert breaker.consecutive_failures == 1, "일시 오류가 아닌 오류가 연속 실패 횟수를 초기화했습니다!"
+        
+        with quiet():
+            with contextlib.suppress(TimeoutError):
+                backend.generate_with_retry(transient, "p", deadline=0.01, label="bench")
+            time.sleep(cooldown)
+            with contextlib.suppress(TypeError):
+                backend.generate_with_retry(local_bug, "p", label="bench")
+        assert breaker.state == "half_open", f"일시 오류가 아닌 오류가 half-open 브레이커를 바꿨습니다: {breaker.state}"
+        
+        with quiet():
+            assert breaker.allow(), "시험 호출 자리가 반납되지 않았습니다!"
+            backend.record_stream_result(TypeError("fake"))
+            assert breaker.state == "half_open" and breaker.allow(), "스트리밍 중 일시 오류가 아닌 오류가 브레이커를 바꿨습니다!"
+            backend.record_stream_result(TimeoutError("fake"))
+        assert breaker.state == "open", "스트리밍 중 일시 오류가 브레이커 실패로 집계되지 않았습니다!"
+    finally:
+        backend._GEMINI_BREAKER, backend._GEMINI_RATE_LIMITER = saved
+    print("✅ 브레이커 검사 통과: 일시 오류가 아닌 오류는 브레이커에 집계되지 않음 (스트리밍 포함)")
+
+def run_breaker_check(args):
+    """브레이커 회복 검사만 실행 (실패하면 종료 코드 1)"""
+    try:
+        check_breaker_recovery()
+        check_breaker_ignores_non_transient()
+    except AssertionError as e:
+        print(f"❌ 브레이커 검사 실패: {e}")
+        sys.exit(1)
+
+
+# --- 10. 실행 ---
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="BobFit 추천 파이프라인 벤치마크")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    p_matcher = subparsers.add_parser("matcher", help="금지 재료 매처 (기존 이중 루프 vs Aho-Corasick)")
+    p_matcher.add_argument("--recipes", type=int, default=10_000)
+    p_matcher.set_defaults(func=bench_matcher)
+
+    p_bitmap = subparsers.add_parser("bitmap", help="금지 재료 비트맵 인덱스 (1차 필터링)")
+    p_bitmap.add_argument("--recipes", type=int, default=100_000)
+    p_bitmap.add_argument("--repeat", type=int, default=50)
+    p_bitmap.set_defaults(func=bench_bitmap)
+
+    p_scoring = subparsers.add_parser("scoring", help="후보군 채점 (쿼리별 get_smart_candidates vs 배치)")
+    p_scoring.add_argument("--recipes", type=int, default=50_000)
+    p_scoring.add_argument("--top-n", type=int, default=20)
+    p_scoring.add_argument("--repeat", type=int, default=10)
+    p_scoring.set_defaults(func=bench_scoring)
+
+    p_inverted = subparsers.add_parser("inverted", help="역색인 top-k (기존 코사인 순위와 정합성 검사 + 속도)")
+    p_inverted.add_argument("--recipes", type=int, default=100_000)
+    p_inverted.add_argument("--top-n", type=int, default=20)
+    p_inverted.add_argument("--repeat", type=int, default=10)
+    p_inverted.set_defaults(func=bench_inverted)
+
+    p_parity = subparsers.add_parser("parity", help="역색인 top-k vs 기존 sklearn 코사인 순위 정합성 검사 (실패 시 종료 코드 1)")
+    p_parity.add_argument("--recipes", type=int, default=3_000)
+    p_parity.add_argument("--queries", type=int, default=200)
+    p_parity.set_defaults(func=run_parity)
+
+    p_lsa = subparsers.add_parser("lsa", help="채점 방식별 지연시간/메모리 (tfidf vs inverted vs lsa)")
+    p_lsa.add_argument("--recipes", type=int, default=100_000)
+    p_lsa.add_argument("--components", type=int, default=backend.LSA_COMPONENTS)
+    p_lsa.add_argument("--top-n", type=int, default=20)
+    p_lsa.add_argument("--repeat", type=int, default=10)
+    p_lsa.set_defaults(func=bench_lsa)
+
+    p_segments = subparsers.add_parser("segments", help="새 레시피 추가 후 인덱스 갱신 (delta 세그먼트 vs 전체 재생성)")
+    p_segments.add_argument("--recipes", type=int, default=100_000)
+    p_segments.add_argument("--top-n", type=int, default=20)
+    p_segments.set_defaults(func=bench_segments)
+
+    p_keywords = subparsers.add_parser("keywords", help="자율 입력 키워드 확장 (로컬 처리율/메모 적중률)")
+    p_keywords.add_argument("--recipes", type=int, default=10_000)
+    p_keywords.add_argument("--requests", type=int, default=1_000)
+    p_keywords.set_defaults(func=bench_keywords)
+
+    p_breaker = subparsers.add_parser("breaker", help="Gemini 서킷 브레이커 회복/집계 규칙 검사 (실패 시 종료 코드 1)")
+    p_breaker.set_defaults(func=run_breaker_check)
+
+    args = parser.parse_args()
+    args.func(args)
@@ -5,16 +5,56 @@ import os # 1. os 임포트
 from dotenv import load_dotenv # 2. load_dotenv 임포트
 import google.generativeai as genai # Gemini API 라이브러리
 import random
+import re
+import functools
+import contextlib
+import copy
+import hashlib
+import unicodedata
+import threading
+import shutil
+import sys
+import time
+import argparse
+import atexit
+import asyncio
+import heapq
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
 
-from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.feature_extraction.text import TfidfVectorizer, TfidfTransformer
 from sklearn.metrics.pairwise import cosine_similarity
+from sklearn.decomposition import TruncatedSVD
 import numpy as np
+from scipy import sparse
 
 # --- 1. 설정 ---
 DB_PATH = 'recipe_db.sqlite'
+DB_BUSY_TIMEOUT_MS = int(os.getenv("BOBFIT_DB_BUSY_TIMEOUT_MS", "5000")) # 잠금을 기다리는 최대 시간(ms)
+WRITE_BEHIND_INTERVAL = float(os.getenv("BOBFIT_WRITE_BEHIND_INTERVAL", "0.5")) # 투표/리워드 모아 쓰기 주기(초), 0이면 즉시 저장
 
 YOUR_API_KEY = os.getenv("GEMINI_API_KEY")
 
+# Gemini 클라이언트 설정 (환경변수로 덮어쓰기 가능)
+GEMINI_MODEL_NAME = os.getenv("BOBFIT_GEMINI_MODEL", 'models/gemini-flash-latest')
+GEMINI_REQUEST_TIMEOUT = float(os.getenv("BOBFIT_GEMINI_TIMEOUT", "90")) # 요청당 기본 제한 시간(초)
+GEMINI_API_ENDPOINT = os.getenv("BOBFIT_GEMINI_ENDPOINT") or None # 예: "localhost:8080" (로컬 가짜 서버)
+GEMINI_TRANSPORT = os.getenv("BOBFIT_GEMINI_TRANSPORT") or None # "grpc"(기본) / "rest"
+# 재시도/서킷 브레이커 (일시 오류 429/500/503/504만 재시도, 요청 하나당 전체 제한 시간 안에서만)
+GEMINI_CALL_DEADLINE = float(os.getenv("BOBFIT_GEMINI_DEADLINE", "120")) # 재시도 포함 요청 하나의 전체 시간(초)
+GEMINI_MAX_ATTEMPTS = int(os.getenv("BOBFIT_GEMINI_MAX_ATTEMPTS", "4"))
+GEMINI_BACKOFF_BASE = 0.5 # 초 (0.5, 1, 2, 4...초 안에서 무작위)
+GEMINI_BACKOFF_MAX = 8.0
+GEMINI_BREAKER_THRESHOLD = 5 # 연속 실패 n번이면 차단(open)
+GEMINI_BREAKER_COOLDOWN = 30.0 # 차단 후 n초 지나면 한 번 시험 호출(half-open)
+# 호출 속도 제한 (토큰 버킷, 우선순위 큐). RPM 0이면 제한 없음
+GEMINI_RATE_LIMIT_RPM = float(os.getenv("BOBFIT_GEMINI_RPM", "60")) # 분당 요청 수
+GEMINI_RATE_LIMIT_BURST = int(os.getenv("BOBFIT_GEMINI_BURST", "10")) # 한꺼번에 보낼 수 있는 요청 수
+GEMINI_RATE_LIMIT_DB = os.getenv("BOBFIT_GEMINI_RATE_DB") or None # 지정하면 여러 프로세스가 이 SQLite 파일로 버킷 공유
+# 식단 응답 형식: "json"(RCP_SNO 기준 구조화 응답, 기본) / "markdown"(예전 방식, 제목 매칭)
+RECOMMENDATION_OUTPUT_FORMAT = os.getenv("BOBFIT_RECOMMENDATION_FORMAT", "json")
+
 # ----------------------------------------------------
 # [★] 추천받을 사용자를 ID로 선택하세요 (1~5)
 # (1: 김다이어트, 2: 박벌크업, 3: 이채식, 4: 최바쁨, 5: 오영양)
@@ -23,6 +63,136 @@ TARGET_USER_ID = 2
 
 # --- 2. DB 접근 및 프로필 파싱 함수 ---
 
+# -----------------------------------------------------------------
+# [신규 추가] SQLite 연결 관리 (스레드별 재사용 + WAL)
+# -----------------------------------------------------------------
+# app.py / 백엔드가 매번 sqlite3.connect()로 새로 여닫던 것을, 스레드마다 DB 파일별 연결 1개를 만들어 재사용합니다.
+# (sqlite 연결은 만든 스레드에서만 쓸 수 있으므로 스레드별)
+#   - WAL 저널: 쓰는 중에도 다른 연결이 읽을 수 있음 (기본 rollback 저널은 읽기가 쓰기 뒤에 줄을 섬)
+#   - busy_timeout: 잠겨 있으면 바로 'database is locked' 대신 DB_BUSY_TIMEOUT_MS까지 기다림
+#   - synchronous=NORMAL (WAL에서 안전), 페이지 캐시/임시 테이블 메모리 사용
+# 쓰기는 db_write()로 감싸면 시작할 때 쓰기 잠금(BEGIN IMMEDIATE)을 잡고, 잠금 대기 시간을 db_pool_stats()에 집계합니다.
+
+DB_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-16000", # 약 16MB
+    "PRAGMA temp_store=MEMORY",
+)
+
+class SQLiteConnectionPool:
+    """
+    스레드별 SQLite 연결 재사용.
+    - connection(path): 이 스레드의 연결 (처음이면 열고 DB_PRAGMAS 적용)
+    - stats(): 연 연결 수, 재사용 수, 쓰기 잠금 대기 시간(p50/p99/max), 잠금 실패 수
+    """
+    def __init__(self, pragmas=DB_PRAGMAS):
+        self.pragmas = pragmas
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._stats = {'opened': 0, 'reused': 0, 'writes': 0, 'lock_errors': 0}
+        self._write_waits = deque(maxlen=1000)
+    
+    def connection(self, path=None):
+        path = path or DB_PATH
+        conns = getattr(self._local, 'conns', None)
+        if conns is None:
+            conns = self._local.conns = {}
+        conn = conns.get(path)
+        if conn is not None:
+            self._count('reused')
+            return conn
+        conn = sqlite3.connect(path, timeout=DB_BUSY_TIMEOUT_MS / 1000)
+        for pragma in self.pragmas:
+            conn.execute(pragma)
+        conns[path] = conn
+        self._count('opened')
+        return conn
+    
+    def close_thread(self):
+        """이 스레드의 연결을 모두 닫음 (스레드가 끝나면 자동으로 정리되므로 보통은 필요 없음)"""
+        for conn in getattr(self._local, 'conns', {}).values():
+            conn.close()
+        self._local.conns = {}
+    
+    def _count(self, key, n=1):
+        with self._lock:
+            self._stats[key] += n
+    
+    def record_write(self, wait_seconds=None, lock_error=False):
+        with self._lock:
+            self._stats['writes'] += 1
+            self._stats['lock_errors'] += int(lock_error)
+            if wait_seconds is not None:
+                self._write_waits.append(wait_seconds)
+    
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            waits = np.sort(np.fromiter(self._write_waits, dtype=float)) * 1000
+        stats['write_wait_p50_ms'] = float(np.percentile(waits, 50)) if len(waits) else 0.0
+        stats['write_wait_p99_ms'] = float(np.percentile(waits, 99)) if len(waits) else 0.0
+        stats['write_wait_max_ms'] = float(waits[-1]) if len(waits) else 0.0
+        return stats
+
+_DB_POOL = SQLiteConnectionPool()
+
+def get_db_connection(path=None):
+    """이 스레드의 공유 연결 (닫지 마세요. 트랜잭션은 직접 commit 하거나 db_connection/db_write 사용)"""
+    return _DB_POOL.connection(path)
+
+@contextlib.contextmanager
+def db_connection(path=None):
+    """
+    with db_connection() as conn: ... (읽기/가벼운 쓰기)
+    `with sqlite3.connect(...) as conn`과 같이 끝나면 commit, 오류면 rollback (연결은 닫지 않고 재사용)
+    """
+    conn = _DB_POOL.connection(path)
+    try:
+        yield conn
+    except BaseException:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+    if conn.in_transaction:
+        conn.commit()
+
+@contextlib.contextmanager
+def db_write(path=None):
+    """
+    with db_write() as conn: ... (쓰기)
+    시작할 때 쓰기 잠금(BEGIN IMMEDIATE)을 잡아서 잠금 대기 시간을 집계하고, 끝나면 commit / 오류면 rollback
+    (안에서 conn.commit()을 불러도 됨)
+    """
+    conn = _DB_POOL.connection(path)
+    if not conn.in_transaction:
+        start = time.perf_counter()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+        except sqlite3.OperationalError:
+            _DB_POOL.record_write(time.perf_counter() - start, lock_error=True)
+            raise
+        waited = time.perf_counter() - start
+        _DB_POOL.record_write(waited)
+        if waited >= 0.5:
+            print(f"⏳ (DB) 쓰기 잠금 대기 {waited:.1f}초")
+    else:
+        _DB_POOL.record_write()
+    try:
+        yield conn
+    except BaseException:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+    if conn.in_transaction:
+        conn.commit()
+
+def db_pool_stats():
+    """(지표) DB 연결 재사용/쓰기 잠금 대기 시간 (이 프로세스 기준 누적)"""
+    return _DB_POOL.stats()
+
+
 def get_user_profile(conn, user_id):
     """'users' 테이블에서 특정 사용자 프로필을 불러옵니다."""
     try:
@@ -269,486 +439,3681 @@ def parse_restrictions(profile):
         
     return final_list
 
-def recommend_recipes_by_filter(conn, profile, restrictions):
-    """
-    (1차 필터링) 'recipes' 테이블에서 금지 재료 + 시간 제약을 필터링합니다.
-    (이 함수는 입력(restrictions)이 강력해졌으므로, 로직 수정은 거의 필요 없음)
-    """
-    try:
-        all_recipes_df = pd.read_sql("SELECT * FROM recipes", conn)
-        
-        # --- 1. 재료 필터링 ---
-        filtered_indices = [] # 합격한 레시피의 인덱스
-        
-        for index, row in all_recipes_df.iterrows():
-            
-            # [수정] 더 구체적인 예외 처리
-            try:
-                # ingredients_json 컬럼의 문자열을 딕셔너리로 변환
-                ingredients_dict = json.loads(row['ingredients_json'])
-            except (json.JSONDecodeError, TypeError):
-                # JSON 형식이 아니거나 NaN인 경우, 안전하게 필터링(제외)
-                continue 
-                
-            ingredient_names = ingredients_dict.keys()
-            
-            is_safe = True # 일단 안전하다고 가정
-            for restriction in restrictions:
-                for name in ingredient_names:
-                    # [핵심 로직] '멸치'가 '국물용 멸치'에 포함되는지 검사
-                    if restriction in name:
-                        is_safe = False 
-                        break 
-                if not is_safe:
-                    break 
-            
-            if is_safe:
-                filtered_indices.append(index)
-                
-        material_filtered_df = all_recipes_df.loc[filtered_indices]
-        print(f"✅ (1차-재료) {len(all_recipes_df)}개 중 {len(material_filtered_df)}개 레시피가 안전합니다.")
-        
-        # -----------------------------------------------------------------
-        # [수정된 부분] 2. 시간 필터링 (30분 / 60분 제약 처리)
-        # -----------------------------------------------------------------
-        
-        other_restrictions = profile['restrictions_other']
-        allowed_times = []
-        time_limit_str = "제약 없음"
-
-        if '조리시간 30분 이내' in other_restrictions:
-            # 30분 제약이 걸리면, 60분 제약은 무시 (더 강력한 조건)
-            allowed_times = ['30분이내', '15분이내', '10분이내', '5분이내']
-            time_limit_str = "30분 이내"
-            
-        elif '조리시간 60분 이내' in other_restrictions:
-            # 30분 제약은 없지만 60분 제약이 있는 경우
-            allowed_times = ['60분이내', '30분이내', '15분이내', '10분이내', '5분이내']
-            time_limit_str = "60분 이내"
-        
-        # allowed_times 리스트가 비어있지 않다면 (즉, 시간 제약이 있다면)
-        if allowed_times:
-            print(f"시간 제약({time_limit_str})으로 필터링을 시작합니다...")
-            
-            # CKG_TIME_NM 컬럼값이 allowed_times 리스트에 포함된 것만 선택
-            # (DB 원본의 NaN 값은 isin()에서 자동으로 False 처리되어 제외됨)
-            final_filtered_df = material_filtered_df[
-                material_filtered_df['CKG_TIME_NM'].isin(allowed_times)
-            ]
-            print(f"✅ (1차-시간) {len(final_filtered_df)}개 레시피만 남김.")
-        else:
-            # 시간 제약이 없으면(allowed_times가 비어있으면) 재료 필터링 결과 그대로 사용
-            print("시간 제약 없음. 재료 필터링 결과만 사용합니다.")
-            final_filtered_df = material_filtered_df
-        
-        # ---------------------------------------------------------
-        # [수정] 3. 예산 필터링 (정적 숫자 budget 사용)
-        # ---------------------------------------------------------
-        user_budget = profile.get('budget', 0) # DB에서 가져온 숫자 (없으면 0)
-    
-        if user_budget and user_budget > 0:
-            # [전략] 네이버 가격은 '대용량(묶음)' 기준일 수 있으므로, 
-            # 한 끼 예산(user_budget)의 3배까지는 후보군에 포함시켜 줍니다.
-            # (예: 내 예산 1만원 -> 재료비 합계 2만원짜리(대용량) 레시피도 일단 통과)
-            budget_limit = user_budget * 3
-        
-            final_filtered_df = final_filtered_df[
-                (final_filtered_df['estimated_price'] <= budget_limit) | 
-                (final_filtered_df['estimated_price'].isnull()) |
-                (final_filtered_df['estimated_price'] == 0)
-            ]
-            print(f"💰 (1차-예산) {user_budget:,}원 예산 적용 -> 대용량 기준 {budget_limit:,}원 이하 {len(final_filtered_df)}개 남김.")
-    
-        else:
-            print("💰 (1차-예산) 예산 제약 없음.")
-        
-        return final_filtered_df
-    
-    except Exception as e:
-        print(f"필터링 중 오류: {e}")
-        return pd.DataFrame()
-    
+# -----------------------------------------------------------------
+# [신규 추가] 금지 키워드 '다중 패턴' 매처 (Aho-Corasick)
+# -----------------------------------------------------------------
+# 채식/비건 프로필은 금지 키워드가 100개를 넘기 때문에,
+# (키워드 수 x 재료 수)만큼 'in' 검사를 반복하는 대신
+# 키워드 전체를 오토마톤 하나로 컴파일해 재료 텍스트를 '한 번'만 훑습니다.
 
+# 재료명 사이에 넣는 구분자 (키워드가 재료명 두 개에 걸쳐 매칭되지 않도록)
+INGREDIENT_SEPARATOR = '\n'
 
-# [수정] 3. 2차 (Gemini) 추천 함수 (최종 완성본)
-def get_gemini_recommendation(api_key, profile, candidate_recipes, today_str, mood, free_text):
+# 키워드가 이 개수 이하면 오토마톤보다 파이썬 기본 'in' 검사가 더 빠름
+SMALL_KEYWORD_SET = 10
+
+class RestrictionMatcher:
     """
-    (2차 추천) 모든 상황(기분, 예산, 목표)을 고려하여 Gemini API로 최종 식단을 생성합니다.
+    금지 키워드 목록을 Aho-Corasick 오토마톤으로 컴파일합니다.
+    search()는 텍스트 길이에 비례하는 한 번의 선형 스캔으로,
+    키워드 중 하나라도 '부분 문자열'로 포함되는지 검사합니다.
+    (예: '멸치' -> '국물용 멸치' 매칭, 기존 `restriction in name`과 동일한 의미)
     """
-    try:
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel('models/gemini-flash-latest') 
-        
-        # 1. 후보 레시피 목록 텍스트 생성 (가격 정보 포함)
-        recipe_list_lines = []
-        for _, row in candidate_recipes.iterrows():
-            # 가격 정보 포맷팅 (0원이면 '정보 없음')
-            price_info = f"{row['estimated_price']:,}원" if row.get('estimated_price', 0) > 0 else "정보 없음"
-            
-            # 재료 정보 포맷팅 (JSON -> 읽기 편한 텍스트로 변환)
-            try:
-                ing_dict = json.loads(row['ingredients_json'])
-                # 너무 길면 AI가 힘들어하므로, 재료명만 나열하거나 주요 재료만 포함
-                # 예: "두부 1모, 대파 1단..." -> "두부, 대파..."
-                ingredients_info = ", ".join(list(ing_dict.keys())[:10]) # 최대 10개 재료만
-            except:
-                ingredients_info = "재료 정보 없음"
-            
-            line = (
-                f"- [{row['RCP_TTL']}] "
-                f"요리명: {row['CKG_NM']}, 조리법: {row['CKG_MTH_ACTO_NM']},"
-                f"소요시간: {row['CKG_TIME_NM']}, 재료비(대용량): {price_info},"
-                f"주재료: {ingredients_info})" # <-- AI가 이걸 보고 칼로리를 추정함
-            )
-            recipe_list_lines.append(line)
-        
-        recipe_list_str = "\n".join(recipe_list_lines)
-        
-        # 2. 사용자 프로필 텍스트 생성 (예산 포함)
-        user_budget = profile.get('budget', 0)
-        budget_str = f"{user_budget:,}원" if user_budget > 0 else "제한 없음"
-        
-        profile_str = f"""
-        - 사용자명: {profile['username']}
-        - 선호 음식: {profile['preferences']}
-        - 달성 목표: {profile['goals']}
-        - 알레르기: {profile['restrictions_allergies']}
-        - 기타 제약: {profile['restrictions_other']}
-        - 한 끼 예산: {budget_str}
-        """
-
-        # 3. 동적 컨텍스트 생성 (기분/요청)
-        context_str = f"- 오늘은 {today_str}입니다."
-        if mood != "-":
-            context_str += f"\n- 사용자의 현재 기분: {mood}"
-        if free_text:
-            context_str += f"\n- 사용자의 추가 요청: {free_text}"
-        else:
-            context_str += "\n- 사용자의 추가 요청: 없음"
 
-        # ------------------------------------------------------------------
-        # [핵심] 최종 통합 프롬프트
-        # ------------------------------------------------------------------
-        prompt = f"""
-        당신은 'BobFit'의 AI 식단 코치이자 전문 영양사입니다.
-        아래 제공된 정보를 종합하여 사용자에게 최적화된 **오늘의 아침/점심/저녁 식단(후보 총 9개)**을 추천해주세요.
+    def __init__(self, keywords):
+        # 빈 문자열/구분자가 들어간 키워드는 의미가 없으므로 제외
+        self.keywords = tuple(sorted({
+            k for k in keywords if k and INGREDIENT_SEPARATOR not in k
+        }))
+        self._goto = [{}]   # 상태별 전이 (문자 -> 다음 상태)
+        self._fail = [0]    # 실패 링크
+        self._out = [()]    # 해당 상태에서 끝나는 키워드 번호들
 
-        # 1. 사용자 프로필
-        {profile_str}
+        # 1. 키워드 트라이(Trie) 구성
+        for keyword_id, keyword in enumerate(self.keywords):
+            state = 0
+            for ch in keyword:
+                next_state = self._goto[state].get(ch)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(())
+                    self._goto[state][ch] = next_state
+                state = next_state
+            self._out[state] += (keyword_id,)
 
-        # 2. 오늘의 상황 (Context)
-        {context_str}
+        # 2. BFS로 실패 링크 연결 (+ 실패 링크 쪽 출력 병합)
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and ch not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(ch, 0)
+                self._out[next_state] += self._out[self._fail[next_state]]
 
-        # 3. 추천 대상 레시피 후보 목록 (엄선된 100개)
-        {recipe_list_str}
+    def search(self, text):
+        """텍스트에 키워드가 하나라도 포함되면 True (첫 매칭에서 즉시 종료)"""
+        if len(self.keywords) <= SMALL_KEYWORD_SET:
+            return any(keyword in text for keyword in self.keywords)
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                return True
+        return False
 
-        ---
-        # [필수 요청 사항]
+    def find_all(self, text):
+        """텍스트에 포함된 모든 키워드의 번호(self.keywords 기준) 집합을 반환"""
+        goto, fail, out = self._goto, self._fail, self._out
+        found = set()
+        state = 0
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                found.update(out[state])
+        return found
 
-        **1. 추천 밸런스 (Balance)**
-        - 추천하는 7개의 메뉴는 다음 두 가지 기준을 적절히 섞어서 구성하세요.
-          - 사용자의 [달성 목표](예: 다이어트, 단백질 증가, 영양 균형)에 충실한 건강 메뉴
-          - [오늘의 상황](기분, 날씨, 요청)을 위로하거나 만족시키는 메뉴
-        
-        **2. 제약 조건 준수 (Constraints)**
-        - 사용자의 [알레르기] 및 [기타 제약](채식, 종교 등)을 **절대적으로 준수**하세요. 위 후보 목록은 이미 1차 필터링 되었으나, AI인 당신이 한 번 더 검토하세요.
-        
-        **3. 예산 고려 (Budget)**
-        - 사용자의 [한 끼 예산] 제한이 있다면 확인하세요.
-        - 후보 목록의 '재료비(대용량)'는 식재료를 묶음으로 샀을 때의 총가격입니다. 
-        - 따라서 **실제 1인분 1끼 비용은 표시된 가격의 약 1/5 ~ 1/10 수준**으로 저렴하다고 판단하고, 이를 감안하여 예산 범위 내에서 합리적인 메뉴를 고르세요.
 
-        **4. [★매우 중요 - 출력 형식]**
-        - 레시피 제목은 반드시 후보 목록에 있는 **대괄호 `[]` 안의 원본 제목 그대로** 작성해야 합니다. (토글 매칭을 위해 필수)
-        (잘못된 예: "순두부찌개", "맛있는 된장찌개")
-        (올바른 예: "[바지락 순두부 찌개 끓이는 법]", "[차돌박이 된장찌개]")
-        
-        - **[열량 추정]** 후보 목록에 있는 **'주재료' 정보**를 바탕으로 대략적인 열량(kcal)을 추정하세요.
-          - 표기의 편리를 위해 반드시 **1인분 기준으로 추정한 열량**을 메뉴 이름의 아래 줄에 `(약 XXX kcal)` 형식으로 명시하세요.
-        
-        - 각 추천 메뉴 사이에는 **반드시 빈 줄(줄바꿈 2번)**을 넣어주세요.
-        
-        - 설명은 Markdown 형식을 사용하여 가독성 있게 작성하세요.
+@functools.lru_cache(maxsize=32)
+def _compile_restriction_matcher(keyword_key):
+    return RestrictionMatcher(keyword_key)
 
-        ---
-        # [출력 예시]
-        
-        안녕하세요, {profile['username']}님! BobFit 영양사입니다.
-        (인사말 및 추천 컨셉 설명...)
+def get_restriction_matcher(restrictions):
+    """
+    parse_restrictions() 결과로 매처를 만들어 캐시합니다.
+    (순서/중복만 다른 같은 키워드 집합이면 이미 컴파일된 매처를 재사용)
+    """
+    return _compile_restriction_matcher(tuple(sorted(set(restrictions))))
 
-        아침 1. **[원본 레시피 제목 그대로]**:
-           (약 XXX kcal)
-           추천 이유: 사용자의 '다이어트' 목표에 맞춰 단백질이 풍부하고...
+# -----------------------------------------------------------------
+# [신규 추가] 레시피 카탈로그 버전 관리
+# -----------------------------------------------------------------
+# recipes 테이블이 바뀔 때마다 트리거가 'recipes_version'을 1씩 올립니다.
+# (조리법(recipe_steps) 저장은 필터/검색 결과에 영향이 없으므로 버전을 올리지 않음)
+# 카탈로그에서 파생된 인덱스들은 이 버전이 바뀌었을 때만 다시 만듭니다.
+# 트리거는 변경마다 (버전, rowid, 종류)를 catalog_changes에도 남겨서,
+# '새 행 추가'만 있었던 경우에는 전체를 다시 만들지 않고 새 행만 이어 붙일 수 있게 합니다.
 
-        아침 2. **[원본 레시피 제목 그대로]**: 
-           (약 XXX kcal)
-           추천 이유: 오늘 '우울함'을 느끼시는 고객님을 위해 따뜻한...
-           
-        아침 3. **[원본 레시피 제목 그대로]**: 
-           (약 XXX kcal)
-           추천 이유: 사용자의 '근육 증가' 목표에 맞춰 고단백...
-           
-        점심 1. **[원본 레시피 제목 그대로]**:
-           (약 XXX kcal)
-           추천 이유: ...
+CATALOG_VERSION_KEY = 'recipes_version'
+# 이 버전까지의 변경 기록은 지워졌음 (그 이전 버전의 캐시는 '추가만 있었는지' 알 수 없음)
+CATALOG_CHANGES_PRUNED_KEY = 'recipes_changes_pruned'
+# 변경 기록을 정리할 때 남겨 둘 최근 변경 수
+CATALOG_CHANGE_LOG_KEEP = 10000
 
-        ... (9번(아침 1 ~ 저녁 3)까지 반복)
-        """
-        
-        print(f"\nGemini API에 추천을 요청합니다... (모델: {model.model_name})")
-        response = model.generate_content(prompt)
-        
-        return response.text
+# 버전을 올려야 하는 '의미 있는' 컬럼들
+CATALOG_TRACKED_COLUMNS = [
+    'RCP_SNO', 'RCP_TTL', 'CKG_NM', 'CKG_MTH_ACTO_NM', 'CKG_TIME_NM',
+    'CKG_INBUN_NM', 'ingredients_json', 'estimated_price',
+]
 
-    except Exception as e:
-        print(f"❌ Gemini API 오류: {e}")
-        return None
-    
-def get_or_create_recipe_steps(conn, api_key, recipe_id, recipe_title, ingredients_json):
-    """
-    DB에 조리법이 있으면 가져오고, 없으면 AI로 생성 후 저장합니다.
+def _catalog_trigger_body(row_ref, op):
+    """버전 +1 후, 올라간 버전으로 변경 기록 1건 추가"""
+    return f"""
+    UPDATE catalog_meta SET value = value + 1 WHERE key = '{CATALOG_VERSION_KEY}';
+    INSERT INTO catalog_changes (version, row_id, op)
+    SELECT value, {row_ref}.rowid, '{op}' FROM catalog_meta WHERE key = '{CATALOG_VERSION_KEY}';
     """
-    try:
-        cursor = conn.cursor()
-        # 1. DB 확인
-        cursor.execute("SELECT recipe_steps FROM recipes WHERE RCP_SNO = ?", (recipe_id,))
-        result = cursor.fetchone()
-        
-        if result and result[0]:
-            print(f"✅ (Cache) DB에서 조리법 로드: {recipe_title}")
-            return result[0] # 저장된 조리법 반환
-        
-        # 2. 없으면 AI 생성
-        print(f"🤖 (GenAI) 조리법 신규 생성 중: {recipe_title}")
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel('models/gemini-flash-latest')
-        
-        safety_settings = [
-            {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"},
-            {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"},
-        ]
-        
-        # 재료 텍스트 변환
-        try:
-            ing_dict = json.loads(ingredients_json)
-            ing_str = ", ".join([f"{k} {v}" for k, v in ing_dict.items()])
-        except:
-            ing_str = ingredients_json
-            
-        prompt = f"""
-        당신은 요리 전문가입니다. 다음 요리의 [상세 조리 순서]를 작성해주세요.
-        
-        - 요리명: {recipe_title}
-        - 재료: {ing_str}
-        
-        [작성 조건]
-        1. 번호(1., 2., ...)를 붙여서 단계별로 명확하게 작성하세요.
-        2. 각 단계는 구체적인 행동(썰다, 볶다, 끓이다)으로 끝맺으세요.
-        3. 불 조절이나 팁이 있다면 함께 적어주세요.
-        4. 출력은 오직 조리 순서 텍스트만 작성하세요.
-        """
-        
-        # safety_settings 적용
-        response = model.generate_content(prompt, safety_settings=safety_settings)
-        
-        # 응답 유효성 검사
-        if response.candidates and response.candidates[0].content.parts:
-            generated_steps = response.text
-        
-            # 3. DB에 저장 (UPDATE)
-            cursor.execute("UPDATE recipes SET recipe_steps = ? WHERE RCP_SNO = ?", (generated_steps, recipe_id))
-            conn.commit()
-            print(f"💾 (DB 저장) 조리법 저장 완료: {recipe_title}")
-            
-            return generated_steps
-        else:
-            print(f"⚠️ (GenAI) 조리법 생성 응답 없음. (Reason: {response.candidates[0].finish_reason})")
-            return "조리법 정보를 생성하지 못했습니다. (AI 응답 오류)"
-    
 
-    except Exception as e:
-        print(f"❌ 조리법 생성/저장 실패: {e}")
-        return "조리법 정보를 불러올 수 없습니다."
-
-# --- 4. [신규 추가] DB 연동 (마이페이지) 함수 ---
+def ensure_catalog_versioning(conn):
+    """catalog_meta / catalog_changes 테이블과 recipes 변경 감지 트리거를 (없으면) 생성합니다."""
+    cursor = conn.cursor()
+    has_change_log = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'catalog_changes'"
+    ).fetchone()
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS catalog_meta (
+        key TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    );
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS catalog_changes (
+        version INTEGER PRIMARY KEY, -- 변경 직후의 카탈로그 버전
+        row_id INTEGER NOT NULL,
+        op TEXT NOT NULL             -- 'insert' / 'update' / 'delete'
+    );
+    """)
+    cursor.execute(
+        "INSERT OR IGNORE INTO catalog_meta (key, value) VALUES (?, 1)",
+        (CATALOG_VERSION_KEY,)
+    )
+    # 변경 기록이 없던 DB: 지금 버전 이전의 변경은 알 수 없음 + 기록을 남기지 않던 예전 트리거 교체
+    cursor.execute(
+        "INSERT OR IGNORE INTO catalog_meta (key, value) SELECT ?, value FROM catalog_meta WHERE key = ?",
+        (CATALOG_CHANGES_PRUNED_KEY, CATALOG_VERSION_KEY)
+    )
+    if not has_change_log:
+        for op in ('insert', 'delete', 'update'):
+            cursor.execute(f"DROP TRIGGER IF EXISTS trg_recipes_version_{op}")
 
-def setup_database(conn):
-    """
-    (최초 1회 실행) votes, rewards 테이블이 없으면 생성합니다.
-    """
-    try:
-        cursor = conn.cursor()
-        
-        # 1. '좋아요/싫어요' 투표 저장 테이블
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS votes (
-            vote_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            recipe_sno INTEGER NOT NULL,
-            vote_type TEXT NOT NULL, -- 'Like' or 'Dislike'
-            voted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users(user_id),
-            FOREIGN KEY (recipe_sno) REFERENCES recipes(RCP_SNO),
-            UNIQUE(user_id, recipe_sno) -- 한 사용자가 한 레시피에 한 번만 투표
-        );
-        """)
-        
-        # 2. '7일 달성' 리워드 기록 테이블
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS rewards (
-            reward_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL UNIQUE, -- 한 사용자당 하나의 기록
-            checked_count INTEGER DEFAULT 0,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        );
-        """)
-        
-        conn.commit()
-        print("✅ (DB 셋업) 'votes' 및 'rewards' 테이블 확인/생성 완료.")
-    except Exception as e:
-        print(f"❌ (DB 셋업) 테이블 생성 오류: {e}")
-        conn.rollback()
+    cursor.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS trg_recipes_version_insert AFTER INSERT ON recipes
+    BEGIN {_catalog_trigger_body('NEW', 'insert')} END;
+    """)
+    cursor.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS trg_recipes_version_delete AFTER DELETE ON recipes
+    BEGIN {_catalog_trigger_body('OLD', 'delete')} END;
+    """)
+    cursor.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS trg_recipes_version_update
+    AFTER UPDATE OF {", ".join(CATALOG_TRACKED_COLUMNS)} ON recipes
+    BEGIN {_catalog_trigger_body('NEW', 'update')} END;
+    """)
+    conn.commit()
 
-def save_vote(conn, user_id, recipe_sno, vote_type):
-    """
-    '좋아요' 또는 '싫어요' 투표를 DB에 저장합니다.
-    (이미 투표했다면 덮어씁니다: INSERT OR REPLACE)
-    """
-    query = """
-    INSERT OR REPLACE INTO votes (user_id, recipe_sno, vote_type)
-    VALUES (?, ?, ?)
-    """
+def get_catalog_version(conn):
+    """현재 레시피 카탈로그 버전 (버전 테이블이 없으면 먼저 생성)"""
+    query = "SELECT value FROM catalog_meta WHERE key = ?"
     try:
-        cursor = conn.cursor()
-        cursor.execute(query, (user_id, recipe_sno, vote_type))
-        conn.commit()
-        print(f"🗳️ (DB 저장) user_id {user_id}가 recipe_sno {recipe_sno}에 '{vote_type}' 투표함.")
-    except Exception as e:
-        print(f"❌ (DB 저장) 투표 저장 오류: {e}")
-        conn.rollback()
+        result = conn.execute(query, (CATALOG_VERSION_KEY,)).fetchone()
+    except sqlite3.OperationalError:
+        ensure_catalog_versioning(conn)
+        result = conn.execute(query, (CATALOG_VERSION_KEY,)).fetchone()
+    return result[0] if result else 0
 
-def save_reward(conn, user_id, checked_count):
-    """
-    '7일 달성' 체크박스 개수를 DB에 저장(업데이트)합니다.
+def get_catalog_changes(conn, since_version):
     """
-    query = """
-    INSERT OR REPLACE INTO rewards (user_id, checked_count, updated_at)
-    VALUES (?, ?, CURRENT_TIMESTAMP)
+    since_version 이후의 recipes 변경 기록 [(version, rowid, op), ...] (버전 순서).
+    그 사이 기록이 정리되어 알 수 없으면 None을 반환합니다.
     """
-    try:
-        cursor = conn.cursor()
-        cursor.execute(query, (user_id, checked_count))
-        conn.commit()
-        # print(f"🏆 (DB 저장) user_id {user_id}의 달성률 {checked_count}/7 저장.")
-    except Exception as e:
-        print(f"❌ (DB 저장) 리워드 저장 오류: {e}")
-        conn.rollback()
+    pruned = conn.execute(
+        "SELECT value FROM catalog_meta WHERE key = ?", (CATALOG_CHANGES_PRUNED_KEY,)
+    ).fetchone()
+    if pruned is None or since_version < pruned[0]:
+        return None
+    return conn.execute(
+        "SELECT version, row_id, op FROM catalog_changes WHERE version > ? ORDER BY version",
+        (since_version,)
+    ).fetchall()
 
-def get_my_votes(conn, user_id):
-    """
-    (마이페이지용) 내가 'Like'한 레시피 목록을 불러옵니다.
+def get_append_only_since(conn):
     """
-    query = """
-    SELECT r.RCP_TTL, r.CKG_MTH_ACTO_NM
-    FROM votes v
-    JOIN recipes r ON v.recipe_sno = r.RCP_SNO
-    WHERE v.user_id = ? AND v.vote_type = 'Like'
-    ORDER BY v.voted_at DESC
+    이 버전 이후로는 '새 행 추가'만 있었음을 보장하는 가장 오래된 카탈로그 버전.
+    (이 버전 이상에서 만든 인덱스는 새 행만 이어 붙여서 최신으로 만들 수 있음)
     """
     try:
-        # read_sql로 바로 DataFrame을 만듭니다.
-        df = pd.read_sql(query, conn, params=(user_id,))
-        return df
-    except Exception as e:
-        print(f"❌ (DB 조회) '좋아요' 목록 로딩 오류: {e}")
-        return pd.DataFrame()
+        last_change = conn.execute(
+            "SELECT MAX(version) FROM catalog_changes WHERE op != 'insert'"
+        ).fetchone()[0]
+    except sqlite3.OperationalError:
+        # 변경 기록 테이블이 생기기 전의 DB -> 트리거 교체 후 '지금부터' 기록
+        ensure_catalog_versioning(conn)
+        return get_catalog_version(conn)
+    pruned = conn.execute(
+        "SELECT value FROM catalog_meta WHERE key = ?", (CATALOG_CHANGES_PRUNED_KEY,)
+    ).fetchone()
+    return max(last_change or 0, pruned[0] if pruned else get_catalog_version(conn))
 
-def get_my_rewards(conn, user_id):
-    """
-    (마이페이지용) 나의 현재 '달성' 횟수를 불러옵니다.
-    """
-    query = "SELECT checked_count FROM rewards WHERE user_id = ?"
-    try:
-        cursor = conn.cursor()
-        cursor.execute(query, (user_id,))
-        result = cursor.fetchone() # (7,) 또는 None
-        if result:
-            return result[0] # 7
-        else:
-            return 0 # 기록이 없으면 0
-    except Exception as e:
-        print(f"❌ (DB 조회) 리워드 로딩 오류: {e}")
+def prune_catalog_changes(conn, keep=CATALOG_CHANGE_LOG_KEEP):
+    """최근 keep건만 남기고 오래된 변경 기록을 정리합니다."""
+    cutoff = get_catalog_version(conn) - keep
+    if cutoff <= 0:
         return 0
-    
-# --- 5. [신규 추가]"스마트" 후보군 선정 (ML) ---
+    deleted = conn.execute("DELETE FROM catalog_changes WHERE version <= ?", (cutoff,)).rowcount
+    conn.execute(
+        "UPDATE catalog_meta SET value = MAX(value, ?) WHERE key = ?",
+        (cutoff, CATALOG_CHANGES_PRUNED_KEY)
+    )
+    conn.commit()
+    return deleted
 
-def _extract_ingredients_text(json_str):
-    """(HELPER) ingredients_json에서 재료명(key)만 추출해 텍스트로 반환"""
-    try:
-        ingredients_dict = json.loads(json_str)
-        # 재료명(key)만 " "으로 묶어서 반환 (예: "두부 아보카도 간장")
-        return " ".join(ingredients_dict.keys())
-    except (json.JSONDecodeError, TypeError):
-        return "" # 파싱 실패 시 빈 텍스트 반환
+def _database_file(conn):
+    """연결된 DB 파일 경로 (프로세스 전역 캐시의 Key로 사용)"""
+    for _, name, file_path in conn.execute("PRAGMA database_list"):
+        if name == 'main':
+            return file_path or ':memory:'
+    return ':memory:'
 
 # -----------------------------------------------------------------
-# [신규 추가] 1순위: AI 레시피 변형 (Generative AI)
+# [신규 추가] 금지 재료 '비트맵 인덱스'
 # -----------------------------------------------------------------
+# RESTRICTION_MAP은 고정이고 레시피 테이블도 거의 바뀌지 않으므로,
+# 카탈로그 버전마다 한 번만 '키워드별로 어떤 레시피에 들어 있는지'를
+# 비트맵(np.packbits)으로 만들어 둡니다.
+# 요청 시에는 [금지 키워드 비트맵들의 OR] + [NOT]만 계산하면 됩니다.
+# 재료는 재료 사전 ID 배열(CSR)로 들고 있으므로, 키워드 매칭은 레시피마다가 아니라
+# '재료명 사전'에 대해 한 번만 하고, 레시피 쪽은 정수 배열 연산(ID -> 레시피 행)으로 처리합니다.
 
-def modify_recipe_with_gemini(api_key, recipe_title, ingredients_json, modification_request, original_cal_str="정보 없음"):
+class RestrictionIndex:
     """
-    (GenAI) 원본 레시피를 사용자의 요청에 맞춰 변형합니다. (칼로리 일관성 유지)
+    레시피 행(row) 순서 기준의 키워드/카테고리별 비트맵 인덱스.
+    - RESTRICTION_MAP의 Key(예: '난류')와 개별 키워드(예: '계란')마다 비트맵 1개
+    - 맵에 없는 자유 입력(예: '복숭아 통조림')은 처음 요청될 때 재료 사전을 훑어서 추가(메모이즈)
+    - ingredients_json이 깨진 레시피는 '항상 제외' 비트맵으로 관리 (기존 동작과 동일)
     """
-    try:
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel('models/gemini-flash-latest')
-        
-        # 안전 설정 해제
-        safety_settings = [
-            {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"},
-            {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"},
-        ]
-        
-        try:
-            ing_dict = json.loads(ingredients_json)
-            ingredients_str = ", ".join([f"{k} {v}" for k, v in ing_dict.items()])
-        except:
-            ingredients_str = ingredients_json
 
-        # [프롬프트 수정] 기준 칼로리 정보 명시
-        prompt = f"""
-        당신은 창의적이고 유능한 요리 연구가입니다.
-        아래의 [원본 레시피]를 사용자의 [요청 사항]에 맞춰 **새롭게 변형**해주세요.
+    def __init__(self, recipe_ids, ingredient_ids, offsets, valid, vocabulary):
+        # recipe_ids: RCP_SNO 배열 / ingredient_ids + offsets: 재료 사전 ID의 CSR 배열
+        # valid: 재료 정보 해석 성공 여부 / vocabulary: 재료 사전 ID -> 재료명 (추가만 되는 공유 리스트)
+        self.recipe_ids = np.asarray(recipe_ids)
+        self.n_rows = len(self.recipe_ids)
+        self._ids = np.asarray(ingredient_ids)
+        self._offsets = np.asarray(offsets)
+        self._vocabulary = vocabulary
+        self._sorted_order = np.argsort(self.recipe_ids, kind='stable')
+        self._lock = threading.Lock()
 
-        [원본 레시피 정보]
-        - 요리명: {recipe_title}
-        - 원본 재료: {ingredients_str}
-        - **원본 1인분 기준 열량: {original_cal_str}**
+        self.invalid_bits = np.packbits(~np.asarray(valid, dtype=bool))
 
-        [사용자 요청 사항]
-        👉 "{modification_request}"
+        # 1. RESTRICTION_MAP 전체 키워드를 매처 하나로 '재료 사전만' 훑어서 (키워드 x 재료 ID) 행렬 생성
+        all_keywords = set()
+        for keywords in RESTRICTION_MAP.values():
+            all_keywords.update(keywords)
+        matcher = RestrictionMatcher(all_keywords)
+        used_ids = np.unique(self._ids)
+        keyword_rows, vocab_cols = [], []
+        for ingredient_id in used_ids.tolist():
+            for keyword_id in matcher.find_all(self._vocabulary[ingredient_id]):
+                keyword_rows.append(keyword_id)
+                vocab_cols.append(ingredient_id)
+        keyword_vocab = sparse.csr_matrix(
+            (np.ones(len(keyword_rows), dtype=np.int32), (keyword_rows, vocab_cols)),
+            shape=(len(matcher.keywords), self._vocab_size()),
+        )
 
-        [작성 가이드]
-        1. 요청 사항을 철저히 반영하여 **변경된 재료 목록**을 작성하세요. 
-        2. [★매우 중요 - 열량 재계산]
-           - 위에서 제공된 **원본 기준 열량({original_cal_str})**을 기준으로, 재료가 빠지거나 줄어들면 낮추고, 추가되면 높여서 계산하세요.
-           - 결과물 맨 윗줄에 **(변형된 예상 열량: 약 XXX kcal)** 라고 명시해주세요.
-           - (예: 원본이 500kcal인데 '1/2분량' 요청 -> "약 250kcal")
-           
-        3. 변형된 재료로 요리하는 **간단한 조리법(Step-by-Step)**을 3~7단계로 요약해서 작성하세요.
-        4. 마지막에 이 변형이 왜 좋은지 **'영양사의 한마디'**를 덧붙여주세요.
-        5. 출력 형식은 읽기 편한 **Markdown**으로 작성해주세요.
+        # 2. (레시피 x 재료 ID) x (재료 ID x 키워드) = 레시피별 키워드 포함 수 -> 키워드(열)마다 행 목록
+        hits = (self._incidence() @ keyword_vocab.T).tocsc()
+        self._keyword_bits = {
+            keyword: self._pack_rows(hits.indices[hits.indptr[k]:hits.indptr[k + 1]])
+            for k, keyword in enumerate(matcher.keywords)
+        }
+
+        # 3. 카테고리(Key) 비트맵 = 소속 키워드 비트맵들의 OR
+        self._group_bits = {
+            term: self._or_bits(self._keyword_bits[k] for k in keywords if k in self._keyword_bits)
+            for term, keywords in RESTRICTION_MAP.items()
+        }
+
+    @classmethod
+    def from_frame(cls, recipes_df):
+        """RCP_SNO, ingredients_json 컬럼을 가진 DataFrame으로부터 인덱스 생성 (재료 사전도 새로 만듦)"""
+        codec = IngredientCodec()
+        ids, _, offsets, valid = codec.decode_frame(recipes_df)
+        return cls(recipes_df['RCP_SNO'].to_numpy(), ids, offsets, valid, codec.names.values)
+
+    def appended(self, recipe_ids, ingredient_ids, offsets, valid):
         """
-        
-        print(f"🤖 (GenAI) 레시피 변형 요청: {recipe_title} (기준: {original_cal_str}) -> {modification_request}")
-        
-        response = model.generate_content(prompt, safety_settings=safety_settings)
-        
-        if response.candidates and response.candidates[0].content.parts:
+        새로 추가된 행들만 훑은 작은 인덱스(세그먼트)를 만들어 기존 비트맵 뒤에 이어 붙인
+        새 인덱스를 반환합니다. (기존 인덱스 객체는 그대로 = 사용 중인 요청에 안전)
+        """
+        delta = RestrictionIndex(recipe_ids, ingredient_ids, offsets, valid, self._vocabulary)
+        with self._lock:
+            memoized = [k for k in self._keyword_bits if k not in delta._keyword_bits]
+        for keyword in memoized:
+            delta.keyword_bits(keyword)
+
+        index = copy.copy(self)
+        index.recipe_ids = np.concatenate([self.recipe_ids, delta.recipe_ids])
+        index.n_rows = self.n_rows + delta.n_rows
+        index._ids = np.concatenate([self._ids, delta._ids])
+        index._offsets = np.concatenate([self._offsets, self._offsets[-1] + delta._offsets[1:]])
+        index._sorted_order = np.argsort(index.recipe_ids, kind='stable')
+        index._lock = threading.Lock()
+        index.invalid_bits = self._concat_bits(self.invalid_bits, delta.invalid_bits, delta.n_rows)
+        index._keyword_bits = {
+            keyword: self._concat_bits(self._keyword_bits[keyword], bits, delta.n_rows)
+            for keyword, bits in delta._keyword_bits.items() if keyword in self._keyword_bits
+        }
+        index._group_bits = {
+            term: self._concat_bits(self._group_bits[term], bits, delta.n_rows)
+            for term, bits in delta._group_bits.items()
+        }
+        return index
+
+    def _vocab_size(self):
+        # 공유 사전은 뒤에 계속 추가될 수 있으므로, 이 인덱스가 쓰는 ID까지만 보장
+        return max(len(self._vocabulary), int(self._ids.max()) + 1 if len(self._ids) else 0)
+
+    def _incidence(self):
+        """(레시피 x 재료 ID) 0/1 희소 행렬 (CSR 배열을 그대로 사용)"""
+        return sparse.csr_matrix(
+            (np.ones(len(self._ids), dtype=np.int32), self._ids, self._offsets),
+            shape=(self.n_rows, self._vocab_size()),
+        )
+
+    def _rows_with(self, ingredient_ids):
+        """재료 ID 중 하나라도 들어 있는 레시피 행 = True (ID 배열에 대한 정수 연산만 사용)"""
+        hit_vocab = np.zeros(self._vocab_size(), dtype=bool)
+        hit_vocab[ingredient_ids] = True
+        counts = np.concatenate([[0], np.cumsum(hit_vocab[self._ids])])
+        return counts[self._offsets[1:]] > counts[self._offsets[:-1]]
+
+    def _concat_bits(self, bits, delta_bits, n_delta):
+        """이 인덱스의 비트맵 뒤에 delta 행 비트맵을 이어 붙임 (8의 배수가 아니면 풀었다가 다시 압축)"""
+        if self.n_rows % 8 == 0:
+            return np.concatenate([bits, delta_bits])
+        return np.packbits(np.concatenate([
+            np.unpackbits(bits, count=self.n_rows),
+            np.unpackbits(delta_bits, count=n_delta),
+        ]))
+
+    def _pack_rows(self, rows):
+        mask = np.zeros(self.n_rows, dtype=bool)
+        mask[rows] = True
+        return np.packbits(mask)
+
+    def _or_bits(self, bitmaps):
+        result = np.zeros((self.n_rows + 7) // 8, dtype=np.uint8)
+        for bits in bitmaps:
+            np.bitwise_or(result, bits, out=result)
+        return result
+
+    def keyword_bits(self, keyword):
+        """키워드 비트맵 (인덱스에 없으면 재료 사전을 한 번 훑은 뒤 메모이즈)"""
+        bits = self._keyword_bits.get(keyword)
+        if bits is None:
+            matcher = RestrictionMatcher([keyword])
+            vocabulary = self._vocabulary
+            matched_ids = [
+                ingredient_id for ingredient_id in np.unique(self._ids).tolist()
+                if matcher.search(vocabulary[ingredient_id])
+            ]
+            bits = np.packbits(self._rows_with(matched_ids))
+            with self._lock:
+                self._keyword_bits[keyword] = bits
+        return bits
+
+    def group_bits(self, term):
+        """RESTRICTION_MAP Key(예: '갑각류') 비트맵 (맵에 없으면 단어 자체를 키워드로 취급)"""
+        bits = self._group_bits.get(term)
+        return bits if bits is not None else self.keyword_bits(term)
+
+    def blocked_mask(self, restrictions):
+        """금지 키워드 중 하나라도 포함되었거나, 재료 정보가 깨진 레시피 = True"""
+        bits = self._or_bits(
+            [self.invalid_bits] + [self.keyword_bits(k) for k in set(restrictions) if k]
+        )
+        return np.unpackbits(bits, count=self.n_rows).astype(bool)
+
+    def positions(self, recipe_ids):
+        """RCP_SNO 목록 -> 인덱스 행 번호 (인덱스에 없는 레시피는 -1)"""
+        recipe_ids = np.asarray(recipe_ids)
+        if self.n_rows == 0:
+            return np.full(len(recipe_ids), -1)
+        sorted_ids = self.recipe_ids[self._sorted_order]
+        found = np.clip(np.searchsorted(sorted_ids, recipe_ids), 0, self.n_rows - 1)
+        hit = sorted_ids[found] == recipe_ids
+        return np.where(hit, self._sorted_order[found], -1)
+
+
+# -----------------------------------------------------------------
+# [신규 추가] 조리시간/예산 필터를 SQL로 내리기 위한 타입 컬럼 + 인덱스
+# -----------------------------------------------------------------
+# CKG_TIME_NM('30분이내', '2시간이상' ...) 문자열을 정수 분(cook_minutes)으로 정규화해서
+# 'cook_minutes <= 30' 처럼 인덱스를 타는 조건으로 바로 걸러냅니다.
+
+# 파이프라인(필터 -> ML -> 프롬프트 -> 화면)에서 실제로 쓰는 컬럼만 조회
+# (대용량 텍스트인 recipe_steps는 get_or_create_recipe_steps에서 따로 조회)
+RECIPE_COLUMNS = [
+    'RCP_SNO', 'RCP_TTL', 'CKG_NM', 'CKG_MTH_ACTO_NM', 'CKG_TIME_NM',
+    'CKG_INBUN_NM', 'ingredients_json', 'estimated_price',
+]
+# 메모리 카탈로그(frame)에 싣는 컬럼 (재료는 ingredients_json 대신 재료 사전 ID 배열로 따로 보관)
+CATALOG_COLUMNS = [col for col in RECIPE_COLUMNS if col != 'ingredients_json']
+
+# '30분이내' -> 30, '2시간이내' -> 120, '2시간이상' -> 121, 알 수 없음/NULL -> NULL
+# ({col} 자리에 CKG_TIME_NM 또는 NEW.CKG_TIME_NM을 넣어서 사용)
+COOK_MINUTES_SQL = """
+    NULLIF(CASE WHEN {col} LIKE '%시간%' THEN CAST({col} AS INTEGER) * 60
+                ELSE CAST({col} AS INTEGER) END, 0)
+    + (CASE WHEN {col} LIKE '%이상%' THEN 1 ELSE 0 END)
+"""
+
+# '2인분', '6인분이상' -> 인분 수 (숫자가 없으면 NULL)
+SERVINGS_SQL = "NULLIF(CAST({col} AS INTEGER), 0)"
+# 1인분 가격 (가격/인분 정보가 없으면 NULL)
+PRICE_PER_SERVING_SQL = (
+    "CASE WHEN {price} > 0 AND {servings} > 0 THEN CAST(ROUND(1.0 * {price} / {servings}) AS INTEGER) END"
+)
+
+# 프로필 '기타 제약' 문구 -> 허용 조리시간(분). 앞에 있을수록 강한 조건
+COOK_TIME_LIMITS = [
+    ('조리시간 30분 이내', 30),
+    ('조리시간 60분 이내', 60),
+]
+
+_RECIPE_SCHEMA_READY = set()
+
+def ensure_recipe_columns(conn):
+    """
+    recipes 테이블에 cook_minutes 컬럼/트리거와 필터용 인덱스를 (없으면) 추가합니다.
+    기존 행은 한 번만 채우고(backfill), 이후 INSERT/UPDATE는 트리거가 유지합니다.
+    """
+    cursor = conn.cursor()
+    columns = {row[1] for row in cursor.execute("PRAGMA table_info(recipes)")}
+    if not columns:
+        return # recipes 테이블이 아직 없음
+
+    if 'cook_minutes' not in columns:
+        cursor.execute("ALTER TABLE recipes ADD COLUMN cook_minutes INTEGER")
+        cursor.execute(f"UPDATE recipes SET cook_minutes = {COOK_MINUTES_SQL.format(col='CKG_TIME_NM')}")
+        print("✅ (DB 셋업) recipes.cook_minutes 컬럼 생성 및 값 채우기 완료.")
+
+    set_minutes_sql = (
+        f"UPDATE recipes SET cook_minutes = {COOK_MINUTES_SQL.format(col='NEW.CKG_TIME_NM')} "
+        "WHERE rowid = NEW.rowid;"
+    )
+    cursor.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS trg_recipes_cook_minutes_insert AFTER INSERT ON recipes
+    BEGIN {set_minutes_sql} END;
+    """)
+    cursor.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS trg_recipes_cook_minutes_update AFTER UPDATE OF CKG_TIME_NM ON recipes
+    BEGIN {set_minutes_sql} END;
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_recipes_cook_minutes ON recipes(cook_minutes)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_recipes_estimated_price ON recipes(estimated_price)")
+    conn.commit()
+    _RECIPE_SCHEMA_READY.add(_database_file(conn))
+
+def ensure_serving_columns(conn):
+    """
+    recipes 테이블에 servings(인분 수) / price_per_serving(1인분 가격) 컬럼과 트리거를 (없으면) 추가합니다.
+    (ensure_recipe_columns의 cook_minutes와 같은 방식: 한 번 채우고 이후는 트리거가 유지)
+    """
+    cursor = conn.cursor()
+    columns = {row[1] for row in cursor.execute("PRAGMA table_info(recipes)")}
+    if not columns:
+        return # recipes 테이블이 아직 없음
+
+    servings = SERVINGS_SQL.format(col='CKG_INBUN_NM')
+    if 'servings' not in columns:
+        cursor.execute("ALTER TABLE recipes ADD COLUMN servings INTEGER")
+        cursor.execute("ALTER TABLE recipes ADD COLUMN price_per_serving INTEGER")
+        cursor.execute(f"UPDATE recipes SET servings = {servings}")
+        cursor.execute(
+            f"UPDATE recipes SET price_per_serving = "
+            f"{PRICE_PER_SERVING_SQL.format(price='estimated_price', servings='servings')}"
+        )
+        print("✅ (DB 셋업) recipes.servings / price_per_serving 컬럼 생성 및 값 채우기 완료.")
+
+    new_servings = SERVINGS_SQL.format(col='NEW.CKG_INBUN_NM')
+    set_servings_sql = (
+        f"UPDATE recipes SET servings = {new_servings}, "
+        f"price_per_serving = {PRICE_PER_SERVING_SQL.format(price='NEW.estimated_price', servings=new_servings)} "
+        "WHERE rowid = NEW.rowid;"
+    )
+    cursor.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS trg_recipes_servings_insert AFTER INSERT ON recipes
+    BEGIN {set_servings_sql} END;
+    """)
+    cursor.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS trg_recipes_servings_update AFTER UPDATE OF CKG_INBUN_NM, estimated_price ON recipes
+    BEGIN {set_servings_sql} END;
+    """)
+    conn.commit()
+
+def get_cook_time_limit(profile):
+    """프로필의 조리시간 제약 -> 허용 분(minutes). 제약이 없으면 None"""
+    other_restrictions = profile['restrictions_other'] or ''
+    for phrase, minutes in COOK_TIME_LIMITS:
+        if phrase in other_restrictions:
+            return minutes
+    return None
+
+def build_recipe_filter_query(profile, columns=RECIPE_COLUMNS):
+    """
+    (쿼리 빌더) 조리시간/예산 제약을 WHERE 절로 만들어 (sql, params)를 반환합니다.
+    - 조리시간: cook_minutes <= N (NULL = 정보 없음은 기존처럼 제외)
+    - 예산: 대용량 가격 기준 예산의 3배 이하 + 가격 정보 없음(NULL/0)은 통과
+    """
+    conditions = []
+    params = []
+
+    time_limit = get_cook_time_limit(profile)
+    if time_limit:
+        conditions.append("cook_minutes <= ?")
+        params.append(time_limit)
+
+    user_budget = profile.get('budget', 0) # DB에서 가져온 숫자 (없으면 0)
+    if user_budget and user_budget > 0:
+        # [전략] 네이버 가격은 '대용량(묶음)' 기준일 수 있으므로, 
+        # 한 끼 예산(user_budget)의 3배까지는 후보군에 포함시켜 줍니다.
+        conditions.append("(estimated_price <= ? OR estimated_price IS NULL OR estimated_price = 0)")
+        params.append(user_budget * 3)
+
+    # (ORDER BY를 붙이면 SQLite가 인덱스 대신 전체 스캔을 고르므로 정렬은 호출 쪽에서)
+    sql = f"SELECT {', '.join(columns)} FROM recipes"
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    return sql, params
+
+# -----------------------------------------------------------------
+# [신규 추가] 재료 사전(vocabulary) 인코딩
+# -----------------------------------------------------------------
+# ingredients_json 텍스트를 단계마다(필터, TF-IDF, 프롬프트, 상세보기, 레시피 변형) 다시 파싱하던 것을,
+# 재료명/양 문자열마다 정수 ID를 붙인 사전 테이블 + 레시피별 정수 배열(BLOB)로 저장해 둡니다.
+#   - ingredient_vocab(ingredient_id, name) / ingredient_amounts(amount_id, amount)
+#   - recipes.ingredient_ids / ingredient_amount_ids: 같은 순서의 사전 ID 배열 (little-endian int32)
+# 메모리 카탈로그는 모든 레시피의 ID 배열을 이어 붙인 CSR 형태(ids + offsets)로 들고 있고,
+# 재료명 / ID 배열 / 원래 dict는 접근자(names_at / ids_at / ingredients_at)로 꺼냅니다.
+# ingredients_json은 원본 보관용으로 남겨 두되 `encode-ingredients --drop-json`으로 비울 수 있고,
+# 값이 바뀌면 트리거가 ID 배열을 비워서(NULL) 다시 인코딩하기 전까지는 JSON을 직접 파싱합니다.
+
+INGREDIENT_ID_DTYPE = np.dtype('<i4')
+INGREDIENT_ENCODE_BATCH = 20000 # 백필 때 한 번에 인코딩하는 행 수
+# 카탈로그로 읽어 들인 뒤 frame에서는 빼는 재료 원본 컬럼들
+INGREDIENT_SOURCE_COLUMNS = ['ingredients_json', 'ingredient_ids', 'ingredient_amount_ids']
+
+class _VocabularyTable:
+    """
+    문자열 <-> 정수 ID 사전 1개 (추가만 가능, 메모리 ID는 0부터 순서대로).
+    DB 사전 테이블(INTEGER PRIMARY KEY + UNIQUE 문자열)과의 ID 변환표도 함께 들고 있습니다.
+    (DB ID는 SQLite가 매기므로 메모리 ID와 다를 수 있음 -> 변환은 배열 인덱싱 한 번)
+    """
+
+    def __init__(self, table, id_column, value_column):
+        self.table = table
+        self.id_column = id_column
+        self.value_column = value_column
+        self.values = []                             # 메모리 ID -> 문자열
+        self._ids = {}                               # 문자열 -> 메모리 ID
+        self._to_db = np.zeros(0, dtype=np.int32)    # 메모리 ID -> DB ID (0 = 아직 DB에 없음)
+        self._from_db = np.zeros(1, dtype=np.int32)  # DB ID -> 메모리 ID
+        self._db_max_id = 0
+
+    def __len__(self):
+        return len(self.values)
+
+    def id_of(self, value):
+        """문자열의 메모리 ID (처음 보는 문자열이면 새 ID 추가)"""
+        local_id = self._ids.get(value)
+        if local_id is None:
+            local_id = self._ids[value] = len(self.values)
+            self.values.append(value)
+        return local_id
+
+    def _padded_to_db(self):
+        if len(self._to_db) < len(self.values):
+            to_db = np.zeros(len(self.values), dtype=np.int32)
+            to_db[:len(self._to_db)] = self._to_db
+            self._to_db = to_db
+        return self._to_db
+
+    def sync_from_db(self, conn):
+        """DB 사전에서 아직 보지 못한 항목을 가져와 변환표를 갱신 (사전 테이블이 없으면 그대로)"""
+        try:
+            rows = conn.execute(
+                f"SELECT {self.id_column}, {self.value_column} FROM {self.table} "
+                f"WHERE {self.id_column} > ? ORDER BY {self.id_column}",
+                (self._db_max_id,)
+            ).fetchall()
+        except sqlite3.OperationalError:
+            return
+        if not rows:
+            return
+        db_ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+        local_ids = np.fromiter((self.id_of(row[1]) for row in rows), dtype=np.int64, count=len(rows))
+        from_db = np.zeros(int(db_ids[-1]) + 1, dtype=np.int32)
+        from_db[:len(self._from_db)] = self._from_db
+        from_db[db_ids] = local_ids
+        to_db = self._padded_to_db()
+        to_db[local_ids] = db_ids
+        self._from_db, self._db_max_id = from_db, int(db_ids[-1])
+
+    def push_to_db(self, conn):
+        """DB에 아직 없는 항목을 사전 테이블에 추가하고 DB ID를 받아옴 (쓰기 쪽에서 사용)"""
+        missing = np.flatnonzero(self._padded_to_db() == 0)
+        if len(missing):
+            conn.executemany(
+                f"INSERT OR IGNORE INTO {self.table} ({self.value_column}) VALUES (?)",
+                ((self.values[i],) for i in missing.tolist())
+            )
+            self.sync_from_db(conn)
+
+    def to_db(self, local_ids):
+        return self._padded_to_db()[local_ids]
+
+    def from_db(self, db_ids):
+        return self._from_db[db_ids]
+
+
+class IngredientCodec:
+    """
+    재료 dict({재료명: 양}) <-> (재료 ID 배열, 양 ID 배열) 변환기.
+    - names / amounts: 재료명 / 양 사전 (ID -> 문자열은 names.values[i])
+    - encode_rows(): ingredients_json 목록 -> CSR (ids, amount_ids, offsets, valid)
+    - decode_rows(): DB의 ID 배열(BLOB) 목록 -> 같은 CSR (BLOB이 없는 행만 JSON 파싱)
+    양은 문자열로 보관합니다. (숫자 등 문자열이 아닌 값은 str()로 바꿔서 저장)
+    """
+
+    def __init__(self):
+        self.names = _VocabularyTable('ingredient_vocab', 'ingredient_id', 'name')
+        self.amounts = _VocabularyTable('ingredient_amounts', 'amount_id', 'amount')
+
+    def sync_from_db(self, conn):
+        self.names.sync_from_db(conn)
+        self.amounts.sync_from_db(conn)
+
+    def encode_rows(self, json_values):
+        """ingredients_json 목록 -> (재료 ID, 양 ID, offsets, valid) (파싱 실패 행 = 재료 0개 + valid False)"""
+        name_id, amount_id = self.names.id_of, self.amounts.id_of
+        ids, amount_ids, offsets, valid = [], [], [0], []
+        for json_str in json_values:
+            ingredients = _parse_ingredients_json(json_str)
+            valid.append(ingredients is not None)
+            if ingredients:
+                ids.extend(map(name_id, ingredients.keys()))
+                amount_ids.extend(
+                    amount_id(amount if isinstance(amount, str) else "" if amount is None else str(amount))
+                    for amount in ingredients.values()
+                )
+            offsets.append(len(ids))
+        return (
+            np.asarray(ids, dtype=np.int32), np.asarray(amount_ids, dtype=np.int32),
+            np.asarray(offsets, dtype=np.int64), np.asarray(valid, dtype=bool),
+        )
+
+    def decode_rows(self, id_blobs, amount_blobs, json_values):
+        """
+        DB 행들의 (재료 ID BLOB, 양 ID BLOB, ingredients_json) -> encode_rows()와 같은 CSR.
+        BLOB은 한 번에 이어 붙여서 변환표로 바꾸고(벡터 연산), BLOB이 없는 행만 JSON을 파싱해서 끼워 넣습니다.
+        """
+        n_rows = len(id_blobs)
+        encoded = np.fromiter(
+            (ids is not None and amounts is not None for ids, amounts in zip(id_blobs, amount_blobs)),
+            dtype=bool, count=n_rows
+        )
+        lengths = np.fromiter(
+            (len(ids) // INGREDIENT_ID_DTYPE.itemsize if ok else 0 for ids, ok in zip(id_blobs, encoded)),
+            dtype=np.int64, count=n_rows
+        )
+        ids = self.names.from_db(np.frombuffer(
+            b"".join(blob for blob, ok in zip(id_blobs, encoded) if ok), dtype=INGREDIENT_ID_DTYPE
+        ))
+        amount_ids = self.amounts.from_db(np.frombuffer(
+            b"".join(blob for blob, ok in zip(amount_blobs, encoded) if ok), dtype=INGREDIENT_ID_DTYPE
+        ))
+        valid = encoded.copy()
+
+        pending = np.flatnonzero(~encoded)
+        if len(pending):
+            extra_ids, extra_amount_ids, extra_offsets, extra_valid = self.encode_rows(
+                [json_values[i] for i in pending.tolist()]
+            )
+            lengths[pending] = np.diff(extra_offsets)
+            valid[pending] = extra_valid
+            from_blob = np.repeat(encoded, lengths) # 이어 붙인 배열의 각 칸이 BLOB 행에서 왔는지
+            merged_ids = np.empty(len(from_blob), dtype=np.int32)
+            merged_ids[from_blob], merged_ids[~from_blob] = ids, extra_ids
+            merged_amount_ids = np.empty(len(from_blob), dtype=np.int32)
+            merged_amount_ids[from_blob], merged_amount_ids[~from_blob] = amount_ids, extra_amount_ids
+            ids, amount_ids = merged_ids, merged_amount_ids
+
+        offsets = np.zeros(n_rows + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        return ids.astype(np.int32, copy=False), amount_ids.astype(np.int32, copy=False), offsets, valid
+
+    def decode_frame(self, recipes_df):
+        """DataFrame의 재료 원본 컬럼(ingredient_ids / ingredient_amount_ids / ingredients_json) -> CSR"""
+        def column(name):
+            return recipes_df[name].tolist() if name in recipes_df else [None] * len(recipes_df)
+        return self.decode_rows(column('ingredient_ids'), column('ingredient_amount_ids'), column('ingredients_json'))
+
+    def decode(self, ids, amount_ids):
+        """ID 배열 -> 원래 dict ({재료명: 양}, 순서 유지)"""
+        names, amounts = self.names.values, self.amounts.values
+        return {names[i]: amounts[j] for i, j in zip(ids.tolist(), amount_ids.tolist())}
+
+    def encode_to_db(self, conn, json_values):
+        """
+        (쓰기 쪽) ingredients_json 목록 -> 행마다 (재료 ID BLOB, 양 ID BLOB) / 파싱 실패 행은 (None, None).
+        새 재료명/양은 사전 테이블에 먼저 추가합니다. (호출한 쪽 트랜잭션 안에서 실행)
+        """
+        ids, amount_ids, offsets, valid = self.encode_rows(json_values)
+        self.names.push_to_db(conn)
+        self.amounts.push_to_db(conn)
+        id_bytes = self.names.to_db(ids).astype(INGREDIENT_ID_DTYPE).tobytes()
+        amount_bytes = self.amounts.to_db(amount_ids).astype(INGREDIENT_ID_DTYPE).tobytes()
+        byte_offsets = (offsets * INGREDIENT_ID_DTYPE.itemsize).tolist()
+        return [
+            (id_bytes[start:end], amount_bytes[start:end]) if ok else (None, None)
+            for start, end, ok in zip(byte_offsets[:-1], byte_offsets[1:], valid.tolist())
+        ]
+
+
+def _parse_ingredients_json(json_str):
+    """(HELPER) ingredients_json -> dict (파싱 실패 / dict가 아님 = None)"""
+    try:
+        ingredients = json.loads(json_str)
+    except (json.JSONDecodeError, TypeError):
+        return None
+    return ingredients if isinstance(ingredients, dict) else None
+
+def ensure_ingredient_encoding(conn, batch_size=INGREDIENT_ENCODE_BATCH):
+    """
+    재료 사전 테이블, recipes.ingredient_ids / ingredient_amount_ids 컬럼과 트리거를 (없으면) 만들고,
+    아직 인코딩되지 않은 행(ID 배열이 NULL + JSON이 있는 행)을 인코딩해서 채웁니다. 반환: 채운 행 수
+    (ID 배열은 같은 내용의 다른 표현이므로 카탈로그 버전은 올리지 않음)
+    """
+    cursor = conn.cursor()
+    columns = {row[1] for row in cursor.execute("PRAGMA table_info(recipes)")}
+    if not columns:
+        return 0 # recipes 테이블이 아직 없음
+
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS ingredient_vocab (
+        ingredient_id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL UNIQUE
+    );
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS ingredient_amounts (
+        amount_id INTEGER PRIMARY KEY,
+        amount TEXT NOT NULL UNIQUE
+    );
+    """)
+    if 'ingredient_ids' not in columns:
+        cursor.execute("ALTER TABLE recipes ADD COLUMN ingredient_ids BLOB")
+        cursor.execute("ALTER TABLE recipes ADD COLUMN ingredient_amount_ids BLOB")
+    # JSON만 바뀌고 ID 배열은 그대로인 UPDATE -> ID 배열을 비워서 '다시 인코딩 필요'로 표시
+    # (ID 배열까지 같이 쓰는 적재와, JSON을 NULL로 비우는 --drop-json은 제외)
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS trg_recipes_ingredients_stale AFTER UPDATE OF ingredients_json ON recipes
+    WHEN NEW.ingredients_json IS NOT NULL AND NEW.ingredients_json IS NOT OLD.ingredients_json
+         AND NEW.ingredient_ids IS OLD.ingredient_ids
+    BEGIN UPDATE recipes SET ingredient_ids = NULL, ingredient_amount_ids = NULL WHERE rowid = NEW.rowid; END;
+    """)
+
+    codec = IngredientCodec()
+    codec.sync_from_db(conn)
+    encoded = 0
+    last_rowid = -2 ** 63
+    while True:
+        rows = cursor.execute(
+            "SELECT rowid, ingredients_json FROM recipes "
+            "WHERE rowid > ? AND ingredients_json IS NOT NULL "
+            "AND (ingredient_ids IS NULL OR ingredient_amount_ids IS NULL) ORDER BY rowid LIMIT ?",
+            (last_rowid, batch_size)
+        ).fetchall()
+        if not rows:
+            break
+        last_rowid = rows[-1][0]
+        blobs = codec.encode_to_db(conn, [json_str for _, json_str in rows])
+        updates = [(ids, amounts, rowid) for (ids, amounts), (rowid, _) in zip(blobs, rows) if ids is not None]
+        cursor.executemany(
+            "UPDATE recipes SET ingredient_ids = ?, ingredient_amount_ids = ? WHERE rowid = ?", updates
+        )
+        encoded += len(updates)
+    conn.commit()
+    if encoded:
+        print(f"✅ (DB 셋업) 레시피 {encoded:,}개의 재료를 사전 ID 배열로 인코딩 "
+              f"(재료명 {len(codec.names):,}개, 양 {len(codec.amounts):,}개)")
+    return encoded
+
+def drop_ingredients_json(conn):
+    """
+    ID 배열로 인코딩된 행의 ingredients_json을 비웁니다. (DB 크기 절약, 내용은 ID 배열 + 사전에서 복원)
+    재료 내용은 그대로이므로 카탈로그 버전은 올리지 않습니다. 반환: 비운 행 수
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # 버전 트리거만 같은 트랜잭션 안에서 잠시 내렸다가 다시 만듦 (다른 연결은 중간 상태를 못 봄)
+        conn.execute("DROP TRIGGER IF EXISTS trg_recipes_version_update")
+        cleared = conn.execute(
+            "UPDATE recipes SET ingredients_json = NULL WHERE ingredients_json IS NOT NULL "
+            "AND ingredient_ids IS NOT NULL AND ingredient_amount_ids IS NOT NULL"
+        ).rowcount
+        ensure_catalog_versioning(conn) # 트리거 복구 + commit
+    except BaseException:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+    return cleared
+
+def _catalog_select_sql(conn, where=""):
+    """
+    카탈로그용 SELECT 문: CATALOG_COLUMNS + 재료 ID 배열 (인코딩 안 된 행만 ingredients_json)
+    (재료 인코딩 마이그레이션 전의 DB면 ingredients_json을 그대로 읽음)
+    """
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(recipes)")}
+    if 'ingredient_ids' in columns:
+        ingredient_columns = (
+            "ingredient_ids, ingredient_amount_ids, "
+            "CASE WHEN ingredient_ids IS NULL OR ingredient_amount_ids IS NULL "
+            "THEN ingredients_json END AS ingredients_json"
+        )
+    else:
+        ingredient_columns = "ingredients_json"
+    return f"SELECT {', '.join(CATALOG_COLUMNS)}, {ingredient_columns} FROM recipes {where}ORDER BY rowid"
+
+# -----------------------------------------------------------------
+# [신규 추가] 프로세스 전역 레시피 카탈로그 (캐시)
+# -----------------------------------------------------------------
+# 추천 버튼을 누를 때마다 recipes 테이블 전체를 다시 읽고 JSON을 다시 파싱하던 것을,
+# 프로세스당 '카탈로그 버전마다 한 번'만 읽어서 메모리에 들고 있도록 바꿉니다.
+# (버전은 catalog_meta 트리거가 관리하므로, 다른 프로세스/연결의 변경도 감지됨)
+
+class RecipeCatalog:
+    """
+    recipes 테이블 스냅샷 (CATALOG_COLUMNS만, rowid 순서 + 이후 추가된 행은 뒤에 이어 붙임).
+    재료는 행마다 dict/JSON으로 들고 있지 않고, 재료 사전(codec) ID의 CSR 배열로 보관합니다.
+      - ingredient_ids:        모든 레시피의 재료 ID를 이어 붙인 int32 배열
+      - ingredient_amount_ids: 같은 순서의 양(amount) ID 배열
+      - ingredient_offsets:    i번째 레시피의 재료 = ids[offsets[i]:offsets[i+1]]
+      - valid:                 재료 정보 해석 성공 여부 (ingredients_json이 깨진 레시피 = False)
+    금지 재료 비트맵 인덱스(restriction_index)도 같은 행 순서로 함께 만듭니다.
+    """
+
+    def __init__(self, version, recipes_df, db_file=None, append_only_since=None, codec=None):
+        self.version = version
+        self.db_file = db_file
+        # 이 버전 이후로는 행 추가만 있었음 (이 버전 이상의 인덱스는 새 행만 이어 붙이면 됨)
+        self.append_only_since = version if append_only_since is None else append_only_since
+        # 재료 사전은 이어 붙인 카탈로그끼리 공유 (추가만 되므로 예전 카탈로그의 ID도 그대로 유효)
+        self.codec = codec if codec is not None else IngredientCodec()
+        recipes_df = recipes_df.reset_index(drop=True)
+        ids, amount_ids, offsets, valid = self.codec.decode_frame(recipes_df)
+        self.frame = recipes_df.drop(columns=INGREDIENT_SOURCE_COLUMNS, errors='ignore')
+        self.recipe_ids = self.frame['RCP_SNO'].to_numpy()
+        self.n_rows = len(self.frame)
+
+        self.ingredient_ids = ids
+        self.ingredient_amount_ids = amount_ids
+        self.ingredient_offsets = offsets
+        self.valid = valid
+        self.restriction_index = RestrictionIndex(self.recipe_ids, ids, offsets, valid, self.codec.names.values)
+
+    def appended(self, version, new_rows_df):
+        """
+        새로 추가된 행만 변환해서 뒤에 이어 붙인 새 카탈로그를 반환합니다.
+        (기존 카탈로그 객체는 그대로 두므로, 이미 그걸 쓰고 있는 요청에 영향 없음)
+        """
+        new_rows_df = new_rows_df.reset_index(drop=True)
+        ids, amount_ids, offsets, valid = self.codec.decode_frame(new_rows_df)
+        new_rows_df = new_rows_df.drop(columns=INGREDIENT_SOURCE_COLUMNS, errors='ignore')
+
+        catalog = copy.copy(self)
+        catalog.version = version
+        catalog.frame = pd.concat([self.frame, new_rows_df], ignore_index=True)
+        catalog.recipe_ids = catalog.frame['RCP_SNO'].to_numpy()
+        catalog.n_rows = len(catalog.frame)
+        catalog.ingredient_ids = np.concatenate([self.ingredient_ids, ids])
+        catalog.ingredient_amount_ids = np.concatenate([self.ingredient_amount_ids, amount_ids])
+        catalog.ingredient_offsets = np.concatenate([
+            self.ingredient_offsets, self.ingredient_offsets[-1] + offsets[1:]
+        ])
+        catalog.valid = np.concatenate([self.valid, valid])
+        catalog.restriction_index = self.restriction_index.appended(
+            new_rows_df['RCP_SNO'].to_numpy(), ids, offsets, valid
+        )
+        return catalog
+
+    def positions(self, recipe_ids):
+        """RCP_SNO 목록 -> 카탈로그 행 번호 (없으면 -1)"""
+        return self.restriction_index.positions(recipe_ids)
+
+    def _span(self, position):
+        if position < 0 or not self.valid[position]:
+            return None
+        return slice(self.ingredient_offsets[position], self.ingredient_offsets[position + 1])
+
+    def ids_at(self, position):
+        """카탈로그 행 번호의 재료 사전 ID 배열 (파싱 실패 레시피는 None)"""
+        span = self._span(position)
+        return None if span is None else self.ingredient_ids[span]
+
+    def names_at(self, position):
+        """카탈로그 행 번호의 재료명 리스트 (파싱 실패 레시피는 None)"""
+        span = self._span(position)
+        if span is None:
+            return None
+        names = self.codec.names.values
+        return [names[i] for i in self.ingredient_ids[span].tolist()]
+
+    def ingredients_at(self, position):
+        """카탈로그 행 번호의 원래 재료 dict ({재료명: 양}, 파싱 실패 레시피는 None)"""
+        span = self._span(position)
+        if span is None:
+            return None
+        return self.codec.decode(self.ingredient_ids[span], self.ingredient_amount_ids[span])
+
+    def ingredient_vocabulary(self):
+        """이 카탈로그 행들이 실제로 쓰는 재료명 목록 (중복 없음, 재료 사전 ID 순서)"""
+        names = self.codec.names.values
+        return [names[i] for i in np.unique(self.ingredient_ids).tolist()]
+
+    def ingredient_matrix(self):
+        """(레시피 x 재료 사전) 재료 포함 여부 희소 행렬 (CSR 배열을 그대로 사용, 파싱 없음)"""
+        return sparse.csr_matrix(
+            (np.ones(len(self.ingredient_ids)), self.ingredient_ids, self.ingredient_offsets),
+            shape=(self.n_rows, len(self.codec.names)),
+        )
+
+    def document_texts(self, start=0):
+        """start번째 행부터의 '제목 + 요리명 + 재료명' 텍스트 (LSA 학습/추가용)"""
+        titles = self.frame['RCP_TTL'].iloc[start:].fillna('').astype(str).to_numpy()
+        dish_names = self.frame['CKG_NM'].iloc[start:].fillna('').astype(str).to_numpy()
+        return [
+            f"{title} {dish_name} {ingredients}"
+            for title, dish_name, ingredients in zip(titles, dish_names, self.ingredient_texts(start))
+        ]
+
+    def ingredient_texts(self, start=0):
+        """start번째 행부터의 '재료명 공백 연결' 텍스트 (TF-IDF delta/LSA용, 파싱 실패 = 빈 문자열)"""
+        names = self.codec.names.values
+        offsets = self.ingredient_offsets[start:].tolist()
+        ids = self.ingredient_ids[offsets[0]:].tolist() if offsets else []
+        base = offsets[0] if offsets else 0
+        return [
+            " ".join([names[i] for i in ids[begin - base:end - base]]) if ok else ""
+            for begin, end, ok in zip(offsets[:-1], offsets[1:], self.valid[start:].tolist())
+        ]
+
+
+# 프로세스 전역 캐시: DB 파일 -> RecipeCatalog
+_CATALOG_CACHE = {}
+_CATALOG_LOCK = threading.Lock()
+
+def get_recipe_catalog(conn=None):
+    """
+    카탈로그 버전이 같으면 캐시된 카탈로그를, 바뀌었으면 새로 읽어서 반환합니다.
+    (conn을 주지 않으면 이 스레드의 공유 연결(get_db_connection)로 버전만 확인)
+    """
+    if conn is None:
+        return get_recipe_catalog(get_db_connection())
+
+    db_file = _database_file(conn)
+    version = get_catalog_version(conn)
+    catalog = _CATALOG_CACHE.get(db_file)
+    if catalog and catalog.version == version:
+        return catalog
+
+    with _CATALOG_LOCK:
+        catalog = _CATALOG_CACHE.get(db_file)
+        if catalog and catalog.version == version:
+            return catalog
+        
+        # 그 사이 '새 행 추가'만 있었다면 새 행만 읽어서 이어 붙임
+        if catalog and catalog.version < version:
+            appended = _append_new_recipes(conn, catalog, version)
+            if appended is not None:
+                _CATALOG_CACHE[db_file] = appended
+                print(f"✅ (카탈로그) 새 레시피 {appended.n_rows - catalog.n_rows}개 추가 "
+                      f"(총 {appended.n_rows}개, 카탈로그 v{version})")
+                return appended
+        
+        append_only_since = get_append_only_since(conn)
+        recipes_df = pd.read_sql(_catalog_select_sql(conn), conn)
+        # 재료 사전은 레시피를 읽은 '뒤에' 읽음 (사전은 추가만 되므로 읽은 행의 ID는 모두 들어 있음)
+        codec = IngredientCodec()
+        codec.sync_from_db(conn)
+        catalog = RecipeCatalog(version, recipes_df, db_file=db_file, append_only_since=append_only_since, codec=codec)
+        _CATALOG_CACHE[db_file] = catalog
+        print(f"✅ (카탈로그) 레시피 {catalog.n_rows}개 로드 완료 (카탈로그 v{version}, 재료명 {len(codec.names):,}개)")
+        return catalog
+
+def _append_new_recipes(conn, catalog, version):
+    """
+    catalog.version -> version 사이의 변경이 모두 '새 행 추가'이면 새 행만 읽어서 이어 붙인
+    카탈로그를, 수정/삭제가 섞여 있거나 기록이 없으면 None(= 전체 다시 읽기)을 반환합니다.
+    """
+    changes = get_catalog_changes(conn, catalog.version)
+    if changes is not None:
+        # 버전을 읽은 뒤에 들어온 변경은 다음 요청에서 반영
+        changes = [change for change in changes if change[0] <= version]
+    if changes is None or len(changes) != version - catalog.version:
+        return None
+    if any(op != 'insert' for _, _, op in changes):
+        return None
+    new_rows_df = pd.read_sql(
+        _catalog_select_sql(
+            conn, "WHERE rowid IN (SELECT row_id FROM catalog_changes WHERE version > ? AND version <= ?) "
+        ),
+        conn, params=(catalog.version, version)
+    )
+    # INSERT OR REPLACE처럼 기존 레시피를 덮어쓴 경우는 '추가'가 아님
+    if len(new_rows_df) != len(changes) or (catalog.positions(new_rows_df['RCP_SNO'].to_numpy()) >= 0).any():
+        return None
+    catalog.codec.sync_from_db(conn)
+    return catalog.appended(version, new_rows_df)
+
+def get_restriction_index(conn):
+    """현재 카탈로그 버전의 금지 재료 비트맵 인덱스"""
+    return get_recipe_catalog(conn).restriction_index
+
+def _catalog_positions(recipes_df, catalog=None):
+    """(HELPER) DataFrame 행 -> (카탈로그, 카탈로그 행 번호 배열(카탈로그에 없으면 -1))"""
+    if catalog is None:
+        try:
+            catalog = get_recipe_catalog()
+        except Exception as e:
+            print(f"⚠️ (카탈로그) 로드 실패, JSON을 직접 파싱합니다: {e}")
+    positions = (
+        catalog.positions(recipes_df['RCP_SNO'].to_numpy())
+        if catalog is not None and 'RCP_SNO' in recipes_df
+        else np.full(len(recipes_df), -1)
+    )
+    json_values = (
+        recipes_df['ingredients_json'].tolist() if 'ingredients_json' in recipes_df else [None] * len(recipes_df)
+    )
+    return catalog, positions, json_values
+
+def get_ingredient_names(recipes_df, catalog=None):
+    """
+    (HELPER) DataFrame 행 순서대로 재료명 리스트를 반환합니다. (파싱 실패 = None)
+    카탈로그에 있는 레시피는 재료 사전 ID에서 바로 꺼내고, 없는 레시피만 JSON을 직접 파싱합니다.
+    """
+    catalog, positions, json_values = _catalog_positions(recipes_df, catalog)
+    names_list = []
+    for position, json_str in zip(positions, json_values):
+        if position >= 0:
+            names_list.append(catalog.names_at(position))
+            continue
+        ingredients = _parse_ingredients_json(json_str)
+        names_list.append(None if ingredients is None else list(ingredients))
+    return names_list
+
+def attach_ingredients(recipes_df, catalog=None):
+    """
+    (HELPER) 후보 행들에 'ingredients'({재료명: 양} dict, 파싱 실패 = None) 컬럼을 붙인 복사본.
+    화면(상세보기) / 조리법 생성 / 레시피 변형이 JSON을 다시 파싱하지 않고 이 dict를 그대로 씁니다.
+    """
+    catalog, positions, json_values = _catalog_positions(recipes_df, catalog)
+    ingredients = [
+        catalog.ingredients_at(position) if position >= 0 else _parse_ingredients_json(json_str)
+        for position, json_str in zip(positions, json_values)
+    ]
+    return recipes_df.assign(ingredients=ingredients)
+
+def format_ingredients(ingredients):
+    """(HELPER) 재료 dict(또는 ingredients_json 문자열) -> '재료명 양, ...' 프롬프트용 텍스트"""
+    if isinstance(ingredients, str):
+        parsed = _parse_ingredients_json(ingredients)
+        if parsed is None:
+            return ingredients # JSON이 아니면 원문 그대로
+        ingredients = parsed
+    if ingredients is None:
+        return "재료 정보 없음"
+    return ", ".join([f"{k} {v}" for k, v in ingredients.items()])
+
+def recommend_recipes_by_filter(conn, profile, restrictions):
+    """
+    (1차 필터링) 'recipes' 테이블에서 금지 재료 + 시간 + 예산 제약을 필터링합니다.
+    - 레시피 데이터: 프로세스 전역 카탈로그 (버전이 바뀔 때만 다시 로드)
+    - 금지 재료: 카탈로그의 비트맵 인덱스로 판정
+    - 시간/예산: SQL(WHERE + 인덱스)로 통과한 RCP_SNO만 조회해서 교집합
+    """
+    try:
+        if _database_file(conn) not in _RECIPE_SCHEMA_READY:
+            ensure_recipe_columns(conn)
+        
+        catalog = get_recipe_catalog(conn)
+        
+        # --- 1. 재료 필터링 ---
+        # 카탈로그 버전별로 캐시된 비트맵 인덱스에서 [금지 키워드 OR] -> [NOT]
+        allowed = ~catalog.restriction_index.blocked_mask(restrictions)
+        print(f"✅ (1차-재료) {catalog.n_rows}개 중 {int(allowed.sum())}개 레시피가 안전합니다.")
+        
+        # --- 2. 시간 + 예산 필터링 (SQL, RCP_SNO만 조회) ---
+        time_limit = get_cook_time_limit(profile)
+        user_budget = profile.get('budget', 0)
+        sql, params = build_recipe_filter_query(profile, columns=['RCP_SNO'])
+        
+        if params:
+            passed_ids = [row[0] for row in conn.execute(sql, params)]
+            positions = catalog.positions(passed_ids)
+            passed = np.zeros(catalog.n_rows, dtype=bool)
+            passed[positions[positions >= 0]] = True
+            allowed &= passed
+        
+        if time_limit:
+            print(f"✅ (1차-시간) 시간 제약({time_limit}분 이내) 적용.")
+        else:
+            print("시간 제약 없음. 재료 필터링 결과만 사용합니다.")
+        if user_budget and user_budget > 0:
+            print(f"💰 (1차-예산) {user_budget:,}원 예산 적용 -> 대용량 기준 {user_budget * 3:,}원 이하.")
+        else:
+            print("💰 (1차-예산) 예산 제약 없음.")
+        
+        final_filtered_df = catalog.frame[allowed]
+        print(f"✅ (1차-최종) {len(final_filtered_df)}개 레시피만 남김.")
+        
+        return final_filtered_df
+    
+    except Exception as e:
+        print(f"필터링 중 오류: {e}")
+        return pd.DataFrame()
+    
+
+
+# -----------------------------------------------------------------
+# [신규 추가] 공유 Gemini 클라이언트 (프로세스당 1개)
+# -----------------------------------------------------------------
+# 예전에는 함수마다 genai.configure() + GenerativeModel(...)을 새로 만들었는데,
+# configure()는 호출될 때마다 라이브러리 내부 클라이언트(HTTP/gRPC 연결)를 버리고 새로 만듭니다.
+# 그래서 configure는 클라이언트 생성 시 한 번만 하고, 모델 핸들도 (안전 설정별로) 재사용합니다.
+# 테스트에서는 set_gemini_client()로 가짜 클라이언트를 끼우거나,
+# BOBFIT_GEMINI_ENDPOINT(+ BOBFIT_GEMINI_TRANSPORT=rest)로 로컬 가짜 서버를 바라보게 할 수 있습니다.
+
+# 조리법 생성/레시피 변형용 안전 설정 (요리 도구/칼 등이 막히지 않도록 해제)
+RELAXED_SAFETY_SETTINGS = (
+    {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"},
+    {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"},
+)
+
+class GeminiClient:
+    """
+    Gemini API 호출 창구. (API 키/엔드포인트 설정 + 모델 핸들 캐시)
+    - generate(prompt, safety_settings=None, stream=False, timeout=None, generation_config=None)
+      -> generate_content 응답
+    """
+    def __init__(self, api_key, model_name=None, timeout=None, endpoint=None, transport=None):
+        self.api_key = api_key
+        self.model_name = model_name or GEMINI_MODEL_NAME
+        self.timeout = GEMINI_REQUEST_TIMEOUT if timeout is None else timeout
+        self.endpoint = endpoint if endpoint is not None else GEMINI_API_ENDPOINT
+        self.transport = transport if transport is not None else GEMINI_TRANSPORT
+        self._models = {}
+        self._lock = threading.Lock()
+        
+        client_options = {'api_endpoint': self.endpoint} if self.endpoint else None
+        genai.configure(api_key=api_key, transport=self.transport, client_options=client_options)
+        where = f", 엔드포인트: {self.endpoint}" if self.endpoint else ""
+        print(f"🔌 (Gemini) 클라이언트 생성 (모델: {self.model_name}, 제한 시간: {self.timeout:g}초{where})")
+    
+    def model(self, safety_settings=None):
+        """안전 설정별 GenerativeModel (한 번 만들면 재사용, 내부 연결도 공유)"""
+        key = tuple(tuple(sorted(setting.items())) for setting in safety_settings or ())
+        with self._lock:
+            if key not in self._models:
+                self._models[key] = genai.GenerativeModel(
+                    self.model_name, safety_settings=[dict(setting) for setting in safety_settings or ()] or None
+                )
+            return self._models[key]
+    
+    def generate(self, prompt, safety_settings=None, stream=False, timeout=None, generation_config=None):
+        timeout = self.timeout if timeout is None else timeout
+        return self.model(safety_settings).generate_content(
+            prompt, generation_config=generation_config, stream=stream,
+            request_options={'timeout': timeout} if timeout else None
+        )
+
+_GEMINI_CLIENT = None
+_GEMINI_CLIENT_LOCK = threading.Lock()
+
+def get_gemini_client(api_key=None):
+    """
+    프로세스 공유 Gemini 클라이언트를 반환합니다. (처음 한 번만 생성)
+    다른 API 키가 들어오면 그 키로 새로 만듭니다. (set_gemini_client로 끼운 클라이언트는 그대로 사용)
+    """
+    global _GEMINI_CLIENT
+    api_key = api_key or YOUR_API_KEY
+    with _GEMINI_CLIENT_LOCK:
+        client = _GEMINI_CLIENT
+        if client is None or (isinstance(client, GeminiClient) and client.api_key != api_key):
+            client = _GEMINI_CLIENT = GeminiClient(api_key)
+        return client
+
+def set_gemini_client(client):
+    """
+    공유 Gemini 클라이언트를 교체합니다. (테스트용 가짜 클라이언트 주입, None이면 다음 호출 때 새로 생성)
+    - client: GeminiClient.generate와 같은 인자를 받는 generate()와 model_name을 가진 객체
+    이전 클라이언트를 반환합니다.
+    """
+    global _GEMINI_CLIENT
+    with _GEMINI_CLIENT_LOCK:
+        previous, _GEMINI_CLIENT = _GEMINI_CLIENT, client
+    return previous
+
+
+# -----------------------------------------------------------------
+# [신규 추가] Gemini 호출 속도 제한 + 우선순위 스케줄러
+# -----------------------------------------------------------------
+# 식단 추천 버튼, 조리법 생성, 레시피 변형, 백그라운드 미리 생성이 같은 API 할당량을 나눠 씁니다.
+# 토큰 버킷(분당 GEMINI_RATE_LIMIT_RPM, 최대 GEMINI_RATE_LIMIT_BURST개)에서 토큰을 받아야 호출할 수 있고,
+# 기다리는 요청은 (우선순위, 그 사용자가 지금까지 받은 토큰 수, 도착 순서) 순으로 줄을 섭니다.
+#   - 우선순위: 식단 추천/키워드(interactive) > 조리법/레시피 변형(on_demand) > 백그라운드(background)
+#   - 같은 우선순위 안에서는 적게 받은 사용자가 먼저 (한 사용자가 몰아서 써도 다른 사용자가 밀리지 않게)
+#   - 백그라운드 작업은 버킷에 GEMINI_BACKGROUND_RESERVE개 이상 남아 있을 때만 가져감
+#     (백그라운드가 돌고 있어도 추천 버튼 대기 시간이 늘지 않도록)
+# GEMINI_RATE_LIMIT_DB를 지정하면 버킷 잔량을 SQLite 파일에 두고 여러 프로세스가 나눠 씁니다. (줄 세우기는 프로세스별)
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_ON_DEMAND = 1
+PRIORITY_BACKGROUND = 2
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_ON_DEMAND: "on_demand", PRIORITY_BACKGROUND: "background"}
+GEMINI_BACKGROUND_RESERVE = max(1, GEMINI_RATE_LIMIT_BURST // 4) # 백그라운드가 남겨 둬야 하는 토큰 수
+
+class GeminiRateLimitTimeout(RuntimeError):
+    """제한 시간 안에 호출 순서(토큰)를 받지 못했을 때 (API 장애가 아니므로 브레이커에 집계 X)"""
+
+class GeminiRateLimiter:
+    """
+    우선순위 + 사용자별 공정 분배 토큰 버킷.
+    - acquire(priority, user=None, timeout=None) -> 기다린 시간(초). timeout 안에 못 받으면 GeminiRateLimitTimeout
+    - stats(): 우선순위별 처리 수/대기 중인 수/대기 시간(p50, p99, max)
+    """
+    def __init__(self, rate_per_minute=GEMINI_RATE_LIMIT_RPM, burst=GEMINI_RATE_LIMIT_BURST, shared_db=None,
+                 background_reserve=GEMINI_BACKGROUND_RESERVE, name="gemini"):
+        self.rate = rate_per_minute / 60.0
+        self.burst = burst
+        self.background_reserve = background_reserve
+        self.shared_db = shared_db
+        self.name = name
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._cond = threading.Condition()
+        self._queue = [] # heap: (priority, 사용자가 받은(받을) 순번 수, 도착 순서)
+        self._sequence = itertools.count()
+        self._served = {} # 사용자별 발급한 순번 수 (대기 중인 것 포함)
+        self._virtual = 0 # 마지막으로 토큰을 받은 순번 (오래 쉬던 사용자가 밀린 몫을 한꺼번에 가져가지 않게)
+        self._waits = {priority: deque(maxlen=1000) for priority in PRIORITY_NAMES}
+        self._granted = dict.fromkeys(PRIORITY_NAMES, 0)
+        self._timeouts = dict.fromkeys(PRIORITY_NAMES, 0)
+        if shared_db:
+            with contextlib.closing(sqlite3.connect(shared_db, timeout=5)) as conn:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("CREATE TABLE IF NOT EXISTS rate_buckets (name TEXT PRIMARY KEY, tokens REAL, updated REAL)")
+                conn.execute("INSERT OR IGNORE INTO rate_buckets VALUES (?, ?, ?)", (name, float(burst), time.time()))
+                conn.commit()
+    
+    def _take(self, reserve):
+        """토큰 1개를 가져오면 0, 아니면 토큰이 찰 때까지 남은 시간(초)"""
+        if self.shared_db:
+            return self._take_shared(reserve)
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self._tokens - 1 >= reserve:
+            self._tokens -= 1
+            return 0.0
+        return (1 + reserve - self._tokens) / self.rate
+    
+    def _take_shared(self, reserve):
+        with contextlib.closing(sqlite3.connect(self.shared_db, timeout=5, isolation_level=None)) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                tokens, updated = conn.execute(
+                    "SELECT tokens, updated FROM rate_buckets WHERE name = ?", (self.name,)
+                ).fetchone()
+                now = time.time()
+                tokens = min(self.burst, tokens + max(0.0, now - updated) * self.rate)
+                wait = 0.0 if tokens - 1 >= reserve else (1 + reserve - tokens) / self.rate
+                if wait == 0.0:
+                    tokens -= 1
+                conn.execute("UPDATE rate_buckets SET tokens = ?, updated = ? WHERE name = ?", (tokens, now, self.name))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return wait
+    
+    def acquire(self, priority=PRIORITY_INTERACTIVE, user=None, timeout=None):
+        if self.rate <= 0:
+            return 0.0
+        reserve = self.background_reserve if priority >= PRIORITY_BACKGROUND else 0
+        start = time.monotonic()
+        with self._cond:
+            entry = (priority, max(self._served.get(user, 0), self._virtual), next(self._sequence))
+            self._served[user] = entry[1] + 1
+            heapq.heappush(self._queue, entry)
+            while True:
+                wait = None
+                if self._queue[0] == entry:
+                    wait = self._take(reserve)
+                    if wait == 0.0:
+                        heapq.heappop(self._queue)
+                        self._virtual = max(self._virtual, entry[1])
+                        waited = time.monotonic() - start
+                        self._granted[priority] += 1
+                        self._waits[priority].append(waited)
+                        self._cond.notify_all() # 다음 순서에게 차례 넘김
+                        return waited
+                remaining = None if timeout is None else timeout - (time.monotonic() - start)
+                if remaining is not None and remaining <= 0:
+                    self._queue.remove(entry)
+                    heapq.heapify(self._queue)
+                    self._served[user] = entry[1]
+                    self._timeouts[priority] += 1
+                    self._cond.notify_all()
+                    raise GeminiRateLimitTimeout(
+                        f"Gemini 호출 순서를 {timeout:g}초 안에 받지 못했습니다. ({PRIORITY_NAMES[priority]})"
+                    )
+                waits = [value for value in (wait, remaining) if value is not None]
+                self._cond.wait(min(waits) if waits else None)
+    
+    def stats(self):
+        """(지표) 우선순위별 처리 수, 대기 중인 수, 제한 시간 초과 수, 대기 시간(ms)"""
+        with self._cond:
+            queued = dict.fromkeys(PRIORITY_NAMES, 0)
+            for priority, _, _ in self._queue:
+                queued[priority] += 1
+            result = {}
+            for priority, name in PRIORITY_NAMES.items():
+                waits = np.sort(np.fromiter(self._waits[priority], dtype=float)) * 1000
+                result[name] = {
+                    'granted': self._granted[priority], 'queued': queued[priority], 'timeouts': self._timeouts[priority],
+                    'wait_p50_ms': float(np.percentile(waits, 50)) if len(waits) else 0.0,
+                    'wait_p99_ms': float(np.percentile(waits, 99)) if len(waits) else 0.0,
+                    'wait_max_ms': float(waits[-1]) if len(waits) else 0.0,
+                }
+            return result
+
+_GEMINI_RATE_LIMITER = GeminiRateLimiter(shared_db=GEMINI_RATE_LIMIT_DB)
+
+
+# -----------------------------------------------------------------
+# [신규 추가] Gemini 호출 재시도 + 서킷 브레이커
+# -----------------------------------------------------------------
+# 일시적인 오류(429 요청 과다, 500/503 서버 오류, 504/시간 초과, 연결 끊김)는
+# 지수 백오프(+무작위 지터)로 다시 시도하되, 요청 하나의 전체 제한 시간(deadline)을 넘기지 않습니다.
+# 연속으로 GEMINI_BREAKER_THRESHOLD번 실패하면 브레이커가 열려서(open) 한동안 API를 부르지 않고 바로 실패합니다.
+# (모든 사용자가 매번 제한 시간을 다 기다리지 않도록. 식단 추천은 이때 ML 상위 후보만으로 '간이 모드' 응답)
+
+class GeminiUnavailableError(RuntimeError):
+    """서킷 브레이커가 열려 있어서 Gemini를 호출하지 않았을 때"""
+
+try:
+    from google.api_core import exceptions as google_exceptions
+    _TRANSIENT_GEMINI_ERRORS = (
+        google_exceptions.TooManyRequests, google_exceptions.ResourceExhausted,
+        google_exceptions.InternalServerError, google_exceptions.ServiceUnavailable,
+        google_exceptions.DeadlineExceeded, google_exceptions.GatewayTimeout,
+        TimeoutError, ConnectionError,
+    )
+except ImportError:
+    _TRANSIENT_GEMINI_ERRORS = (TimeoutError, ConnectionError)
+
+class CircuitBreaker:
+    """
+    연속 실패 횟수 기반 서킷 브레이커 (closed -> open -> half_open -> closed/open)
+    - allow(): 지금 호출해도 되는지 (open이면 False, 대기 시간이 지나면 시험 호출 1번 허용)
+    - record_success() / record_failure(): 호출 결과 기록
+    - release_trial(): 결과를 집계하지 않고 시험 호출 자리만 반납 (속도 제한 대기 시간 초과, 일시 오류가 아닌 오류)
+    """
+    def __init__(self, threshold=GEMINI_BREAKER_THRESHOLD, cooldown=GEMINI_BREAKER_COOLDOWN, name="Gemini"):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.name = name
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.trips = 0
+        self._trial_running = False
+        self._lock = threading.Lock()
+    
+    def allow(self):
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.cooldown:
+                self.state = "half_open"
+                self._trial_running = False
+                print(f"🟡 ({self.name}) 서킷 브레이커 half-open: 시험 호출 1회 허용")
+            if self.state == "half_open" and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+    
+    def record_success(self):
+        with self._lock:
+            if self.state != "closed":
+                print(f"🟢 ({self.name}) 서킷 브레이커 closed: 호출 정상화")
+            self.state = "closed"
+            self.consecutive_failures = 0
+            self._trial_running = False
+    
+    def release_trial(self):
+        with self._lock:
+            self._trial_running = False
+    
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            self._trial_running = False
+            if self.state == "half_open" or (self.state == "closed" and self.consecutive_failures >= self.threshold):
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                self.trips += 1
+                print(f"🔴 ({self.name}) 서킷 브레이커 open: 연속 실패 {self.consecutive_failures}회, "
+                      f"{self.cooldown:g}초 동안 호출 차단")
+    
+    def snapshot(self):
+        with self._lock:
+            retry_in = None
+            if self.state == "open":
+                retry_in = max(0.0, self.cooldown - (time.monotonic() - self.opened_at))
+            return {'state': self.state, 'consecutive_failures': self.consecutive_failures,
+                    'trips': self.trips, 'retry_in': retry_in}
+
+_GEMINI_BREAKER = CircuitBreaker()
+_GEMINI_CALL_STATS = {'calls': 0, 'attempts': 0, 'retries': 0, 'successes': 0, 'failures': 0, 'rejected': 0}
+_GEMINI_CALL_STATS_LOCK = threading.Lock()
+
+def _count_gemini_call(**increments):
+    with _GEMINI_CALL_STATS_LOCK:
+        for name, amount in increments.items():
+            _GEMINI_CALL_STATS[name] += amount
+
+def gemini_resilience_stats():
+    """(지표) 브레이커 상태 + 호출/재시도/실패/차단 횟수 + 우선순위별 대기 시간 (이 프로세스 기준 누적)"""
+    with _GEMINI_CALL_STATS_LOCK:
+        stats = dict(_GEMINI_CALL_STATS)
+    return {'breaker': _GEMINI_BREAKER.snapshot(), **stats, 'rate_limiter': _GEMINI_RATE_LIMITER.stats()}
+
+def gemini_available():
+    """브레이커가 호출을 막고 있지 않은지 (막혀 있으면 호출 전에 간이 모드로 넘어가는 용도)"""
+    breaker = _GEMINI_BREAKER.snapshot()
+    return breaker['state'] != "open" or breaker['retry_in'] == 0
+
+def generate_with_retry(client, prompt, deadline=None, label="gemini", priority=PRIORITY_INTERACTIVE, user=None,
+                        call_site=None, **generate_kwargs):
+    """
+    client.generate(...)를 예산 확인 + 속도 제한(우선순위 스케줄러) + 재시도 + 서킷 브레이커를 거쳐서 호출합니다.
+    - priority / user: 호출 순서를 받을 때의 우선순위(PRIORITY_*)와 사용자 (사용자별 공정 분배, 예산 집계용)
+    - call_site: 사용량 기록에 남길 호출 위치 이름 (예: 'recipe_steps'). 스트리밍은 다 받은 뒤 호출한 쪽에서 기록
+    - stream=True: 응답(iterator)을 만든 것만으로는 성공이 아니므로, 성공/실패(브레이커, 호출 집계)도
+                   호출한 쪽에서 다 받은 뒤 기록 (record_stream_result)
+    - deadline: 재시도를 포함한 전체 제한 시간(초, 기본 GEMINI_CALL_DEADLINE).
+                각 시도의 timeout은 남은 시간으로 줄이고, 남은 시간 안에 다시 못 부르면 재시도를 멈춤
+    - 일시 오류가 아닌 오류(잘못된 요청, 권한 등)는 바로 다시 발생시킴 (브레이커에도 집계 X)
+    브레이커가 열려 있으면 GeminiUnavailableError, 사용 한도를 넘었으면 LLMBudgetExceededError,
+    제한 시간 안에 순서를 못 받으면 GeminiRateLimitTimeout, 재시도가 모두 실패하면 마지막 오류를 발생시킵니다.
+    """
+    deadline = GEMINI_CALL_DEADLINE if deadline is None else deadline
+    deadline_at = time.monotonic() + deadline
+    budget_reason = llm_budget_exceeded(user)
+    if budget_reason:
+        raise LLMBudgetExceededError(f"{budget_reason}: {label}")
+    _count_gemini_call(calls=1)
+    record = call_site is not None and not generate_kwargs.get('stream')
+    start = time.perf_counter()
+    
+    for attempt in range(GEMINI_MAX_ATTEMPTS):
+        if not _GEMINI_BREAKER.allow():
+            _count_gemini_call(rejected=1)
+            if record:
+                record_llm_call(call_site, user, model=client.model_name, status="rejected")
+            raise GeminiUnavailableError(f"Gemini 호출 차단 중 (서킷 브레이커 open): {label}")
+        try:
+            waited = _GEMINI_RATE_LIMITER.acquire(priority, user, timeout=max(0.0, deadline_at - time.monotonic()))
+        except GeminiRateLimitTimeout:
+            # 호출은 못 했으므로 결과 기록 없이 자리만 반납 (half-open 시험 호출이 계속 잡혀 있지 않게)
+            _GEMINI_BREAKER.release_trial()
+            _count_gemini_call(failures=1)
+            if record:
+                record_llm_call(call_site, user, model=client.model_name, status="rate_limited",
+                                latency_ms=(time.perf_counter() - start) * 1000)
+            raise
+        if waited >= 0.5:
+            print(f"⏳ (Gemini) {label} 호출 순서 대기 {waited:.1f}초 ({PRIORITY_NAMES[priority]})")
+        remaining = deadline_at - time.monotonic()
+        timeout = min(getattr(client, 'timeout', remaining) or remaining, remaining)
+        _count_gemini_call(attempts=1, retries=int(attempt > 0))
+        try:
+            response = client.generate(prompt, timeout=timeout, **generate_kwargs)
+        except _TRANSIENT_GEMINI_ERRORS as e:
+            _GEMINI_BREAKER.record_failure()
+            delay = random.uniform(0, min(GEMINI_BACKOFF_MAX, GEMINI_BACKOFF_BASE * 2 ** attempt))
+            out_of_budget = attempt + 1 >= GEMINI_MAX_ATTEMPTS or time.monotonic() + delay >= deadline_at
+            if out_of_budget or not gemini_available():
+                _count_gemini_call(failures=1)
+                if record:
+                    record_llm_call(call_site, user, model=client.model_name, status="error",
+                                    latency_ms=(time.perf_counter() - start) * 1000)
+                print(f"❌ (Gemini) {label} 실패: 시도 {attempt + 1}회, 재시도 중단 ({type(e).__name__})")
+                raise
+            print(f"🔁 (Gemini) {label} 일시 오류 ({type(e).__name__}), {delay:.1f}초 후 재시도 ({attempt + 2}/{GEMINI_MAX_ATTEMPTS})")
+            time.sleep(delay)
+            continue
+        except Exception:
+            # 잘못된 요청/클라이언트 코드 오류 등은 API 상태를 알려주지 않음 -> 집계 없이 시험 호출 자리만 반납
+            _GEMINI_BREAKER.release_trial()
+            _count_gemini_call(failures=1)
+            if record:
+                record_llm_call(call_site, user, model=client.model_name, status="error",
+                                latency_ms=(time.perf_counter() - start) * 1000)
+            raise
+        if generate_kwargs.get('stream'):
+            return response
+        _GEMINI_BREAKER.record_success()
+        _count_gemini_call(successes=1)
+        if record:
+            record_llm_call(call_site, user, response=response, model=client.model_name,
+                            latency_ms=(time.perf_counter() - start) * 1000)
+        return response
+
+def record_stream_result(error=None):
+    """
+    generate_with_retry(..., stream=True)로 받은 스트리밍 응답이 끝났을 때 브레이커/호출 집계에 결과를 기록합니다.
+    - error=None: 끝까지 받음 -> 성공
+    - 일시 오류(_TRANSIENT_GEMINI_ERRORS): 받는 도중 끊김 -> 브레이커 실패
+    - 그 밖의 오류: 브레이커에 집계하지 않고 시험 호출 자리만 반납 (generate_with_retry와 같은 규칙)
+    """
+    if error is None:
+        _GEMINI_BREAKER.record_success()
+        _count_gemini_call(successes=1)
+        return
+    if isinstance(error, _TRANSIENT_GEMINI_ERRORS):
+        _GEMINI_BREAKER.record_failure()
+    else:
+        _GEMINI_BREAKER.release_trial()
+    _count_gemini_call(failures=1)
+
+
+# -----------------------------------------------------------------
+# [신규 추가] Gemini 응답 캐시 (SQLite 파일, 여러 프로세스가 공유)
+# -----------------------------------------------------------------
+# 같은 레시피 + 같은 변형 요청('🥣 1인분으로 양 조절해줘'), 같은 자율 입력('국물 땡겨')처럼
+# 입력이 똑같은 호출은 API를 다시 부르지 않고 저장된 응답을 돌려줍니다.
+#   - Key: (함수 이름, 모델 이름, 정규화한 프롬프트)의 SHA-256
+#   - 함수별 TTL이 지나면 만료, 전체 LLM_CACHE_MAX_ENTRIES개를 넘으면 가장 오래 안 쓴 것부터 삭제(LRU)
+#   - 적중/미스 횟수는 llm_cache_stats 테이블에 누적 (python recommend_gemini.py cache-stats)
+# Streamlit 워커 프로세스들이 같이 쓰도록 레시피 DB와는 별도 파일(WAL 모드)에 저장합니다.
+
+LLM_CACHE_PATH = os.getenv("BOBFIT_LLM_CACHE_PATH", "gemini_cache.sqlite")
+LLM_CACHE_ENABLED = os.getenv("BOBFIT_LLM_CACHE", "on").lower() not in ("0", "off", "false")
+LLM_CACHE_MAX_ENTRIES = 5000
+LLM_CACHE_TTL = { # 초 단위 (없는 함수는 DEFAULT)
+    'recipe_steps': 30 * 24 * 3600,     # 조리법은 거의 바뀌지 않음
+    'modify_recipe': 7 * 24 * 3600,
+    'extract_keywords': 24 * 3600,
+}
+LLM_CACHE_DEFAULT_TTL = 24 * 3600
+
+def _normalize_prompt(prompt):
+    """들여쓰기/줄바꿈 차이, 한글 조합형(NFD) 차이는 같은 프롬프트로 취급"""
+    return " ".join(unicodedata.normalize('NFC', prompt).split())
+
+class GeminiResponseCache:
+    """SQLite 파일 기반 Gemini 응답 캐시 (TTL + LRU). 호출마다 짧게 연결하므로 스레드/프로세스 간 공유 가능"""
+
+    def __init__(self, path=LLM_CACHE_PATH, max_entries=LLM_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                func TEXT NOT NULL,
+                model TEXT NOT NULL,
+                response TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            );
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_last_access ON llm_cache (last_access)")
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS llm_cache_stats (
+                func TEXT PRIMARY KEY,
+                hits INTEGER NOT NULL DEFAULT 0,
+                misses INTEGER NOT NULL DEFAULT 0
+            );
+            """)
+
+    @contextlib.contextmanager
+    def _connect(self):
+        """짧은 연결 1개 (블록이 끝나면 commit 후 닫음)"""
+        conn = sqlite3.connect(self.path, timeout=5)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def make_key(func, model_name, prompt):
+        raw = f"{func}\x00{model_name}\x00{_normalize_prompt(prompt)}"
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def _count(self, conn, func, column):
+        conn.execute("INSERT OR IGNORE INTO llm_cache_stats (func) VALUES (?)", (func,))
+        conn.execute(f"UPDATE llm_cache_stats SET {column} = {column} + 1 WHERE func = ?", (func,))
+
+    def get(self, func, model_name, prompt):
+        """저장된 응답 (없거나 만료되었으면 None). 적중하면 LRU 순서를 갱신합니다."""
+        key = self.make_key(func, model_name, prompt)
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute("SELECT response, expires_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row and row[1] > now:
+                conn.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (now, key))
+                self._count(conn, func, 'hits')
+                return row[0]
+            if row:
+                conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+            self._count(conn, func, 'misses')
+            return None
+
+    def put(self, func, model_name, prompt, response, ttl=None):
+        """응답 저장 (+ 최대 개수를 넘으면 가장 오래 안 쓴 항목부터 삭제)"""
+        ttl = LLM_CACHE_TTL.get(func, LLM_CACHE_DEFAULT_TTL) if ttl is None else ttl
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, func, model, response, expires_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (self.make_key(func, model_name, prompt), func, model_name, response, now + ttl, now)
+            )
+            overflow = conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0] - self.max_entries
+            if overflow > 0:
+                conn.execute(
+                    "DELETE FROM llm_cache WHERE key IN "
+                    "(SELECT key FROM llm_cache ORDER BY last_access LIMIT ?)", (overflow,)
+                )
+
+    def stats(self):
+        """함수별 {'hits', 'misses', 'entries'}"""
+        with self._connect() as conn:
+            stats = {
+                func: {'hits': hits, 'misses': misses, 'entries': 0}
+                for func, hits, misses in conn.execute("SELECT func, hits, misses FROM llm_cache_stats")
+            }
+            for func, entries in conn.execute("SELECT func, COUNT(*) FROM llm_cache GROUP BY func"):
+                stats.setdefault(func, {'hits': 0, 'misses': 0, 'entries': 0})['entries'] = entries
+        return stats
+
+    def clear(self, expired_only=False):
+        """캐시 항목 삭제 (expired_only=True면 만료된 것만). 삭제한 개수를 반환"""
+        with self._connect() as conn:
+            if expired_only:
+                return conn.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (time.time(),)).rowcount
+            return conn.execute("DELETE FROM llm_cache").rowcount
+
+
+_LLM_CACHE = None
+_LLM_CACHE_LOCK = threading.Lock()
+
+def get_llm_cache():
+    """프로세스 전역 Gemini 응답 캐시 (비활성화되었거나 파일을 열 수 없으면 None)"""
+    global _LLM_CACHE
+    if not LLM_CACHE_ENABLED:
+        return None
+    if _LLM_CACHE is None:
+        with _LLM_CACHE_LOCK:
+            if _LLM_CACHE is None:
+                try:
+                    _LLM_CACHE = GeminiResponseCache()
+                except sqlite3.Error as e:
+                    print(f"⚠️ (LLM 캐시) '{LLM_CACHE_PATH}'를 열 수 없어 캐시 없이 호출합니다: {e}")
+                    return None
+    return _LLM_CACHE
+
+def cached_gemini_call(func, prompt, generate, use_cache=True, ttl=None, model=None, user=None):
+    """
+    (HELPER) 캐시에 있으면 저장된 응답을, 없으면 generate()를 호출해서 저장 후 반환합니다.
+    - generate: 응답 텍스트를 반환하는 함수 (None = 실패, 캐시하지 않음)
+    - use_cache=False: 이번 호출만 캐시를 건너뜀 (읽기/쓰기 모두)
+    - model: 캐시 키에 들어갈 모델 이름 (기본 GEMINI_MODEL_NAME)
+    - user: 캐시 적중도 사용량 기록(토큰 0)에 남길 사용자
+    캐시 오류는 호출 결과에 영향을 주지 않습니다.
+    """
+    model = model or GEMINI_MODEL_NAME
+    cache = get_llm_cache() if use_cache else None
+    if cache is not None:
+        start = time.perf_counter()
+        try:
+            cached = cache.get(func, model, prompt)
+            if cached is not None:
+                print(f"⚡ (LLM 캐시) {func} 응답 재사용")
+                record_llm_call(func, user, model=model, cache_hit=True,
+                                latency_ms=(time.perf_counter() - start) * 1000)
+                return cached
+        except sqlite3.Error as e:
+            print(f"⚠️ (LLM 캐시) 조회 실패: {e}")
+
+    response = generate()
+    if cache is not None and response is not None:
+        try:
+            cache.put(func, model, prompt, response, ttl)
+        except sqlite3.Error as e:
+            print(f"⚠️ (LLM 캐시) 저장 실패: {e}")
+    return response
+
+
+# -----------------------------------------------------------------
+# [신규 추가] LLM 사용량(토큰/비용) 기록 + 사용 한도
+# -----------------------------------------------------------------
+# Gemini 호출마다 (호출 위치, 사용자, 모델, 입력/출력 토큰, 추정 비용, 걸린 시간, 캐시 적중, 결과)를
+# SQLite 파일(LLM_USAGE_PATH)에 한 줄씩 남깁니다. 집계: python recommend_gemini.py usage-report
+# 토큰 수는 응답의 usage_metadata 값, 비용은 LLM_PRICE_PER_1M_* (USD / 100만 토큰, 요금제에 맞게 조정)로 추정.
+# 사용 한도(0 = 제한 없음)를 넘으면 그날은 Gemini를 부르지 않고
+#   - 식단 추천: ML 상위 후보로 만든 간이 식단 (degraded)
+#   - 키워드: 로컬 사전 확장만 (신뢰도가 낮아도 사용)
+#   - 조리법/레시피 변형: 안내 문구
+# 으로 대신합니다.
+
+LLM_USAGE_PATH = os.getenv("BOBFIT_LLM_USAGE_PATH", "gemini_usage.sqlite")
+LLM_USAGE_ENABLED = os.getenv("BOBFIT_LLM_USAGE", "on").lower() not in ("0", "off", "false")
+LLM_PRICE_PER_1M_INPUT = float(os.getenv("BOBFIT_LLM_PRICE_INPUT", "0.30"))
+LLM_PRICE_PER_1M_OUTPUT = float(os.getenv("BOBFIT_LLM_PRICE_OUTPUT", "2.50"))
+LLM_USER_DAILY_TOKEN_BUDGET = int(os.getenv("BOBFIT_LLM_USER_DAILY_TOKENS", "0")) # 사용자 1명의 하루 토큰
+LLM_DAILY_TOKEN_BUDGET = int(os.getenv("BOBFIT_LLM_DAILY_TOKENS", "0")) # 서비스 전체의 하루 토큰
+LLM_DAILY_COST_BUDGET = float(os.getenv("BOBFIT_LLM_DAILY_USD", "0")) # 서비스 전체의 하루 추정 비용(USD)
+
+class LLMBudgetExceededError(GeminiUnavailableError):
+    """오늘 사용 한도를 넘어서 Gemini를 부르지 않을 때"""
+
+def estimate_llm_cost(prompt_tokens, response_tokens):
+    """(추정) 토큰 수 -> USD"""
+    return (prompt_tokens * LLM_PRICE_PER_1M_INPUT + response_tokens * LLM_PRICE_PER_1M_OUTPUT) / 1_000_000
+
+class LLMUsageStore:
+    """SQLite 파일 기반 LLM 호출 기록. (GeminiResponseCache처럼 호출마다 짧게 연결 -> 프로세스 간 공유 가능)"""
+
+    REPORT_COLUMNS = {'call_site': "call_site", 'user': "COALESCE(user_id, '-')", 'day': "day", 'model': "model"}
+
+    def __init__(self, path=LLM_USAGE_PATH):
+        self.path = path
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS llm_usage (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                ts REAL NOT NULL,
+                day TEXT NOT NULL,
+                call_site TEXT NOT NULL,
+                user_id TEXT,
+                model TEXT,
+                prompt_tokens INTEGER NOT NULL DEFAULT 0,
+                response_tokens INTEGER NOT NULL DEFAULT 0,
+                total_tokens INTEGER NOT NULL DEFAULT 0,
+                cost_usd REAL NOT NULL DEFAULT 0,
+                latency_ms REAL NOT NULL DEFAULT 0,
+                cache_hit INTEGER NOT NULL DEFAULT 0,
+                status TEXT NOT NULL DEFAULT 'ok'
+            );
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_usage_day_user ON llm_usage (day, user_id)")
+
+    @contextlib.contextmanager
+    def _connect(self):
+        """짧은 연결 1개 (블록이 끝나면 commit 후 닫음)"""
+        conn = sqlite3.connect(self.path, timeout=5)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def record(self, call_site, user=None, model=None, prompt_tokens=0, response_tokens=0, total_tokens=None,
+               latency_ms=0.0, cache_hit=False, status="ok"):
+        """호출 1건 기록"""
+        total_tokens = prompt_tokens + response_tokens if total_tokens is None else total_tokens
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO llm_usage (ts, day, call_site, user_id, model, prompt_tokens, response_tokens, "
+                "total_tokens, cost_usd, latency_ms, cache_hit, status) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (now, time.strftime('%Y-%m-%d', time.localtime(now)), call_site,
+                 None if user is None else str(user), model, prompt_tokens, response_tokens, total_tokens,
+                 estimate_llm_cost(prompt_tokens, response_tokens), latency_ms, int(cache_hit), status)
+            )
+
+    def usage_on(self, day, user=None):
+        """그날의 (토큰 합계, 추정 비용) (user를 주면 그 사용자만)"""
+        query = "SELECT COALESCE(SUM(total_tokens), 0), COALESCE(SUM(cost_usd), 0) FROM llm_usage WHERE day = ?"
+        params = [day]
+        if user is not None:
+            query += " AND user_id = ?"
+            params.append(str(user))
+        with self._connect() as conn:
+            tokens, cost = conn.execute(query, params).fetchone()
+        return int(tokens), float(cost)
+
+    def report(self, group_by=("call_site",), since_day=None):
+        """
+        group_by 컬럼(call_site / user / day / model)별 집계 DataFrame
+        (calls, cache_hits, errors, prompt_tokens, response_tokens, total_tokens, cost_usd, avg_latency_ms)
+        """
+        keys = [self.REPORT_COLUMNS[name] for name in group_by]
+        select_keys = ", ".join(f"{expr} AS {name}" for name, expr in zip(group_by, keys))
+        where = "WHERE day >= ?" if since_day else ""
+        query = f"""
+        SELECT {select_keys}, COUNT(*) AS calls, SUM(cache_hit) AS cache_hits,
+               SUM(status != 'ok') AS errors, SUM(prompt_tokens) AS prompt_tokens,
+               SUM(response_tokens) AS response_tokens, SUM(total_tokens) AS total_tokens,
+               SUM(cost_usd) AS cost_usd, AVG(CASE WHEN cache_hit = 0 THEN latency_ms END) AS avg_latency_ms
+        FROM llm_usage {where}
+        GROUP BY {", ".join(keys)}
+        ORDER BY {", ".join(keys)}
+        """
+        with self._connect() as conn:
+            return pd.read_sql(query, conn, params=[since_day] if since_day else None)
+
+
+_LLM_USAGE = None
+_LLM_USAGE_LOCK = threading.Lock()
+
+def get_llm_usage_store():
+    """프로세스 전역 사용량 기록 저장소 (비활성화되었거나 파일을 열 수 없으면 None)"""
+    global _LLM_USAGE
+    if not LLM_USAGE_ENABLED:
+        return None
+    if _LLM_USAGE is None:
+        with _LLM_USAGE_LOCK:
+            if _LLM_USAGE is None:
+                try:
+                    _LLM_USAGE = LLMUsageStore()
+                except sqlite3.Error as e:
+                    print(f"⚠️ (LLM 사용량) '{LLM_USAGE_PATH}'를 열 수 없어 기록 없이 호출합니다: {e}")
+                    return None
+    return _LLM_USAGE
+
+def record_llm_call(call_site, user=None, response=None, model=None, latency_ms=0.0, cache_hit=False, status="ok"):
+    """
+    (HELPER) Gemini 호출 1건을 사용량 기록에 남깁니다. (response의 usage_metadata에서 토큰 수를 읽음)
+    기록 오류는 호출 결과에 영향을 주지 않습니다.
+    """
+    store = get_llm_usage_store()
+    if store is None:
+        return
+    usage = getattr(response, 'usage_metadata', None)
+    prompt_tokens = int(getattr(usage, 'prompt_token_count', 0) or 0)
+    response_tokens = int(getattr(usage, 'candidates_token_count', 0) or 0)
+    total_tokens = int(getattr(usage, 'total_token_count', 0) or 0) or prompt_tokens + response_tokens
+    try:
+        store.record(call_site, user, model, prompt_tokens, response_tokens, total_tokens,
+                     latency_ms=latency_ms, cache_hit=cache_hit, status=status)
+    except sqlite3.Error as e:
+        print(f"⚠️ (LLM 사용량) 기록 실패: {e}")
+
+def llm_budget_exceeded(user=None):
+    """오늘 사용 한도를 넘었으면 그 이유(문자열), 아니면 None (한도가 모두 0이거나 기록이 꺼져 있으면 항상 None)"""
+    if not (LLM_USER_DAILY_TOKEN_BUDGET or LLM_DAILY_TOKEN_BUDGET or LLM_DAILY_COST_BUDGET):
+        return None
+    store = get_llm_usage_store()
+    if store is None:
+        return None
+    today = time.strftime('%Y-%m-%d')
+    try:
+        if LLM_DAILY_TOKEN_BUDGET or LLM_DAILY_COST_BUDGET:
+            tokens, cost = store.usage_on(today)
+            if LLM_DAILY_TOKEN_BUDGET and tokens >= LLM_DAILY_TOKEN_BUDGET:
+                return f"오늘 전체 토큰 한도 초과 ({tokens:,}/{LLM_DAILY_TOKEN_BUDGET:,})"
+            if LLM_DAILY_COST_BUDGET and cost >= LLM_DAILY_COST_BUDGET:
+                return f"오늘 전체 비용 한도 초과 (${cost:.2f}/${LLM_DAILY_COST_BUDGET:.2f})"
+        if LLM_USER_DAILY_TOKEN_BUDGET and user is not None:
+            tokens, _ = store.usage_on(today, user)
+            if tokens >= LLM_USER_DAILY_TOKEN_BUDGET:
+                return f"오늘 사용자 {user} 토큰 한도 초과 ({tokens:,}/{LLM_USER_DAILY_TOKEN_BUDGET:,})"
+    except sqlite3.Error as e:
+        print(f"⚠️ (LLM 사용량) 한도 확인 실패, 제한 없이 진행합니다: {e}")
+    return None
+
+
+# -----------------------------------------------------------------
+# [신규 추가] 토큰 예산 안에서 만드는 식단 프롬프트
+# -----------------------------------------------------------------
+# 후보 목록은 DataFrame 컬럼 단위로 한 번에 포맷하고(iterrows X, 재료명은 카탈로그에서 파싱된 값),
+# 프롬프트가 PROMPT_TOKEN_BUDGET을 넘으면 ML 점수(ml_score)가 낮은 후보부터 목록에서 뺍니다.
+# (토큰 수는 API(count_tokens)를 부르지 않는 근사치: 한글 등 비ASCII ~1.5자/토큰, ASCII ~4자/토큰)
+
+PROMPT_TOKEN_BUDGET = int(os.getenv("BOBFIT_PROMPT_TOKEN_BUDGET", "6000"))
+PROMPT_MIN_CANDIDATES = 9 # 아침/점심/저녁 x 3개는 고를 수 있어야 함
+PROMPT_MAX_INGREDIENTS = 10 # 너무 길면 AI가 힘들어하므로 재료명은 최대 10개만
+
+def estimate_tokens(text):
+    """(근사) 텍스트의 Gemini 토큰 수"""
+    n_ascii = len(text.encode('ascii', 'ignore'))
+    return int(n_ascii / 4 + (len(text) - n_ascii) / 1.5) + 1
+
+def format_candidate_lines(candidate_recipes, with_id=False):
+    """
+    후보 레시피 DataFrame -> 프롬프트용 한 줄 요약 리스트 (행 순서 유지)
+    - with_id: 줄 맨 앞에 '(ID RCP_SNO)'를 붙임 (JSON 응답에서 레시피를 ID로 고르게 할 때)
+    """
+    def column(name, default=""):
+        if name in candidate_recipes:
+            return candidate_recipes[name].to_numpy()
+        return np.full(len(candidate_recipes), default, dtype=object)
+    
+    # 가격 정보 포맷팅 (0원/없음이면 '정보 없음')
+    prices = pd.to_numeric(pd.Series(column('estimated_price', 0)), errors='coerce').fillna(0).to_numpy()
+    price_infos = [f"{int(price):,}원" if price > 0 else "정보 없음" for price in prices]
+    
+    # 재료 정보 포맷팅: 재료명만 나열 (예: "두부 1모, 대파 1단..." -> "두부, 대파...")
+    ingredient_infos = [
+        ", ".join(names[:PROMPT_MAX_INGREDIENTS]) if names is not None else "재료 정보 없음"
+        for names in get_ingredient_names(candidate_recipes)
+    ]
+    
+    id_prefixes = [f"(ID {sno}) " for sno in column('RCP_SNO')] if with_id else [""] * len(candidate_recipes)
+    
+    return [
+        f"- {id_prefix}[{title}] "
+        f"요리명: {dish_name}, 조리법: {method},"
+        f"소요시간: {cook_time}, 재료비(대용량): {price_info},"
+        f"주재료: {ingredients_info})" # <-- AI가 이걸 보고 칼로리를 추정함
+        for id_prefix, title, dish_name, method, cook_time, price_info, ingredients_info in zip(
+            id_prefixes, column('RCP_TTL'), column('CKG_NM'), column('CKG_MTH_ACTO_NM'), column('CKG_TIME_NM'),
+            price_infos, ingredient_infos,
+        )
+    ]
+
+def fit_candidates_to_budget(candidate_recipes, line_tokens, available_tokens, min_candidates=PROMPT_MIN_CANDIDATES):
+    """
+    토큰 예산 안에 들어가는 후보 행 위치(원래 순서)를 반환합니다.
+    ml_score가 높은 후보부터 채우고 (점수 없는 랜덤 후보는 가장 낮은 순위, 동점이면 앞쪽 행 우선),
+    예산이 모자라도 min_candidates개는 남깁니다.
+    """
+    n = len(line_tokens)
+    if 'ml_score' in candidate_recipes:
+        priority = pd.to_numeric(candidate_recipes['ml_score'], errors='coerce').fillna(-np.inf).to_numpy()
+    else:
+        priority = np.zeros(n)
+    order = np.lexsort((np.arange(n), -priority))
+    fits = np.cumsum(np.asarray(line_tokens, dtype=np.int64)[order]) <= available_tokens
+    n_keep = max(int(fits.sum()), min(min_candidates, n))
+    return np.sort(order[:n_keep])
+
+# [수정] 3. 2차 (Gemini) 추천 함수 (최종 완성본)
+def build_recommendation_prompt(profile, candidate_recipes, today_str, mood, free_text, token_budget=None,
+                                output_format=None):
+    """
+    (2차 추천 프롬프트) 프로필 + 오늘의 상황 + 후보 레시피 목록 -> Gemini 식단 요청 프롬프트
+    - token_budget: 프롬프트 전체 토큰 예산 (기본 PROMPT_TOKEN_BUDGET). 넘으면 낮은 점수 후보부터 제외
+    - output_format: "json"(MEAL_PLAN_SCHEMA, 후보에 ID 표시) / "markdown" (기본 RECOMMENDATION_OUTPUT_FORMAT)
+    프롬프트 크기와 생성 시간은 요청마다 로그로 남깁니다.
+    """
+    build_start = time.perf_counter()
+    token_budget = PROMPT_TOKEN_BUDGET if token_budget is None else token_budget
+    output_format = output_format or RECOMMENDATION_OUTPUT_FORMAT
+    
+    # 1. 후보 레시피 목록 텍스트 생성 (가격 정보 포함, 컬럼 단위)
+    candidate_lines = format_candidate_lines(candidate_recipes, with_id=(output_format == "json"))
+    line_tokens = [estimate_tokens(line) + 1 for line in candidate_lines] # +1 = 줄바꿈
+    
+    # 2. 사용자 프로필 텍스트 생성 (예산 포함)
+    user_budget = profile.get('budget', 0)
+    budget_str = f"{user_budget:,}원" if user_budget > 0 else "제한 없음"
+    
+    profile_str = f"""
+    - 사용자명: {profile['username']}
+    - 선호 음식: {profile['preferences']}
+    - 달성 목표: {profile['goals']}
+    - 알레르기: {profile['restrictions_allergies']}
+    - 기타 제약: {profile['restrictions_other']}
+    - 한 끼 예산: {budget_str}
+    """
+
+    # 3. 동적 컨텍스트 생성 (기분/요청)
+    context_str = f"- 오늘은 {today_str}입니다."
+    if mood != "-":
+        context_str += f"\n- 사용자의 현재 기분: {mood}"
+    if free_text:
+        context_str += f"\n- 사용자의 추가 요청: {free_text}"
+    else:
+        context_str += "\n- 사용자의 추가 요청: 없음"
+
+    # 4. 출력 형식 (JSON: 후보 ID로 고르게 해서 제목 매칭 없이 바로 연결 / Markdown: 예전 방식)
+    if output_format == "json":
+        output_format_str = f"""**4. [★매우 중요 - 출력 형식 (JSON)]**
+    - 반드시 아래 구조의 JSON 객체 하나만 출력하세요. (코드 블록이나 다른 설명 문장 없이)
+      - intro: {profile['username']}님에게 건네는 인사말 및 추천 컨셉 설명 (Markdown 가능)
+      - meals: 추천 메뉴 9개 (아침/점심/저녁 각 3개)
+        - rcp_sno: 후보 목록의 **(ID 숫자) 그대로**. 후보 목록에 없는 ID는 절대 쓰지 마세요.
+        - slot: "아침", "점심", "저녁" 중 하나
+        - kcal: 후보 목록의 **'주재료' 정보**를 바탕으로 추정한 **1인분 기준 열량** (정수)
+        - reason: 추천 이유 (사용자의 목표나 오늘의 상황과 연결해서 1~2문장)
+
+    ---
+    # [출력 예시]
+    {{"intro": "안녕하세요, {profile['username']}님! BobFit 영양사입니다. (추천 컨셉 설명...)",
+     "meals": [
+      {{"rcp_sno": 1234567, "slot": "아침", "kcal": 450, "reason": "사용자의 '다이어트' 목표에 맞춰 단백질이 풍부하고..."}},
+      {{"rcp_sno": 2345678, "slot": "아침", "kcal": 380, "reason": "오늘 '우울함'을 느끼시는 고객님을 위해 따뜻한..."}},
+      ... (저녁 3번째까지 총 9개)
+     ]}}"""
+    else:
+        output_format_str = f"""**4. [★매우 중요 - 출력 형식]**
+    - 레시피 제목은 반드시 후보 목록에 있는 **대괄호 `[]` 안의 원본 제목 그대로** 작성해야 합니다. (토글 매칭을 위해 필수)
+    (잘못된 예: "순두부찌개", "맛있는 된장찌개")
+    (올바른 예: "[바지락 순두부 찌개 끓이는 법]", "[차돌박이 된장찌개]")
+    
+    - **[열량 추정]** 후보 목록에 있는 **'주재료' 정보**를 바탕으로 대략적인 열량(kcal)을 추정하세요.
+      - 표기의 편리를 위해 반드시 **1인분 기준으로 추정한 열량**을 메뉴 이름의 아래 줄에 `(약 XXX kcal)` 형식으로 명시하세요.
+    
+    - 각 추천 메뉴 사이에는 **반드시 빈 줄(줄바꿈 2번)**을 넣어주세요.
+    
+    - 설명은 Markdown 형식을 사용하여 가독성 있게 작성하세요.
+
+    ---
+    # [출력 예시]
+    
+    안녕하세요, {profile['username']}님! BobFit 영양사입니다.
+    (인사말 및 추천 컨셉 설명...)
+
+    아침 1. **[원본 레시피 제목 그대로]**:
+       (약 XXX kcal)
+       추천 이유: 사용자의 '다이어트' 목표에 맞춰 단백질이 풍부하고...
+
+    아침 2. **[원본 레시피 제목 그대로]**: 
+       (약 XXX kcal)
+       추천 이유: 오늘 '우울함'을 느끼시는 고객님을 위해 따뜻한...
+       
+    아침 3. **[원본 레시피 제목 그대로]**: 
+       (약 XXX kcal)
+       추천 이유: 사용자의 '근육 증가' 목표에 맞춰 고단백...
+       
+    점심 1. **[원본 레시피 제목 그대로]**:
+       (약 XXX kcal)
+       추천 이유: ...
+
+    ... (9번(아침 1 ~ 저녁 3)까지 반복)"""
+    
+    # ------------------------------------------------------------------
+    # [핵심] 최종 통합 프롬프트
+    # ------------------------------------------------------------------
+    # (후보 개수/목록 자리는 비워두고 예산을 맞춘 뒤 채움. 사용자 입력과 겹치지 않게 NUL로 감싼 표식 사용)
+    count_slot, list_slot = "\0n_candidates\0", "\0recipe_list\0"
+    prompt_template = f"""
+    당신은 'BobFit'의 AI 식단 코치이자 전문 영양사입니다.
+    아래 제공된 정보를 종합하여 사용자에게 최적화된 **오늘의 아침/점심/저녁 식단(후보 총 9개)**을 추천해주세요.
+
+    # 1. 사용자 프로필
+    {profile_str}
+
+    # 2. 오늘의 상황 (Context)
+    {context_str}
+
+    # 3. 추천 대상 레시피 후보 목록 (엄선된 {count_slot}개)
+    {list_slot}
+
+    ---
+    # [필수 요청 사항]
+
+    **1. 추천 밸런스 (Balance)**
+    - 추천하는 7개의 메뉴는 다음 두 가지 기준을 적절히 섞어서 구성하세요.
+      - 사용자의 [달성 목표](예: 다이어트, 단백질 증가, 영양 균형)에 충실한 건강 메뉴
+      - [오늘의 상황](기분, 날씨, 요청)을 위로하거나 만족시키는 메뉴
+    
+    **2. 제약 조건 준수 (Constraints)**
+    - 사용자의 [알레르기] 및 [기타 제약](채식, 종교 등)을 **절대적으로 준수**하세요. 위 후보 목록은 이미 1차 필터링 되었으나, AI인 당신이 한 번 더 검토하세요.
+    
+    **3. 예산 고려 (Budget)**
+    - 사용자의 [한 끼 예산] 제한이 있다면 확인하세요.
+    - 후보 목록의 '재료비(대용량)'는 식재료를 묶음으로 샀을 때의 총가격입니다. 
+    - 따라서 **실제 1인분 1끼 비용은 표시된 가격의 약 1/5 ~ 1/10 수준**으로 저렴하다고 판단하고, 이를 감안하여 예산 범위 내에서 합리적인 메뉴를 고르세요.
+
+    {output_format_str}
+    """
+    
+    def render(n_candidates, recipe_list_str):
+        return (prompt_template
+                .replace(count_slot, str(n_candidates))
+                .replace(list_slot, recipe_list_str))
+    
+    # 4. 토큰 예산 맞추기: 후보 목록을 뺀 고정 부분을 먼저 재고, 남는 만큼 점수 높은 후보부터 채움
+    fixed_tokens = estimate_tokens(render(len(candidate_lines), ""))
+    kept = fit_candidates_to_budget(candidate_recipes, line_tokens, token_budget - fixed_tokens)
+    prompt = render(len(kept), "\n".join(candidate_lines[i] for i in kept))
+    
+    print(f"🧾 (프롬프트) 후보 {len(kept)}/{len(candidate_lines)}개, 약 {estimate_tokens(prompt):,}토큰 "
+          f"({len(prompt):,}자, 예산 {token_budget:,}) | 생성 {(time.perf_counter() - build_start) * 1000:.1f}ms")
+    return prompt
+
+def recommendation_generation_config(output_format=None):
+    """식단 요청용 generation_config (JSON 형식이면 응답 스키마 지정)"""
+    if (output_format or RECOMMENDATION_OUTPUT_FORMAT) == "json":
+        return {'response_mime_type': "application/json", 'response_schema': MEAL_PLAN_SCHEMA}
+    return None
+
+def get_gemini_recommendation(api_key, profile, candidate_recipes, today_str, mood, free_text, output_format=None,
+                              deadline=None):
+    """
+    (2차 추천) 모든 상황(기분, 예산, 목표)을 고려하여 Gemini API로 최종 식단을 생성합니다.
+    - output_format: "json"이면 MEAL_PLAN_SCHEMA 형식의 JSON 텍스트 (parse_meal_plan으로 해석)
+    - deadline: 재시도 포함 전체 제한 시간(초)
+    """
+    try:
+        client = get_gemini_client(api_key)
+        prompt = build_recommendation_prompt(profile, candidate_recipes, today_str, mood, free_text,
+                                             output_format=output_format)
+        
+        print(f"\nGemini API에 추천을 요청합니다... (모델: {client.model_name})")
+        response = generate_with_retry(client, prompt, deadline=deadline, label="식단 추천", user=profile.get('user_id'),
+                                       call_site='recommendation',
+                                       generation_config=recommendation_generation_config(output_format))
+        
+        return response.text
+
+    except Exception as e:
+        print(f"❌ Gemini API 오류: {e}")
+        return None
+
+def stream_gemini_recommendation(api_key, profile, candidate_recipes, today_str, mood, free_text, timeout=None,
+                                 output_format=None):
+    """
+    (2차 추천, 스트리밍) get_gemini_recommendation과 같은 식단을 생성되는 대로 텍스트 조각(chunk)으로 yield합니다.
+    - 첫 조각까지 걸린 시간(TTFT)과 전체 시간을 로그로 남깁니다.
+    - timeout: 요청 제한 시간(초, 첫 조각 전 일시 오류 재시도 포함). 오류가 나면 그때까지 받은 조각만 나오고 끝납니다.
+    - 받는 중인 JSON은 parse_meal_plan(..., partial=True)로 완성된 메뉴부터 꺼낼 수 있습니다.
+    """
+    start = time.perf_counter()
+    first_chunk_ms = None
+    n_chars = 0
+    client = response = None
+    status = "error"
+    stream_open = False # 스트리밍 응답을 받았지만 아직 결과(브레이커)를 기록하지 않음
+    try:
+        client = get_gemini_client(api_key)
+        prompt = build_recommendation_prompt(profile, candidate_recipes, today_str, mood, free_text,
+                                             output_format=output_format)
+        
+        print(f"\nGemini API에 추천을 요청합니다... (모델: {client.model_name}, 스트리밍)")
+        response = generate_with_retry(client, prompt, deadline=timeout, label="식단 추천(스트리밍)", stream=True,
+                                       user=profile.get('user_id'),
+                                       generation_config=recommendation_generation_config(output_format))
+        stream_open = True
+        for chunk in response:
+            text = chunk.text
+            if not text:
+                continue
+            if first_chunk_ms is None:
+                first_chunk_ms = (time.perf_counter() - start) * 1000
+                print(f"⏱️ (Gemini) 첫 토큰까지 {first_chunk_ms:.0f}ms (TTFT)")
+            n_chars += len(text)
+            yield text
+        status = "ok"
+        stream_open = False
+        record_stream_result()
+
+    except LLMBudgetExceededError as e:
+        print(f"💸 (Gemini) {e}")
+        status = None
+    except Exception as e:
+        print(f"❌ Gemini API 오류 (스트리밍): {e}")
+        if stream_open:
+            stream_open = False
+            record_stream_result(e)
+    finally:
+        if stream_open:
+            # 다 받기 전에 화면 쪽에서 그만 읽음 -> 성공/실패를 알 수 없으니 시험 호출 자리만 반납
+            _GEMINI_BREAKER.release_trial()
+        if client is not None and status is not None:
+            # (스트리밍 응답의 usage_metadata는 끝까지 받은 뒤에 채워짐)
+            record_llm_call('recommendation', profile.get('user_id'), response=response if status == "ok" else None,
+                            model=client.model_name, status=status, latency_ms=(time.perf_counter() - start) * 1000)
+        ttft = f"{first_chunk_ms:.0f}ms" if first_chunk_ms is not None else "-"
+        print(f"⏱️ (Gemini) 스트리밍 종료: TTFT {ttft}, 전체 {(time.perf_counter() - start) * 1000:.0f}ms, {n_chars}자")
+
+def match_recommended_recipes(rec_text, candidates_df):
+    """
+    AI 응답 텍스트에 등장한 후보 레시피를 (후보 순서대로) 찾아서
+    [{'row', 'position', 'calories'}, ...]로 반환합니다.
+    - 매칭: '[원본 제목]'이 통째로 있거나, 없으면 '핵심 요리명(CKG_NM)'이 있으면 매칭
+    - position: 응답에서 처음 등장한 위치 (스트리밍 중 표시 순서용)
+    - calories: 제목 뒤에서 처음 나오는 'XXX kcal' (아직 없으면 '정보 없음')
+    스트리밍 중에는 지금까지 받은 텍스트로 호출하면, 제목이 완성된 레시피부터 차례로 잡힙니다.
+    """
+    matches = []
+    displayed_sno = set()
+    for _, row in candidates_df.iterrows():
+        recipe_id = row['RCP_SNO']
+        recipe_title_full = str(row['RCP_TTL']) # 1. 원본 제목 (예: "[단호박...]")
+        clean_name = str(row['CKG_NM'])      # 2. 핵심 요리명 (예: "단호박에그슬럿")
+        if recipe_id in displayed_sno:
+            continue
+        
+        # --- [핵심] 하이브리드 매칭 ---
+        # 1. AI 응답에 '원본 제목'이 통째로 있는지 확인
+        # 2. 1번이 실패하면, '핵심 요리명'이 있는지 재확인 (단, 요리명이 유효한 경우만)
+        position = rec_text.find(recipe_title_full)
+        if position < 0 and pd.notna(row['CKG_NM']) and len(clean_name) > 1:
+            position = rec_text.find(clean_name)
+        if position < 0:
+            continue
+        displayed_sno.add(recipe_id)
+        
+        # 칼로리 파싱: "제목" 뒤에 나오는 내용 중 가장 먼저 발견되는 "숫자+kcal" 패턴
+        # (우선순위 1: 원본 제목 뒤 / 우선순위 2: 핵심 요리명 뒤)
+        calories = "정보 없음"
+        try:
+            for name in (recipe_title_full, clean_name):
+                match = re.search(rf"{re.escape(name)}.*?([\d,]+\s*kcal)", rec_text, re.DOTALL | re.IGNORECASE)
+                if match:
+                    calories = match.group(1) # "500 kcal" 또는 "1,000kcal" 추출
+                    break
+        except Exception as e:
+            print(f"칼로리 파싱 에러: {e}")
+        
+        matches.append({'row': row, 'position': position, 'calories': calories})
+    return matches
+    
+# -----------------------------------------------------------------
+# [신규 추가] 구조화(JSON) 식단 응답
+# -----------------------------------------------------------------
+# 식단을 RCP_SNO 기준 JSON으로 받아서 검증한 뒤 객체로 화면에 그립니다.
+# (응답 전체에 대한 제목 부분 문자열 검색 + 칼로리 정규식 없이 ID로 바로 후보 행을 찾음)
+# JSON이 아니거나 쓸 만한 메뉴가 하나도 없으면 None -> 예전 Markdown 매칭(match_recommended_recipes)으로 처리
+
+MEAL_SLOTS = ("아침", "점심", "저녁")
+
+MEAL_PLAN_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "intro": {"type": "string"},
+        "meals": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "rcp_sno": {"type": "integer"},
+                    "slot": {"type": "string", "enum": list(MEAL_SLOTS)},
+                    "kcal": {"type": "integer"},
+                    "reason": {"type": "string"},
+                },
+                "required": ["rcp_sno", "slot", "kcal", "reason"],
+            },
+        },
+    },
+    "required": ["intro", "meals"],
+}
+
+_JSON_DECODER = json.JSONDecoder()
+_JSON_INTRO_PATTERN = re.compile(r'"intro"\s*:\s*("(?:[^"\\]|\\.)*")')
+_JSON_MEALS_PATTERN = re.compile(r'"meals"\s*:\s*\[')
+
+def _strip_json_fence(text):
+    """```json ... ``` 코드 블록으로 감싸 온 응답이면 벗겨냄"""
+    text = text.strip()
+    if text.startswith("```"):
+        text = text.split("\n", 1)[1] if "\n" in text else ""
+        text = text.rsplit("```", 1)[0] if text.rstrip().endswith("```") else text
+    return text.strip()
+
+def _scan_partial_meal_plan(text):
+    """(스트리밍 중) 아직 닫히지 않은 JSON에서 완성된 intro와 meals 항목만 꺼냄"""
+    intro = ""
+    intro_match = _JSON_INTRO_PATTERN.search(text)
+    if intro_match:
+        intro = json.loads(intro_match.group(1))
+    
+    meals = []
+    meals_match = _JSON_MEALS_PATTERN.search(text)
+    position = meals_match.end() if meals_match else len(text)
+    while position < len(text):
+        while position < len(text) and text[position] in " \t\r\n,":
+            position += 1
+        if position >= len(text) or text[position] != "{":
+            break
+        try:
+            meal, position = _JSON_DECODER.raw_decode(text, position)
+        except ValueError:
+            break # 아직 다 안 온 항목
+        meals.append(meal)
+    return {'intro': intro, 'meals': meals}
+
+def parse_meal_plan(text, candidates_df, partial=False):
+    """
+    JSON 식단 응답 -> {'intro', 'meals': [{'row', 'rcp_sno', 'slot', 'kcal', 'calories', 'reason'}, ...], 'dropped', 'degraded'}
+    - 후보에 없는 rcp_sno, 잘못된 slot, 중복 레시피 항목은 버리고 개수를 'dropped'에 기록
+    - meals는 아침 -> 점심 -> 저녁 순 (같은 끼니 안에서는 응답 순서)
+    - partial=True: 받는 중인 텍스트에서 완성된 항목만 (JSON으로 시작하지 않으면 None)
+    JSON이 아니거나 남는 메뉴가 없으면 None을 반환합니다. (Markdown 응답으로 처리)
+    """
+    body = _strip_json_fence(text or "")
+    if not body.startswith("{"):
+        return None
+    if partial:
+        data = _scan_partial_meal_plan(body)
+    else:
+        try:
+            data = json.loads(body)
+        except ValueError as e:
+            print(f"⚠️ (식단 JSON) 해석 실패 -> Markdown으로 처리: {e}")
+            return None
+    if not isinstance(data, dict) or not isinstance(data.get('meals'), list):
+        return None
+    
+    rows_by_sno = {}
+    if not candidates_df.empty:
+        rows_by_sno = {int(row['RCP_SNO']): row for _, row in candidates_df.iterrows()}
+    meals = []
+    seen = set()
+    dropped = 0
+    for meal in data['meals']:
+        try:
+            rcp_sno = int(meal['rcp_sno'])
+            slot = str(meal['slot'])
+            kcal = int(meal['kcal']) if meal.get('kcal') is not None else None
+            reason = str(meal.get('reason') or "")
+        except (KeyError, TypeError, ValueError):
+            dropped += 1
+            continue
+        if rcp_sno not in rows_by_sno or slot not in MEAL_SLOTS or rcp_sno in seen:
+            dropped += 1
+            continue
+        seen.add(rcp_sno)
+        meals.append({
+            'row': rows_by_sno[rcp_sno], 'rcp_sno': rcp_sno, 'slot': slot, 'kcal': kcal,
+            'calories': f"{kcal:,} kcal" if kcal is not None and kcal > 0 else "정보 없음",
+            'reason': reason,
+        })
+    if dropped and not partial:
+        print(f"⚠️ (식단 JSON) 후보에 없거나 형식이 잘못된 항목 {dropped}개 제외")
+    if not meals and not partial:
+        return None
+    
+    meals.sort(key=lambda meal: MEAL_SLOTS.index(meal['slot']))
+    return {'intro': str(data.get('intro') or ""), 'meals': meals, 'dropped': dropped, 'degraded': False}
+
+def meal_plan_to_markdown(plan):
+    """parse_meal_plan 결과 -> 화면/콘솔 출력용 Markdown (끼니별 번호 + 열량 + 추천 이유)"""
+    lines = [plan['intro'], ""] if plan['intro'] else []
+    for slot in MEAL_SLOTS:
+        slot_meals = [meal for meal in plan['meals'] if meal['slot'] == slot]
+        for number, meal in enumerate(slot_meals, start=1):
+            calories = f"(약 {meal['calories']})" if meal['kcal'] else "(열량 정보 없음)"
+            lines.append(f"{slot} {number}. **{meal['row']['RCP_TTL']}**:")
+            lines.append(f"   {calories}")
+            lines.append(f"   추천 이유: {meal['reason']}")
+            lines.append("")
+    return "\n".join(lines).strip()
+
+DEGRADED_MEAL_PLAN_INTRO = (
+    "⚠️ 지금은 AI 영양사 연결이 원활하지 않아, 취향 분석(ML) 점수가 높은 레시피로 간이 식단을 먼저 보여드려요. "
+    "(열량 추정/추천 이유 없음)"
+)
+
+def build_fallback_meal_plan(candidates_df, per_slot=3):
+    """
+    (간이 모드) Gemini 없이 ML 점수(ml_score) 상위 후보로 식단을 구성합니다. (parse_meal_plan과 같은 형식)
+    점수 순서대로 아침 -> 점심 -> 저녁에 번갈아 배치 (점수 없는 랜덤 후보는 맨 뒤)
+    """
+    ranked = candidates_df.drop_duplicates('RCP_SNO')
+    if 'ml_score' in ranked:
+        ranked = ranked.sort_values('ml_score', ascending=False, na_position='last', kind='stable')
+    meals = [
+        {'row': row, 'rcp_sno': int(row['RCP_SNO']), 'slot': MEAL_SLOTS[i % len(MEAL_SLOTS)], 'kcal': None,
+         'calories': "정보 없음", 'reason': "취향 분석 점수 상위 레시피"}
+        for i, (_, row) in enumerate(ranked.head(per_slot * len(MEAL_SLOTS)).iterrows())
+    ]
+    meals.sort(key=lambda meal: MEAL_SLOTS.index(meal['slot']))
+    return {'intro': DEGRADED_MEAL_PLAN_INTRO, 'meals': meals, 'dropped': 0, 'degraded': True}
+
+def resolve_meal_plan(rec_text, candidates_df):
+    """
+    최종 응답 텍스트 -> 화면에 그릴 식단 (meal_plan 또는 None)
+    - JSON 식단이면 parse_meal_plan 결과, Markdown 응답이면 None (예전 제목 매칭 방식)
+    - 응답이 없거나 중간에 끊긴/쓸 수 없는 JSON이면 build_fallback_meal_plan (간이 모드, 'degraded': True)
+    """
+    meal_plan = parse_meal_plan(rec_text, candidates_df) if rec_text else None
+    if meal_plan is not None:
+        return meal_plan
+    if not rec_text or _strip_json_fence(rec_text).startswith("{"):
+        print("⚠️ (식단) Gemini 응답을 쓸 수 없어 간이 모드(ML 상위 후보)로 대체합니다.")
+        return build_fallback_meal_plan(candidates_df)
+    return None
+
+STEPS_NOT_GENERATED = "조리법 정보를 생성하지 못했습니다. (AI 응답 오류)"
+STEPS_UNAVAILABLE = "조리법 정보를 불러올 수 없습니다."
+STEPS_BUDGET_EXCEEDED = "오늘 AI 조리법 생성 한도를 모두 사용했습니다. 내일 다시 시도해주세요."
+STEPS_PREFETCH_WORKERS = int(os.getenv("BOBFIT_STEPS_WORKERS", "4")) # 조리법 동시 생성 수 (모든 세션 공유)
+
+def _generate_recipe_steps(client, recipe_title, ingredients, use_cache=True, priority=PRIORITY_ON_DEMAND, user=None):
+    """
+    (HELPER) Gemini로 조리법 텍스트 생성 (DB 저장 X, 응답이 비었으면 None). 스레드에서 불러도 안전
+    - ingredients: 재료 dict (attach_ingredients) 또는 ingredients_json 문자열
+    """
+    # 재료 텍스트 변환
+    ing_str = format_ingredients(ingredients)
+        
+    prompt = f"""
+        당신은 요리 전문가입니다. 다음 요리의 [상세 조리 순서]를 작성해주세요.
+        
+        - 요리명: {recipe_title}
+        - 재료: {ing_str}
+        
+        [작성 조건]
+        1. 번호(1., 2., ...)를 붙여서 단계별로 명확하게 작성하세요.
+        2. 각 단계는 구체적인 행동(썰다, 볶다, 끓이다)으로 끝맺으세요.
+        3. 불 조절이나 팁이 있다면 함께 적어주세요.
+        4. 출력은 오직 조리 순서 텍스트만 작성하세요.
+        """
+    
+    # 안전 설정 해제(RELAXED_SAFETY_SETTINGS) 적용 + 응답 유효성 검사
+    def generate():
+        response = generate_with_retry(client, prompt, label="조리법 생성", safety_settings=RELAXED_SAFETY_SETTINGS,
+                                       priority=priority, user=user, call_site='recipe_steps')
+        if response.candidates and response.candidates[0].content.parts:
             return response.text
+        print(f"⚠️ (GenAI) 조리법 생성 응답 없음. (Reason: {response.candidates[0].finish_reason if response.candidates else 'no candidates'})")
+        return None
+    
+    return cached_gemini_call('recipe_steps', prompt, generate, use_cache=use_cache,
+                              model=client.model_name, user=user)
+
+def get_or_create_recipe_steps(conn, api_key, recipe_id, recipe_title, ingredients, use_cache=True,
+                               priority=PRIORITY_ON_DEMAND, user=None):
+    """
+    DB에 조리법이 있으면 가져오고, 없으면 AI로 생성 후 저장합니다.
+    (생성은 Gemini 응답 캐시를 거치므로, 제목/재료가 같은 레시피는 API를 다시 부르지 않음)
+    - priority / user: 호출 순서 우선순위 (화면에서 연 조리법은 ON_DEMAND, 미리 생성은 PRIORITY_BACKGROUND)
+    (여러 개를 한꺼번에 보여줄 때는 get_recipe_steps_batch)
+    """
+    try:
+        cursor = conn.cursor()
+        # 1. DB 확인
+        cursor.execute(RECIPE_STEPS_QUERY, (recipe_id,))
+        result = cursor.fetchone()
+        
+        if result and result[0]:
+            print(f"✅ (Cache) DB에서 조리법 로드: {recipe_title}")
+            return result[0] # 저장된 조리법 반환
+        
+        # 2. 없으면 AI 생성
+        print(f"🤖 (GenAI) 조리법 신규 생성 중: {recipe_title}")
+        client = get_gemini_client(api_key)
+        generated_steps = _generate_recipe_steps(client, recipe_title, ingredients, use_cache=use_cache,
+                                                 priority=priority, user=user)
+        if generated_steps is not None:
+        
+            # 3. DB에 저장 (UPDATE)
+            cursor.execute("UPDATE recipes SET recipe_steps = ? WHERE RCP_SNO = ?", (generated_steps, recipe_id))
+            conn.commit()
+            print(f"💾 (DB 저장) 조리법 저장 완료: {recipe_title}")
+            
+            return generated_steps
+        else:
+            return STEPS_NOT_GENERATED
+    
+
+    except LLMBudgetExceededError as e:
+        print(f"💸 (GenAI) 조리법 생성 생략: {e}")
+        return STEPS_BUDGET_EXCEEDED
+    except Exception as e:
+        print(f"❌ 조리법 생성/저장 실패: {e}")
+        return STEPS_UNAVAILABLE
+
+_STEPS_EXECUTOR = ThreadPoolExecutor(max_workers=STEPS_PREFETCH_WORKERS, thread_name_prefix="bobfit-steps")
+
+def _row_ingredients(row):
+    """(HELPER) 후보 행의 재료: 'ingredients' dict가 있으면 그대로, 없으면 ingredients_json 문자열"""
+    ingredients = row.get('ingredients')
+    return ingredients if ingredients is not None else row.get('ingredients_json')
+
+def get_recipe_steps_batch(conn, api_key, recipes, use_cache=True, priority=PRIORITY_ON_DEMAND, user=None):
+    """
+    (일괄) 추천된 레시피들의 조리법을 한 번에 준비합니다. -> {RCP_SNO: 조리법 텍스트}
+    - recipes: RCP_SNO / RCP_TTL / ingredients(dict, attach_ingredients) 또는 ingredients_json 을 가진 행(dict, Series)들
+    - DB에 있는 것은 SELECT ... WHERE RCP_SNO IN (...) 한 번으로 읽고,
+      없는 것만 _STEPS_EXECUTOR(최대 STEPS_PREFETCH_WORKERS개)에서 동시에 생성한 뒤 한 트랜잭션으로 저장
+      (전체 시간 ≈ 가장 느린 생성 1건)
+    - 실패한 레시피는 get_or_create_recipe_steps와 같은 안내 문구
+    """
+    recipes_by_id = {}
+    for row in recipes:
+        recipes_by_id.setdefault(row['RCP_SNO'], row)
+    if not recipes_by_id:
+        return {}
+    
+    steps = {}
+    try:
+        recipe_ids = list(recipes_by_id)
+        placeholders = ", ".join("?" * len(recipe_ids))
+        for recipe_id, recipe_steps in conn.execute(
+            f"SELECT RCP_SNO, recipe_steps FROM recipes WHERE RCP_SNO IN ({placeholders})", recipe_ids
+        ):
+            if recipe_steps:
+                steps[recipe_id] = recipe_steps
+        missing = [recipe_id for recipe_id in recipe_ids if recipe_id not in steps]
+        print(f"✅ (Cache) DB에서 조리법 {len(steps)}/{len(recipe_ids)}개 로드")
+        if not missing:
+            return steps
+        
+        print(f"🤖 (GenAI) 조리법 {len(missing)}개 동시 생성 중... (최대 {STEPS_PREFETCH_WORKERS}개씩)")
+        start = time.perf_counter()
+        client = get_gemini_client(api_key)
+        futures = {
+            recipe_id: _STEPS_EXECUTOR.submit(
+                _generate_recipe_steps, client, str(recipes_by_id[recipe_id]['RCP_TTL']),
+                _row_ingredients(recipes_by_id[recipe_id]), use_cache=use_cache, priority=priority, user=user
+            )
+            for recipe_id in missing
+        }
+    except Exception as e:
+        print(f"❌ 조리법 일괄 조회 실패: {e}")
+        return {recipe_id: steps.get(recipe_id, STEPS_UNAVAILABLE) for recipe_id in recipes_by_id}
+    
+    generated = []
+    for recipe_id, future in futures.items():
+        try:
+            recipe_steps = future.result()
+        except LLMBudgetExceededError as e:
+            print(f"💸 (GenAI) 조리법 생성 생략: {e}")
+            steps[recipe_id] = STEPS_BUDGET_EXCEEDED
+            continue
+        except Exception as e:
+            print(f"❌ 조리법 생성 실패 ({recipes_by_id[recipe_id]['RCP_TTL']}): {e}")
+            steps[recipe_id] = STEPS_UNAVAILABLE
+            continue
+        if recipe_steps is None:
+            steps[recipe_id] = STEPS_NOT_GENERATED
+            continue
+        steps[recipe_id] = recipe_steps
+        generated.append((recipe_steps, recipe_id))
+    print(f"⏱️ (GenAI) 조리법 {len(generated)}/{len(missing)}개 생성, {(time.perf_counter() - start) * 1000:.0f}ms")
+    
+    # 생성한 조리법은 한 트랜잭션으로 저장
+    if generated:
+        try:
+            with conn:
+                conn.executemany("UPDATE recipes SET recipe_steps = ? WHERE RCP_SNO = ?", generated)
+            print(f"💾 (DB 저장) 조리법 {len(generated)}개 저장 완료")
+        except sqlite3.Error as e:
+            print(f"❌ 조리법 저장 실패 (이번 화면에는 생성한 조리법 표시): {e}")
+    return steps
+
+# --- 4. [신규 추가] DB 연동 (마이페이지) 함수 ---
+
+# -----------------------------------------------------------------
+# [신규 추가] 스키마 마이그레이션 (schema_version 테이블로 버전 관리)
+# -----------------------------------------------------------------
+# 스키마 변경은 SCHEMA_MIGRATIONS 끝에 (버전, 설명, 함수, recipes 필요 여부)로 추가합니다.
+# - 적용한 버전은 schema_version 테이블에 기록 -> 이미 적용한 것은 다시 실행하지 않음
+# - 프로세스당 DB 파일별로 한 번만 확인 (Streamlit이 화면을 다시 그릴 때마다 DDL을 돌리지 않음)
+# - recipes 테이블이 아직 없으면 그 마이그레이션부터는 미뤘다가 다음 시작 때 적용
+# - 각 함수는 중간에 끊겨도 다시 실행해서 안전하게 (IF NOT EXISTS) 작성
+# 자주 쓰는 조회가 인덱스를 타는지는 `python recommend_gemini.py check-plans`로 확인 (EXPLAIN QUERY PLAN)
+
+def _migrate_user_tables(conn):
+    """(v1) votes, rewards 테이블"""
+    cursor = conn.cursor()
+    
+    # 1. '좋아요/싫어요' 투표 저장 테이블
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS votes (
+        vote_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        recipe_sno INTEGER NOT NULL,
+        vote_type TEXT NOT NULL, -- 'Like' or 'Dislike'
+        voted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users(user_id),
+        FOREIGN KEY (recipe_sno) REFERENCES recipes(RCP_SNO),
+        UNIQUE(user_id, recipe_sno) -- 한 사용자가 한 레시피에 한 번만 투표
+    );
+    """)
+    
+    # 2. '7일 달성' 리워드 기록 테이블
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS rewards (
+        reward_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL UNIQUE, -- 한 사용자당 하나의 기록
+        checked_count INTEGER DEFAULT 0,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    """)
+
+def _migrate_hot_path_indexes(conn):
+    """(v4) 자주 쓰는 조회용 인덱스"""
+    # 마이페이지 '좋아요' 목록: user_id + vote_type으로 찾고 voted_at 순서 그대로, JOIN용 recipe_sno까지 인덱스에서
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_votes_user_type_time ON votes (user_id, vote_type, voted_at, recipe_sno)"
+    )
+    # 조리법/투표 JOIN은 RCP_SNO로 찾음 (RCP_SNO가 INTEGER PRIMARY KEY인 DB는 이미 rowid로 찾으므로 생략)
+    rcp_sno_is_rowid = any(
+        name == 'RCP_SNO' and pk and col_type.upper() == 'INTEGER'
+        for _, name, col_type, _, _, pk in conn.execute("PRAGMA table_info(recipes)")
+    )
+    if not rcp_sno_is_rowid:
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_recipes_rcp_sno ON recipes (RCP_SNO)")
+
+SCHEMA_MIGRATIONS = (
+    (1, "votes/rewards 테이블", _migrate_user_tables, False),
+    (2, "레시피 카탈로그 버전 테이블 + 변경 감지 트리거", ensure_catalog_versioning, True),
+    (3, "recipes.cook_minutes 컬럼 + 시간/예산 필터 인덱스", ensure_recipe_columns, True),
+    (4, "마이페이지/조리법 조회 인덱스", _migrate_hot_path_indexes, True),
+    (5, "recipes.servings / price_per_serving 컬럼", ensure_serving_columns, True),
+    (6, "재료 사전 테이블 + recipes.ingredient_ids / ingredient_amount_ids", ensure_ingredient_encoding, True),
+)
+
+_SCHEMA_READY = set()
+_SCHEMA_LOCK = threading.Lock()
+
+def get_schema_version(conn):
+    """적용된 마지막 마이그레이션 버전 (schema_version 테이블이 없으면 0)"""
+    try:
+        return conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+    except sqlite3.OperationalError:
+        return 0
+
+def run_migrations(conn, migrations=SCHEMA_MIGRATIONS):
+    """
+    아직 적용하지 않은 마이그레이션을 버전 순서대로 적용하고, 적용 후 버전을 반환합니다.
+    (여러 프로세스가 동시에 시작해도 쓰기 잠금(BEGIN IMMEDIATE) 안에서 버전을 다시 확인하므로 한 번만 적용)
+    """
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        description TEXT NOT NULL,
+        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    """)
+    conn.commit()
+    has_recipes = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'recipes'"
+    ).fetchone() is not None
+    
+    for version, description, migrate, requires_recipes in migrations:
+        if version <= get_schema_version(conn):
+            continue
+        if requires_recipes and not has_recipes:
+            print(f"⏸️ (DB 마이그레이션) recipes 테이블이 없어 v{version}부터는 다음 시작 때 적용합니다.")
+            break
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if conn.execute("SELECT 1 FROM schema_version WHERE version = ?", (version,)).fetchone():
+                conn.rollback() # 다른 프로세스가 먼저 적용함
+                continue
+            start = time.perf_counter()
+            migrate(conn)
+            conn.execute("INSERT OR IGNORE INTO schema_version (version, description) VALUES (?, ?)",
+                         (version, description))
+            conn.commit()
+        except BaseException:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        print(f"✅ (DB 마이그레이션) v{version} {description} ({(time.perf_counter() - start) * 1000:.0f}ms)")
+    return get_schema_version(conn)
+
+def setup_database(conn):
+    """
+    (시작할 때 1회) 스키마 마이그레이션을 적용합니다. (프로세스당 DB 파일별로 한 번만 실행)
+    """
+    db_file = _database_file(conn)
+    if db_file in _SCHEMA_READY:
+        return
+    with _SCHEMA_LOCK:
+        if db_file in _SCHEMA_READY:
+            return
+        try:
+            version = run_migrations(conn)
+            if version >= SCHEMA_MIGRATIONS[-1][0]:
+                _SCHEMA_READY.add(db_file) # (recipes가 없어 미룬 것이 있으면 다음 호출 때 다시 확인)
+            print(f"✅ (DB 셋업) 스키마 v{version} 확인 완료.")
+        except Exception as e:
+            print(f"❌ (DB 셋업) 마이그레이션 오류: {e}")
+            if conn.in_transaction:
+                conn.rollback()
+
+# --- EXPLAIN QUERY PLAN 점검 (자주 쓰는 조회가 전체 스캔/정렬로 떨어지지 않았는지) ---
+
+MY_VOTES_QUERY = """
+    SELECT r.RCP_SNO, r.RCP_TTL, r.CKG_MTH_ACTO_NM
+    FROM votes v
+    JOIN recipes r ON v.recipe_sno = r.RCP_SNO
+    WHERE v.user_id = ? AND v.vote_type = 'Like'
+    ORDER BY v.voted_at DESC
+    """
+MY_REWARDS_QUERY = "SELECT checked_count FROM rewards WHERE user_id = ?"
+RECIPE_STEPS_QUERY = "SELECT recipe_steps FROM recipes WHERE RCP_SNO = ?"
+
+HOT_QUERIES = {
+    'my_votes': (MY_VOTES_QUERY, (1,)),
+    'my_rewards': (MY_REWARDS_QUERY, (1,)),
+    'recipe_steps': (RECIPE_STEPS_QUERY, (1,)),
+    'recipe_steps_batch': ("SELECT RCP_SNO, recipe_steps FROM recipes WHERE RCP_SNO IN (?, ?, ?)", (1, 2, 3)),
+    'vote_upsert_lookup': ("SELECT vote_id FROM votes WHERE user_id = ? AND recipe_sno = ?", (1, 1)),
+    'catalog_changes': ("SELECT version, row_id, op FROM catalog_changes WHERE version > ? ORDER BY version", (0,)),
+}
+
+def check_query_plans(conn, queries=None):
+    """
+    HOT_QUERIES를 EXPLAIN QUERY PLAN으로 점검 -> [(이름, 문제가 된 계획 줄), ...] (비어 있으면 통과)
+    - 'SCAN 테이블'(전체 스캔)과 'USE TEMP B-TREE'(인덱스 없이 정렬)를 문제로 봄
+    - 테이블이 없어서 계획을 만들 수 없는 조회는 건너뜀
+    """
+    problems = []
+    for name, (sql, params) in (queries or HOT_QUERIES).items():
+        try:
+            plan = [row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+        except sqlite3.OperationalError as e:
+            print(f"⏭️ (쿼리 계획) {name}: 건너뜀 ({e})")
+            continue
+        bad = [detail for detail in plan if detail.startswith("SCAN") or "TEMP B-TREE" in detail]
+        problems.extend((name, detail) for detail in bad)
+        print(f"{'❌' if bad else '✅'} (쿼리 계획) {name}: {' | '.join(plan)}")
+    return problems
+
+def save_vote(conn, user_id, recipe_sno, vote_type):
+    """
+    '좋아요' 또는 '싫어요' 투표를 DB에 저장합니다.
+    (이미 투표했다면 덮어씁니다: INSERT OR REPLACE)
+    """
+    query = """
+    INSERT OR REPLACE INTO votes (user_id, recipe_sno, vote_type)
+    VALUES (?, ?, ?)
+    """
+    try:
+        cursor = conn.cursor()
+        cursor.execute(query, (user_id, recipe_sno, vote_type))
+        conn.commit()
+        print(f"🗳️ (DB 저장) user_id {user_id}가 recipe_sno {recipe_sno}에 '{vote_type}' 투표함.")
+    except Exception as e:
+        print(f"❌ (DB 저장) 투표 저장 오류: {e}")
+        conn.rollback()
+
+def save_reward(conn, user_id, checked_count):
+    """
+    '7일 달성' 체크박스 개수를 DB에 저장(업데이트)합니다.
+    """
+    query = """
+    INSERT OR REPLACE INTO rewards (user_id, checked_count, updated_at)
+    VALUES (?, ?, CURRENT_TIMESTAMP)
+    """
+    try:
+        cursor = conn.cursor()
+        cursor.execute(query, (user_id, checked_count))
+        conn.commit()
+        # print(f"🏆 (DB 저장) user_id {user_id}의 달성률 {checked_count}/7 저장.")
+    except Exception as e:
+        print(f"❌ (DB 저장) 리워드 저장 오류: {e}")
+        conn.rollback()
+
+def get_my_votes(conn, user_id):
+    """
+    (마이페이지용) 내가 'Like'한 레시피 목록을 불러옵니다.
+    (아직 저장 대기 중/저장 중인 내 투표를 DB 결과 위에 덮어씀 -> 방금 누른 'Like'도 보이고, 'Dislike'로 바꾸면 빠짐)
+    """
+    pending = _WRITE_BEHIND.pending_votes(user_id)
+    try:
+        # read_sql로 바로 DataFrame을 만듭니다.
+        df = pd.read_sql(MY_VOTES_QUERY, conn, params=(user_id,))
+        if pending:
+            df = df[~df['RCP_SNO'].isin(list(pending))]
+            liked = [recipe_sno for recipe_sno, vote_type in pending.items() if vote_type == 'Like']
+            if liked:
+                placeholders = ", ".join("?" * len(liked))
+                new_likes = pd.read_sql(
+                    f"SELECT RCP_SNO, RCP_TTL, CKG_MTH_ACTO_NM FROM recipes WHERE RCP_SNO IN ({placeholders})",
+                    conn, params=liked,
+                )
+                # 대기 중인 투표가 가장 최근 것 -> 누른 순서(최근 먼저)대로 맨 앞에
+                new_likes = new_likes.set_index('RCP_SNO').reindex(liked).dropna(how='all').reset_index()
+                df = pd.concat([new_likes, df], ignore_index=True)
+        return df.drop(columns='RCP_SNO').reset_index(drop=True)
+    except Exception as e:
+        print(f"❌ (DB 조회) '좋아요' 목록 로딩 오류: {e}")
+        return pd.DataFrame()
+
+def get_my_rewards(conn, user_id):
+    """
+    (마이페이지용) 나의 현재 '달성' 횟수를 불러옵니다.
+    (아직 저장 대기 중이거나 저장 중인 값이 있으면 그 값)
+    """
+    pending = _WRITE_BEHIND.pending_reward(user_id)
+    if pending is not None:
+        return pending
+    try:
+        cursor = conn.cursor()
+        cursor.execute(MY_REWARDS_QUERY, (user_id,))
+        result = cursor.fetchone() # (7,) 또는 None
+        if result:
+            return result[0] # 7
+        else:
+            return 0 # 기록이 없으면 0
+    except Exception as e:
+        print(f"❌ (DB 조회) 리워드 로딩 오류: {e}")
+        return 0
+    
+# -----------------------------------------------------------------
+# [신규 추가] 투표/리워드 모아 쓰기 (write-behind)
+# -----------------------------------------------------------------
+# 버튼/체크박스를 누를 때마다 commit(fsync)하던 것을 메모리 대기열에 넣고 바로 돌아옵니다.
+#   - 같은 (사용자, 레시피) 투표, 같은 사용자 리워드는 마지막 값만 남김 (연속 클릭/토글은 1건으로)
+#   - 백그라운드 스레드가 WRITE_BEHIND_INTERVAL초마다 한 트랜잭션으로 저장, 프로세스 종료 시에도 저장(atexit)
+#   - 내 화면에서는 바로 보임: get_my_rewards / get_my_votes는 대기 중인 값과 저장 중(commit 전)인 값을
+#     DB 결과 위에 덮어씀 (조회할 때 저장하지 않음 -> 화면 갱신이 commit을 기다리지 않음)
+# (WRITE_BEHIND_INTERVAL = 0이면 예전처럼 즉시 저장)
+
+class WriteBehindQueue:
+    """
+    투표/리워드 쓰기 대기열.
+    - put_vote / put_reward: 대기열에 넣기 (같은 키는 덮어씀)
+    - flush(): 대기 중인 것을 한 트랜잭션으로 저장 (실패하면 다음 주기에 다시 시도)
+    - stats(): 넣은 수, 합쳐진 수, 저장한 행 수/횟수, 저장 시간(p50, max), 대기 중인 수, 오류 수
+    """
+    def __init__(self, interval=WRITE_BEHIND_INTERVAL, path=None):
+        self.interval = interval
+        self.path = path
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock() # flush는 한 번에 하나씩 (저장 순서 유지)
+        self._votes = {} # (user_id, recipe_sno) -> (vote_type, 누른 시각)
+        self._rewards = {} # user_id -> (checked_count, 누른 시각)
+        self._inflight_votes = {} # flush가 꺼내 간 뒤 아직 commit되지 않은 배치 (commit 성공 후 비움)
+        self._inflight_rewards = {}
+        self._thread = None
+        self._stats = {'queued': 0, 'coalesced': 0, 'flushed_rows': 0, 'flushes': 0, 'errors': 0}
+        self._flush_ms = deque(maxlen=1000)
+    
+    def _put(self, pending, key, value):
+        with self._lock:
+            self._stats['queued'] += 1
+            self._stats['coalesced'] += int(key in pending)
+            pending[key] = value
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="bobfit-write-behind", daemon=True)
+                self._thread.start()
+    
+    @staticmethod
+    def _now():
+        """CURRENT_TIMESTAMP와 같은 형식(UTC)의 누른 시각 (저장이 늦어도 투표 시각은 그대로)"""
+        return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+    
+    def put_vote(self, user_id, recipe_sno, vote_type):
+        self._put(self._votes, (user_id, recipe_sno), (vote_type, self._now()))
+    
+    def put_reward(self, user_id, checked_count):
+        self._put(self._rewards, user_id, (checked_count, self._now()))
+    
+    def pending_votes(self, user_id):
+        """아직 DB에 commit되지 않은 내 투표 {recipe_sno: vote_type} (최근에 누른 것부터)"""
+        with self._lock:
+            votes = {**self._inflight_votes, **self._votes}
+        mine = [(recipe_sno, value) for (vote_user, recipe_sno), value in votes.items() if vote_user == user_id]
+        mine.reverse() # 같은 초에 누른 것은 나중에 넣은 것이 앞으로
+        mine.sort(key=lambda item: item[1][1], reverse=True)
+        return {recipe_sno: vote_type for recipe_sno, (vote_type, _) in mine}
+    
+    def pending_reward(self, user_id):
+        with self._lock:
+            pending = self._rewards.get(user_id) or self._inflight_rewards.get(user_id)
+        return pending[0] if pending else None
+    
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+    
+    def flush(self):
+        """대기 중인 투표/리워드를 한 트랜잭션으로 저장. 저장한 행 수를 반환"""
+        with self._flush_lock:
+            with self._lock:
+                votes, self._votes = self._votes, {}
+                rewards, self._rewards = self._rewards, {}
+                self._inflight_votes, self._inflight_rewards = votes, rewards
+            if not votes and not rewards:
+                return 0
+            start = time.perf_counter()
+            try:
+                with db_write(self.path) as conn:
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO votes (user_id, recipe_sno, vote_type, voted_at) VALUES (?, ?, ?, ?)",
+                        [(user_id, recipe_sno, vote_type, voted_at)
+                         for (user_id, recipe_sno), (vote_type, voted_at) in votes.items()]
+                    )
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO rewards (user_id, checked_count, updated_at) VALUES (?, ?, ?)",
+                        [(user_id, checked_count, updated_at) for user_id, (checked_count, updated_at) in rewards.items()]
+                    )
+            except Exception as e:
+                # 실패한 것은 다시 대기열로 (그 사이에 새로 들어온 값이 있으면 새 값 우선)
+                with self._lock:
+                    self._stats['errors'] += 1
+                    self._votes = {**votes, **self._votes}
+                    self._rewards = {**rewards, **self._rewards}
+                    self._inflight_votes, self._inflight_rewards = {}, {}
+                print(f"❌ (DB 저장) 투표/리워드 모아 쓰기 실패, 다음에 다시 시도: {e}")
+                return 0
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            with self._lock:
+                self._inflight_votes, self._inflight_rewards = {}, {}
+                self._stats['flushes'] += 1
+                self._stats['flushed_rows'] += len(votes) + len(rewards)
+                self._flush_ms.append(elapsed_ms)
+            print(f"🗳️ (DB 저장) 투표 {len(votes)}건, 리워드 {len(rewards)}건 저장 ({elapsed_ms:.0f}ms)")
+            return len(votes) + len(rewards)
+    
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['pending'] = len(self._votes) + len(self._rewards)
+            flush_ms = np.sort(np.fromiter(self._flush_ms, dtype=float))
+        stats['flush_p50_ms'] = float(np.percentile(flush_ms, 50)) if len(flush_ms) else 0.0
+        stats['flush_max_ms'] = float(flush_ms[-1]) if len(flush_ms) else 0.0
+        return stats
+
+_WRITE_BEHIND = WriteBehindQueue()
+atexit.register(_WRITE_BEHIND.flush)
+
+def queue_vote(user_id, recipe_sno, vote_type):
+    """'좋아요'/'싫어요' 투표 저장 (모아 쓰기, WRITE_BEHIND_INTERVAL = 0이면 save_vote로 즉시 저장)"""
+    if WRITE_BEHIND_INTERVAL <= 0:
+        with db_write() as conn:
+            save_vote(conn, user_id, recipe_sno, vote_type)
+        return
+    _WRITE_BEHIND.put_vote(user_id, recipe_sno, vote_type)
+    print(f"🗳️ (저장 대기) user_id {user_id}가 recipe_sno {recipe_sno}에 '{vote_type}' 투표함.")
+
+def queue_reward(user_id, checked_count):
+    """'7일 달성' 개수 저장 (모아 쓰기, WRITE_BEHIND_INTERVAL = 0이면 save_reward로 즉시 저장)"""
+    if WRITE_BEHIND_INTERVAL <= 0:
+        with db_write() as conn:
+            save_reward(conn, user_id, checked_count)
+        return
+    _WRITE_BEHIND.put_reward(user_id, checked_count)
+
+def flush_pending_writes():
+    """대기 중인 투표/리워드를 지금 저장 (관리/테스트용). 저장한 행 수를 반환"""
+    return _WRITE_BEHIND.flush()
+
+def write_behind_stats():
+    """(지표) 투표/리워드 모아 쓰기 상태"""
+    return _WRITE_BEHIND.stats()
+
+# --- 5. [신규 추가]"스마트" 후보군 선정 (ML) ---
+
+def _extract_ingredients_text(json_str):
+    """(HELPER) ingredients_json에서 재료명(key)만 추출해 텍스트로 반환"""
+    try:
+        ingredients_dict = json.loads(json_str)
+        # 재료명(key)만 " "으로 묶어서 반환 (예: "두부 아보카도 간장")
+        return " ".join(ingredients_dict.keys())
+    except (json.JSONDecodeError, TypeError):
+        return "" # 파싱 실패 시 빈 텍스트 반환
+
+# -----------------------------------------------------------------
+# [신규 추가] 미리 학습해서 디스크에 저장해 두는 TF-IDF 인덱스
+# -----------------------------------------------------------------
+# 매 요청마다 (필터링된) 레시피 전체로 TfidfVectorizer를 새로 학습하던 것을,
+# 전체 카탈로그로 '한 번만' 학습해서 디스크에 저장해 두고
+# 요청 시에는 필터링된 행만 잘라서(slice) 사용합니다.
+#   - vocabulary.json: 어휘 사전 (열 순서)
+#   - idf.npy / recipe_ids.npy: IDF 가중치, 행 순서(RCP_SNO)
+#   - data.npy / indices.npy / indptr.npy: CSR 희소 행렬 (np.load mmap_mode='r'로 로드)
+#   - meta.json: 포맷 버전 + 학습 당시 카탈로그 버전 (다르면 stale -> 재학습)
+# 그 뒤로 '새 행 추가'만 있었다면 재학습하지 않고, 새 레시피만 기존 어휘 사전으로 변환한
+# 작은 delta 세그먼트를 본 행렬 옆에 붙여서 함께 검색합니다.
+# delta가 SEGMENT_MERGE_* 기준을 넘으면 백그라운드 스레드에서 전체 재학습(= 병합) 후 교체합니다.
+
+TFIDF_INDEX_FORMAT = 1
+SEGMENT_MERGE_MIN_ROWS = 2000
+SEGMENT_MERGE_RATIO = 0.05 # 본 세그먼트 행 수 대비
+
+def get_index_dir(db_file, name='tfidf'):
+    """DB 파일 옆의 인덱스 저장 폴더 (예: recipe_db.sqlite -> recipe_db_index/tfidf/)"""
+    return os.path.join(os.path.splitext(db_file)[0] + '_index', name)
+
+def _new_index_tmp_dir(index_dir):
+    """인덱스를 먼저 써 둘 임시 폴더 (프로세스별로 분리)"""
+    tmp_dir = f"{index_dir}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    return tmp_dir
+
+def _swap_index_dir(tmp_dir, index_dir):
+    """다 쓴 임시 폴더로 기존 인덱스 폴더를 교체 (반쯤 쓴 인덱스를 읽지 않도록)"""
+    shutil.rmtree(index_dir, ignore_errors=True)
+    os.replace(tmp_dir, index_dir)
+
+def _make_vectorizer(vocabulary, idf):
+    """저장된 어휘 사전 + IDF로 '이미 학습된' TfidfVectorizer를 복원"""
+    vectorizer = TfidfVectorizer(vocabulary=vocabulary)
+    vectorizer.idf_ = idf
+    return vectorizer
+
+class TfidfIndex:
+    """
+    전체 카탈로그로 학습한 재료 TF-IDF 행렬 (행 = 카탈로그 행 순서, L2 정규화됨).
+    행이 정규화되어 있으므로 코사인 유사도 = 행렬 x 쿼리 벡터 (내적) 입니다.
+      - matrix:       학습 당시 카탈로그 행들 (본 세그먼트, 디스크에서 메모리 맵)
+      - delta_matrix: 그 뒤에 추가된 행들 (같은 어휘 사전으로 변환, 메모리)
+    """
+
+    def __init__(self, vocabulary, idf, matrix, recipe_ids, catalog_version):
+        self.vocabulary = list(vocabulary)
+        self.idf = np.asarray(idf)
+        self.matrix = matrix
+        self.delta_matrix = sparse.csr_matrix((0, matrix.shape[1]), dtype=np.float32)
+        self.recipe_ids = np.asarray(recipe_ids)
+        self.catalog_version = catalog_version
+        self.vectorizer = _make_vectorizer(self.vocabulary, self.idf)
+
+    @classmethod
+    def build(cls, catalog):
+        """
+        카탈로그 전체 재료로 TF-IDF 학습.
+        레시피마다 재료 텍스트를 만들어 다시 토큰화하지 않고, 재료명 사전의 각 이름만 한 번 토큰화한 뒤
+        (레시피 x 재료 ID) 행렬 x (재료 ID x 토큰) 행렬 = 토큰 빈도 행렬을 희소 행렬 곱으로 만듭니다.
+        (재료명 공백 연결 텍스트로 TfidfVectorizer를 학습한 것과 같은 어휘 사전/IDF/행렬)
+        """
+        analyzer = TfidfVectorizer().build_analyzer()
+        names = catalog.codec.names.values
+        token_ids = {}
+        name_rows, token_cols = [], []
+        for name_id in np.unique(catalog.ingredient_ids).tolist():
+            for token in analyzer(names[name_id]):
+                name_rows.append(name_id)
+                token_cols.append(token_ids.setdefault(token, len(token_ids)))
+        if not token_ids:
+            raise ValueError("재료명에서 토큰을 하나도 찾지 못했습니다. (empty vocabulary)")
+        
+        # 어휘 사전은 TfidfVectorizer처럼 토큰 정렬 순서
+        vocabulary = sorted(token_ids)
+        column_of = np.empty(len(token_ids), dtype=np.int64)
+        column_of[[token_ids[token] for token in vocabulary]] = np.arange(len(vocabulary))
+        name_tokens = sparse.csr_matrix(
+            (np.ones(len(name_rows)), (name_rows, column_of[token_cols])),
+            shape=(len(names), len(vocabulary)),
+        )
+        counts = catalog.ingredient_matrix() @ name_tokens
+        transformer = TfidfTransformer()
+        matrix = transformer.fit_transform(counts).astype(np.float32)
+        return cls(
+            vocabulary,
+            transformer.idf_,
+            matrix.tocsr(),
+            catalog.recipe_ids,
+            catalog.version,
+        )
+
+    def is_current(self, catalog):
+        """카탈로그 버전 + 행 순서가 같아야 재사용 가능"""
+        return (
+            self.catalog_version == catalog.version
+            and len(self.recipe_ids) == catalog.n_rows
+            and np.array_equal(self.recipe_ids, catalog.recipe_ids)
+        )
+
+    def can_extend_to(self, catalog):
+        """그 사이 '새 행 추가'만 있었으면 True (새 행만 delta 세그먼트로 변환하면 최신이 됨)"""
+        n = len(self.recipe_ids)
+        return (
+            catalog.append_only_since <= self.catalog_version <= catalog.version
+            and n <= catalog.n_rows
+            and np.array_equal(self.recipe_ids, catalog.recipe_ids[:n])
+        )
+
+    def extended(self, catalog):
+        """새 행들을 delta 세그먼트에 추가한 새 인덱스 (본 세그먼트와 그 역색인은 공유)"""
+        delta = self.transform(catalog.ingredient_texts(start=len(self.recipe_ids)))
+        index = copy.copy(self)
+        index.__dict__.pop('delta_inverted', None)
+        index.delta_matrix = sparse.vstack(
+            [self.delta_matrix, delta.astype(np.float32)], format='csr'
+        )
+        index.recipe_ids = catalog.recipe_ids
+        index.catalog_version = catalog.version
+        return index
+
+    def save(self, index_dir):
+        """임시 폴더에 모두 쓴 뒤 교체 (다른 프로세스가 반쯤 쓴 인덱스를 읽지 않도록)"""
+        matrix = self.matrix
+        if self.delta_matrix.shape[0]:
+            matrix = sparse.vstack([self.matrix, self.delta_matrix], format='csr')
+        tmp_dir = _new_index_tmp_dir(index_dir)
+        with open(os.path.join(tmp_dir, 'vocabulary.json'), 'w', encoding='utf-8') as f:
+            json.dump(self.vocabulary, f, ensure_ascii=False)
+        np.save(os.path.join(tmp_dir, 'idf.npy'), self.idf)
+        np.save(os.path.join(tmp_dir, 'recipe_ids.npy'), self.recipe_ids)
+        np.save(os.path.join(tmp_dir, 'data.npy'), matrix.data)
+        np.save(os.path.join(tmp_dir, 'indices.npy'), matrix.indices)
+        np.save(os.path.join(tmp_dir, 'indptr.npy'), matrix.indptr)
+        with open(os.path.join(tmp_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump({
+                'format': TFIDF_INDEX_FORMAT,
+                'catalog_version': self.catalog_version,
+                'n_rows': int(matrix.shape[0]),
+                'n_terms': int(matrix.shape[1]),
+                'built_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+            }, f)
+        _swap_index_dir(tmp_dir, index_dir)
+
+    @classmethod
+    def load(cls, index_dir):
+        """저장된 인덱스 로드 (희소 행렬 배열은 메모리 맵). 포맷이 다르거나 없으면 None"""
+        try:
+            with open(os.path.join(index_dir, 'meta.json'), encoding='utf-8') as f:
+                meta = json.load(f)
+            if meta.get('format') != TFIDF_INDEX_FORMAT:
+                return None
+            with open(os.path.join(index_dir, 'vocabulary.json'), encoding='utf-8') as f:
+                vocabulary = json.load(f)
+            arrays = {
+                name: np.load(os.path.join(index_dir, f'{name}.npy'), mmap_mode='r')
+                for name in ('data', 'indices', 'indptr')
+            }
+            matrix = sparse.csr_matrix(
+                (arrays['data'], arrays['indices'], arrays['indptr']),
+                shape=(meta['n_rows'], meta['n_terms']),
+                copy=False,
+            )
+            return cls(
+                vocabulary,
+                np.load(os.path.join(index_dir, 'idf.npy')),
+                matrix,
+                np.load(os.path.join(index_dir, 'recipe_ids.npy')),
+                meta['catalog_version'],
+            )
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as e:
+            print(f"⚠️ (TF-IDF) 저장된 인덱스를 읽지 못했습니다: {e}")
+            return None
+
+    def transform(self, texts):
+        """쿼리/신규 텍스트 -> 같은 어휘 사전의 TF-IDF 벡터 (학습 X)"""
+        return self.vectorizer.transform(texts)
+
+    def rows(self, positions):
+        """카탈로그 행 번호 목록에 해당하는 TF-IDF 행들만 잘라서 반환 (본/delta 세그먼트에서 각각)"""
+        positions = np.asarray(positions, dtype=np.int64)
+        n_base = self.matrix.shape[0]
+        in_base = positions < n_base
+        if in_base.all():
+            return self.matrix[positions]
+        stacked = sparse.vstack(
+            [self.matrix[positions[in_base]], self.delta_matrix[positions[~in_base] - n_base]],
+            format='csr'
+        )
+        order = np.concatenate([np.flatnonzero(in_base), np.flatnonzero(~in_base)])
+        return stacked[np.argsort(order)]
+
+    @functools.cached_property
+    def inverted(self):
+        """같은 TF-IDF 가중치로 만든 본 세그먼트 역색인 (처음 필요할 때 한 번 생성)"""
+        return InvertedIndex(self.matrix)
+
+    @functools.cached_property
+    def delta_inverted(self):
+        """delta 세그먼트 역색인 (행이 적어서 만드는 비용이 작음)"""
+        return InvertedIndex(self.delta_matrix)
+
+    def search(self, query_vector, k, allow=None):
+        """
+        본/delta 세그먼트 역색인을 각각 top-k 검색한 뒤 합쳐서 (카탈로그 행 번호, 점수)를 반환합니다.
+        (delta 행 번호가 항상 더 크므로, 동점 순서도 세그먼트 하나로 검색한 결과와 같음)
+        """
+        n_base = self.matrix.shape[0]
+        rows, scores = self.inverted.search(query_vector, k, None if allow is None else allow[:n_base])
+        if self.delta_matrix.shape[0] == 0:
+            return rows, scores
+        delta_rows, delta_scores = self.delta_inverted.search(
+            query_vector, k, None if allow is None else allow[n_base:]
+        )
+        rows = np.concatenate([rows, delta_rows + n_base])
+        scores = np.concatenate([scores, delta_scores])
+        top = _top_k_indices(scores, k)
+        return rows[top], scores[top]
+
+
+# -----------------------------------------------------------------
+# [신규 추가] 역색인(Inverted Index) 기반 top-k 검색 (MaxScore)
+# -----------------------------------------------------------------
+# 사용자 쿼리는 보통 어휘 30개 미만이므로, 전체 레시피와 코사인 유사도를 계산하는 대신
+# '쿼리 단어가 들어 있는 레시피 목록(postings)'만 훑어서 같은 top-k를 구합니다.
+# MaxScore 방식: 남은 단어들의 최대 기여도 합이 현재 k등 점수보다 작아지면
+# 더 이상 새 후보를 만들지 않고, 이미 있는 후보의 점수만 갱신/가지치기합니다.
+
+class InvertedIndex:
+    """
+    TF-IDF 행렬(행 = 카탈로그 행, L2 정규화)의 단어별 postings.
+    - postings_rows / postings_weights: 단어 t의 목록 = [postings_ptr[t]:postings_ptr[t+1]] (행 번호 오름차순)
+    - max_weights: 단어별 최대 가중치 (MaxScore 상한 계산용)
+    """
+
+    def __init__(self, tfidf_matrix):
+        csc = sparse.csc_matrix(tfidf_matrix)
+        csc.sort_indices()
+        self.n_rows, self.n_terms = csc.shape
+        self.postings_ptr = csc.indptr
+        self.postings_rows = csc.indices
+        self.postings_weights = csc.data
+        self.max_weights = np.zeros(self.n_terms, dtype=np.float64)
+        term_of_entry = np.repeat(np.arange(self.n_terms), np.diff(self.postings_ptr))
+        np.maximum.at(self.max_weights, term_of_entry, self.postings_weights)
+
+    def search(self, query_vector, k, allow=None):
+        """
+        쿼리 벡터(1 x 어휘, 희소)와 내적이 가장 큰 k개 행을 (행 번호, 점수)로 반환합니다.
+        - allow: 카탈로그 행 기준 bool 배열 (False인 행은 결과에서 제외)
+        - 점수 내림차순, 동점이면 행 번호 오름차순 (= 전체 코사인 계산 후 정렬한 결과와 동일)
+        """
+        query_vector = sparse.csr_matrix(query_vector)
+        terms = query_vector.indices
+        query_weights = query_vector.data.astype(np.float64)
+
+        # 1. 단어별 점수 상한(쿼리 가중치 x 최대 가중치)이 큰 순서로 처리
+        upper_bounds = query_weights * self.max_weights[terms]
+        order = np.argsort(-upper_bounds, kind='stable')
+        order = order[upper_bounds[order] > 0]
+        terms, query_weights, upper_bounds = terms[order], query_weights[order], upper_bounds[order]
+        remaining_bounds = np.append(np.cumsum(upper_bounds[::-1])[::-1], 0.0)
+
+        cand_rows = np.empty(0, dtype=np.int64)
+        cand_scores = np.empty(0, dtype=np.float64)
+        pruning = False
+
+        for i, (term, weight) in enumerate(zip(terms, query_weights)):
+            start, end = self.postings_ptr[term], self.postings_ptr[term + 1]
+            rows = self.postings_rows[start:end]
+            contributions = self.postings_weights[start:end] * weight
+            if allow is not None:
+                allowed = allow[rows]
+                rows, contributions = rows[allowed], contributions[allowed]
+
+            if not pruning:
+                # 2-1. 새 후보 추가 + 기존 후보 점수 합산
+                merged_rows, inverse = np.unique(
+                    np.concatenate([cand_rows, rows]), return_inverse=True
+                )
+                cand_scores = np.bincount(
+                    inverse, weights=np.concatenate([cand_scores, contributions]),
+                    minlength=len(merged_rows)
+                )
+                cand_rows = merged_rows
+            elif len(rows) and len(cand_rows):
+                # 2-2. 가지치기 단계: 기존 후보의 점수만 갱신 (postings는 행 번호로 정렬됨)
+                found = np.clip(np.searchsorted(rows, cand_rows), 0, len(rows) - 1)
+                hit = rows[found] == cand_rows
+                cand_scores[hit] += contributions[found[hit]]
+
+            # 3. 현재 k등 점수(threshold)와 남은 단어들의 상한 합 비교
+            if len(cand_rows) >= k > 0:
+                threshold = -np.partition(-cand_scores, k - 1)[k - 1]
+                remaining = remaining_bounds[i + 1]
+                if not pruning and threshold > remaining:
+                    # 아직 후보가 아닌 행(현재 0점)은 남은 단어를 모두 받아도 k등을 넘을 수 없음
+                    pruning = True
+                if pruning:
+                    alive = cand_scores + remaining >= threshold
+                    cand_rows, cand_scores = cand_rows[alive], cand_scores[alive]
+
+        top = _top_k_indices(cand_scores, k)
+        top_rows, top_scores = cand_rows[top], cand_scores[top]
+
+        # 4. 점수가 있는 후보가 k개 미만이면, 0점인 (허용된) 행을 앞에서부터 채움
+        if len(top_rows) < k:
+            zero_rows = np.ones(self.n_rows, dtype=bool) if allow is None else allow.copy()
+            zero_rows[cand_rows] = False
+            fill = np.flatnonzero(zero_rows)[:k - len(top_rows)]
+            top_rows = np.concatenate([top_rows, fill])
+            top_scores = np.concatenate([top_scores, np.zeros(len(fill))])
+        return top_rows, top_scores
+
+
+# 프로세스 전역 캐시: DB 파일 -> TfidfIndex
+_TFIDF_CACHE = {}
+_TFIDF_LOCK = threading.Lock()
+
+def rebuild_tfidf_index(catalog):
+    """카탈로그로 TF-IDF를 다시 학습해서 디스크에 저장하고 캐시를 교체합니다."""
+    start = time.perf_counter()
+    index = TfidfIndex.build(catalog)
+    if catalog.db_file and catalog.db_file != ':memory:':
+        try:
+            index.save(get_index_dir(catalog.db_file))
+        except OSError as e:
+            print(f"⚠️ (TF-IDF) 인덱스 저장 실패 (메모리에서만 사용): {e}")
+    # (백그라운드 병합 중에 캐시가 더 최신 버전으로 넘어갔다면 덮어쓰지 않음)
+    cached = _TFIDF_CACHE.get(catalog.db_file)
+    if cached is None or cached.catalog_version <= index.catalog_version:
+        _TFIDF_CACHE[catalog.db_file] = index
+    print(f"✅ (TF-IDF) 인덱스 재학습 완료: 레시피 {index.matrix.shape[0]}개 x 어휘 {index.matrix.shape[1]}개 "
+          f"({(time.perf_counter() - start) * 1000:.0f} ms, 카탈로그 v{catalog.version})")
+    return index
+
+def get_tfidf_index(catalog=None):
+    """
+    현재 카탈로그 버전의 TF-IDF 인덱스 (처음 필요할 때 로드).
+    메모리 캐시 -> 디스크 -> (없거나 stale이면) 재학습 순서로 찾습니다.
+    (새 행 추가만 있었다면 재학습 대신 delta 세그먼트에 이어 붙임)
+    """
+    if catalog is None:
+        catalog = get_recipe_catalog()
+    index = _TFIDF_CACHE.get(catalog.db_file)
+    if index is not None and index.is_current(catalog):
+        return index
+
+    with _TFIDF_LOCK:
+        index = _TFIDF_CACHE.get(catalog.db_file)
+        if index is not None and index.is_current(catalog):
+            return index
+        if index is not None and index.can_extend_to(catalog):
+            return _extend_tfidf_index(index, catalog)
+        if catalog.db_file and catalog.db_file != ':memory:':
+            index = TfidfIndex.load(get_index_dir(catalog.db_file))
+            if index is not None and index.is_current(catalog):
+                _TFIDF_CACHE[catalog.db_file] = index
+                print(f"✅ (TF-IDF) 저장된 인덱스 로드 (카탈로그 v{catalog.version})")
+                return index
+            if index is not None and index.can_extend_to(catalog):
+                return _extend_tfidf_index(index, catalog)
+            if index is not None:
+                print(f"⚠️ (TF-IDF) 저장된 인덱스가 오래됨 (v{index.catalog_version} != v{catalog.version}). 재학습합니다.")
+        return rebuild_tfidf_index(catalog)
+
+def _extend_tfidf_index(index, catalog):
+    """(_TFIDF_LOCK 안에서) 새 행을 delta 세그먼트에 추가하고, 커졌으면 백그라운드 병합 예약"""
+    start = time.perf_counter()
+    n_new = catalog.n_rows - len(index.recipe_ids)
+    index = index.extended(catalog)
+    _TFIDF_CACHE[catalog.db_file] = index
+    print(f"✅ (TF-IDF) 새 레시피 {n_new}개를 delta 세그먼트에 추가 "
+          f"(delta {index.delta_matrix.shape[0]}개, {(time.perf_counter() - start) * 1000:.0f} ms, 카탈로그 v{catalog.version})")
+    schedule_segment_merge(catalog, index.delta_matrix.shape[0], index.matrix.shape[0])
+    return index
+
+
+# --- 백그라운드 세그먼트 병합 ---
+# delta 세그먼트는 새 단어를 모르고(기존 어휘 사전), IDF도 학습 당시 값이므로
+# 어느 정도 커지면 전체 카탈로그로 다시 학습해서 본 세그먼트 하나로 합칩니다.
+# 요청 처리 스레드는 기다리지 않고 기존(본 + delta) 인덱스를 계속 사용합니다.
+
+_MERGE_THREADS = {}
+_MERGE_LOCK = threading.Lock()
+
+def schedule_segment_merge(catalog, n_delta_rows, n_base_rows):
+    """delta 세그먼트가 기준보다 크면 백그라운드 병합 스레드를 (DB 파일당 하나만) 시작합니다."""
+    if n_delta_rows < max(SEGMENT_MERGE_MIN_ROWS, SEGMENT_MERGE_RATIO * n_base_rows):
+        return False
+    with _MERGE_LOCK:
+        running = _MERGE_THREADS.get(catalog.db_file)
+        if running is not None and running.is_alive():
+            return False
+        thread = threading.Thread(
+            target=_merge_segments, args=(catalog,), name="bobfit-segment-merge", daemon=True
+        )
+        _MERGE_THREADS[catalog.db_file] = thread
+        thread.start()
+    print(f"🔄 (인덱스) delta 세그먼트 {n_delta_rows}개 -> 백그라운드 병합 시작 (카탈로그 v{catalog.version})")
+    return True
+
+def _merge_segments(catalog):
+    """(백그라운드 스레드) TF-IDF(+ 사용 중인 LSA) 전체 재학습 후 교체, 오래된 변경 기록 정리"""
+    start = time.perf_counter()
+    try:
+        rebuild_tfidf_index(catalog)
+        lsa_index = _LSA_CACHE.get(catalog.db_file)
+        if lsa_index is not None:
+            build_lsa_index(catalog, lsa_index.vectors.shape[1])
+        if catalog.db_file and catalog.db_file != ':memory:':
+            with db_connection(catalog.db_file) as conn:
+                prune_catalog_changes(conn)
+        print(f"✅ (인덱스) 세그먼트 병합 완료 ({(time.perf_counter() - start):.1f} s, 카탈로그 v{catalog.version})")
+    except Exception as e:
+        print(f"❌ (인덱스) 세그먼트 병합 실패 (기존 인덱스를 계속 사용): {e}")
+
+# -----------------------------------------------------------------
+# [신규 추가] LSA 밀집 임베딩 인덱스 (TruncatedSVD + float16 메모리 맵)
+# -----------------------------------------------------------------
+# 재료 TF-IDF는 '국물' 요리와 '찌개' 요리처럼 재료 목록이 달라도 비슷한 요리를 놓칩니다.
+# 제목 + 요리명 + 재료 TF-IDF를 TruncatedSVD로 저차원(LSA_COMPONENTS) 밀집 벡터로 줄여서
+# 오프라인으로 저장해 두고, 쿼리마다 NumPy 행렬 곱 한 번으로 채점합니다.
+#   - vectors.npy: [레시피 수, 차원] float16 (L2 정규화, np.load mmap_mode='r'로 로드)
+#   - components.npy: SVD 투영 행렬 (쿼리를 같은 공간으로 변환)
+#   - vocabulary.json / idf.npy / recipe_ids.npy / meta.json: TF-IDF 인덱스와 동일
+# (python recommend_gemini.py build-lsa 로 생성. 없거나 오래되면 'tfidf' 방식으로 대체)
+
+LSA_INDEX_FORMAT = 1
+LSA_COMPONENTS = 128
+
+def _l2_normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+class LsaIndex:
+    """
+    레시피별 LSA 밀집 벡터 (행 = 카탈로그 행 순서). 점수 = 벡터 내적 = 코사인 유사도
+    (생성 이후 추가된 레시피는 같은 투영 행렬로 변환해서 delta_vectors에 보관)
+    """
+
+    def __init__(self, vocabulary, idf, components, vectors, recipe_ids, catalog_version):
+        self.vocabulary = list(vocabulary)
+        self.idf = np.asarray(idf)
+        self.components = np.asarray(components, dtype=np.float32)
+        # 희소 행렬 x 밀집 행렬 곱은 오른쪽이 C-연속일 때 훨씬 빠르므로 전치본을 미리 만들어 둠
+        self._projection = np.ascontiguousarray(self.components.T)
+        self.vectors = vectors
+        self.delta_vectors = np.empty((0, vectors.shape[1]), dtype=np.float16)
+        self.recipe_ids = np.asarray(recipe_ids)
+        self.catalog_version = catalog_version
+        self.vectorizer = _make_vectorizer(self.vocabulary, self.idf)
+
+    @classmethod
+    def build(cls, catalog, n_components=LSA_COMPONENTS):
+        """(오프라인 작업) 제목 + 요리명 + 재료 TF-IDF -> TruncatedSVD -> float16 벡터"""
+        vectorizer = TfidfVectorizer()
+        tfidf_matrix = vectorizer.fit_transform(catalog.document_texts())
+        n_components = max(1, min(n_components, tfidf_matrix.shape[1] - 1, tfidf_matrix.shape[0] - 1))
+        svd = TruncatedSVD(n_components=n_components, random_state=42)
+        vectors = _l2_normalize(svd.fit_transform(tfidf_matrix)).astype(np.float16)
+        return cls(
+            vectorizer.get_feature_names_out().tolist(),
+            vectorizer.idf_,
+            svd.components_,
+            vectors,
+            catalog.recipe_ids,
+            catalog.version,
+        )
+
+    def is_current(self, catalog):
+        return (
+            self.catalog_version == catalog.version
+            and len(self.recipe_ids) == catalog.n_rows
+            and np.array_equal(self.recipe_ids, catalog.recipe_ids)
+        )
+
+    def can_extend_to(self, catalog):
+        """그 사이 '새 행 추가'만 있었으면 True (TfidfIndex.can_extend_to와 동일)"""
+        n = len(self.recipe_ids)
+        return (
+            catalog.append_only_since <= self.catalog_version <= catalog.version
+            and n <= catalog.n_rows
+            and np.array_equal(self.recipe_ids, catalog.recipe_ids[:n])
+        )
+
+    def extended(self, catalog):
+        """새 행들을 같은 LSA 공간으로 투영해서 delta_vectors에 추가한 새 인덱스"""
+        delta = self.embed(catalog.document_texts(start=len(self.recipe_ids))).astype(np.float16)
+        index = copy.copy(self)
+        index.delta_vectors = np.concatenate([self.delta_vectors, delta])
+        index.recipe_ids = catalog.recipe_ids
+        index.catalog_version = catalog.version
+        return index
+
+    def save(self, index_dir):
+        vectors = np.concatenate([np.asarray(self.vectors, dtype=np.float16), self.delta_vectors])
+        tmp_dir = _new_index_tmp_dir(index_dir)
+        with open(os.path.join(tmp_dir, 'vocabulary.json'), 'w', encoding='utf-8') as f:
+            json.dump(self.vocabulary, f, ensure_ascii=False)
+        np.save(os.path.join(tmp_dir, 'idf.npy'), self.idf)
+        np.save(os.path.join(tmp_dir, 'components.npy'), self.components)
+        np.save(os.path.join(tmp_dir, 'vectors.npy'), vectors)
+        np.save(os.path.join(tmp_dir, 'recipe_ids.npy'), self.recipe_ids)
+        with open(os.path.join(tmp_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump({
+                'format': LSA_INDEX_FORMAT,
+                'catalog_version': self.catalog_version,
+                'n_rows': int(vectors.shape[0]),
+                'n_components': int(vectors.shape[1]),
+                'built_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+            }, f)
+        _swap_index_dir(tmp_dir, index_dir)
+
+    @classmethod
+    def load(cls, index_dir):
+        """저장된 LSA 인덱스 로드 (벡터는 메모리 맵). 없거나 포맷이 다르면 None"""
+        try:
+            with open(os.path.join(index_dir, 'meta.json'), encoding='utf-8') as f:
+                meta = json.load(f)
+            if meta.get('format') != LSA_INDEX_FORMAT:
+                return None
+            with open(os.path.join(index_dir, 'vocabulary.json'), encoding='utf-8') as f:
+                vocabulary = json.load(f)
+            return cls(
+                vocabulary,
+                np.load(os.path.join(index_dir, 'idf.npy')),
+                np.load(os.path.join(index_dir, 'components.npy')),
+                np.load(os.path.join(index_dir, 'vectors.npy'), mmap_mode='r'),
+                np.load(os.path.join(index_dir, 'recipe_ids.npy')),
+                meta['catalog_version'],
+            )
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as e:
+            print(f"⚠️ (LSA) 저장된 인덱스를 읽지 못했습니다: {e}")
+            return None
+
+    def embed(self, texts):
+        """쿼리 텍스트 -> 같은 LSA 공간의 정규화된 벡터 [num_texts, 차원]"""
+        projected = self.vectorizer.transform(texts) @ self._projection
+        return _l2_normalize(np.asarray(projected, dtype=np.float32))
+
+    def score(self, texts, positions, chunk_size=8192):
+        """
+        쿼리들 x 지정한 카탈로그 행들의 코사인 유사도 [num_texts, len(positions)].
+        float16 -> float32 변환 비용이 커서, CPU 캐시에 맞는 크기(chunk_size)로 나눠서 곱합니다.
+        """
+        query_vectors = self.embed(texts)
+        positions = np.asarray(positions, dtype=np.int64)
+        scores = np.empty((len(query_vectors), len(positions)), dtype=np.float32)
+        for start in range(0, len(positions), chunk_size):
+            block = self._vectors_at(positions[start:start + chunk_size])
+            scores[:, start:start + chunk_size] = query_vectors @ block.T
+        return scores
+
+    def _vectors_at(self, positions):
+        """카탈로그 행 번호들의 벡터 (float32, 본/delta 세그먼트에서 각각)"""
+        n_base = self.vectors.shape[0]
+        in_base = positions < n_base
+        if in_base.all():
+            return self.vectors[positions].astype(np.float32)
+        block = np.empty((len(positions), self.vectors.shape[1]), dtype=np.float32)
+        block[in_base] = self.vectors[positions[in_base]]
+        block[~in_base] = self.delta_vectors[positions[~in_base] - n_base]
+        return block
+
+
+# 프로세스 전역 캐시: DB 파일 -> LsaIndex
+_LSA_CACHE = {}
+
+def build_lsa_index(catalog, n_components=LSA_COMPONENTS):
+    """(오프라인 작업) LSA 인덱스를 만들어 디스크에 저장하고 캐시를 교체합니다."""
+    start = time.perf_counter()
+    index = LsaIndex.build(catalog, n_components)
+    if catalog.db_file and catalog.db_file != ':memory:':
+        index.save(get_index_dir(catalog.db_file, 'lsa'))
+    cached = _LSA_CACHE.get(catalog.db_file)
+    if cached is None or cached.catalog_version <= index.catalog_version:
+        _LSA_CACHE[catalog.db_file] = index
+    print(f"✅ (LSA) 인덱스 생성 완료: 레시피 {index.vectors.shape[0]}개 x {index.vectors.shape[1]}차원 "
+          f"(float16 {index.vectors.nbytes / 1024 / 1024:.1f} MB, {(time.perf_counter() - start):.1f} s)")
+    return index
+
+def get_lsa_index(catalog=None):
+    """
+    현재 카탈로그 버전의 LSA 인덱스 (메모리 캐시 -> 디스크).
+    학습은 오프라인 작업이므로 여기서는 하지 않고, 없거나 오래되었으면 None을 반환합니다.
+    """
+    if catalog is None:
+        catalog = get_recipe_catalog()
+    index = _LSA_CACHE.get(catalog.db_file)
+    if index is not None and index.is_current(catalog):
+        return index
+    if index is not None and index.can_extend_to(catalog):
+        return _extend_lsa_index(index, catalog)
+    if catalog.db_file and catalog.db_file != ':memory:':
+        index = LsaIndex.load(get_index_dir(catalog.db_file, 'lsa'))
+        if index is not None and index.is_current(catalog):
+            _LSA_CACHE[catalog.db_file] = index
+            print(f"✅ (LSA) 저장된 인덱스 로드 (카탈로그 v{catalog.version})")
+            return index
+        if index is not None and index.can_extend_to(catalog):
+            return _extend_lsa_index(index, catalog)
+    print("⚠️ (LSA) 최신 인덱스가 없습니다. 'python recommend_gemini.py build-lsa'를 실행해주세요.")
+    return None
+
+def _extend_lsa_index(index, catalog):
+    """새 행을 LSA delta 세그먼트에 추가 (병합은 TF-IDF 병합 때 함께 수행)"""
+    n_new = catalog.n_rows - len(index.recipe_ids)
+    index = index.extended(catalog)
+    _LSA_CACHE[catalog.db_file] = index
+    print(f"✅ (LSA) 새 레시피 {n_new}개를 delta 세그먼트에 추가 (delta {len(index.delta_vectors)}개, 카탈로그 v{catalog.version})")
+    return index
+
+def _tfidf_rows_for(tfidf_index, catalog, recipes_df):
+    """DataFrame 행 순서대로 TF-IDF 행렬을 구성 (카탈로그에 없는 행만 즉석 변환)"""
+    positions = catalog.positions(recipes_df['RCP_SNO'].to_numpy())
+    known = positions >= 0
+    if known.all():
+        return tfidf_index.rows(positions)
+    matrix = sparse.lil_matrix((len(positions), tfidf_index.matrix.shape[1]), dtype=np.float32)
+    if known.any():
+        matrix[np.flatnonzero(known)] = tfidf_index.rows(positions[known])
+    json_values = (
+        recipes_df['ingredients_json'].to_numpy()[~known] if 'ingredients_json' in recipes_df
+        else [None] * int((~known).sum())
+    )
+    unknown_texts = [_extract_ingredients_text(json_str) for json_str in json_values]
+    matrix[np.flatnonzero(~known)] = tfidf_index.transform(unknown_texts)
+    return matrix.tocsr()
+
+# -----------------------------------------------------------------
+# [신규 추가] 1순위: AI 레시피 변형 (Generative AI)
+# -----------------------------------------------------------------
+
+def modify_recipe_with_gemini(api_key, recipe_title, ingredients, modification_request, original_cal_str="정보 없음",
+                              use_cache=True, user=None):
+    """
+    (GenAI) 원본 레시피를 사용자의 요청에 맞춰 변형합니다. (칼로리 일관성 유지)
+    (같은 레시피 + 같은 요청은 Gemini 응답 캐시에서 재사용, use_cache=False면 항상 새로 생성)
+    """
+    try:
+        client = get_gemini_client(api_key)
+        
+        ingredients_str = format_ingredients(ingredients) # 재료 dict (또는 ingredients_json 문자열)
+
+        # [프롬프트 수정] 기준 칼로리 정보 명시
+        prompt = f"""
+        당신은 창의적이고 유능한 요리 연구가입니다.
+        아래의 [원본 레시피]를 사용자의 [요청 사항]에 맞춰 **새롭게 변형**해주세요.
+
+        [원본 레시피 정보]
+        - 요리명: {recipe_title}
+        - 원본 재료: {ingredients_str}
+        - **원본 1인분 기준 열량: {original_cal_str}**
+
+        [사용자 요청 사항]
+        👉 "{modification_request}"
+
+        [작성 가이드]
+        1. 요청 사항을 철저히 반영하여 **변경된 재료 목록**을 작성하세요. 
+        2. [★매우 중요 - 열량 재계산]
+           - 위에서 제공된 **원본 기준 열량({original_cal_str})**을 기준으로, 재료가 빠지거나 줄어들면 낮추고, 추가되면 높여서 계산하세요.
+           - 결과물 맨 윗줄에 **(변형된 예상 열량: 약 XXX kcal)** 라고 명시해주세요.
+           - (예: 원본이 500kcal인데 '1/2분량' 요청 -> "약 250kcal")
+           
+        3. 변형된 재료로 요리하는 **간단한 조리법(Step-by-Step)**을 3~7단계로 요약해서 작성하세요.
+        4. 마지막에 이 변형이 왜 좋은지 **'영양사의 한마디'**를 덧붙여주세요.
+        5. 출력 형식은 읽기 편한 **Markdown**으로 작성해주세요.
+        """
+        
+        print(f"🤖 (GenAI) 레시피 변형 요청: {recipe_title} (기준: {original_cal_str}) -> {modification_request}")
+        
+        # 안전 설정 해제(RELAXED_SAFETY_SETTINGS) 적용
+        def generate():
+            response = generate_with_retry(client, prompt, label="레시피 변형", safety_settings=RELAXED_SAFETY_SETTINGS,
+                                           priority=PRIORITY_ON_DEMAND, user=user, call_site='modify_recipe')
+            if response.candidates and response.candidates[0].content.parts:
+                return response.text
+            return None
+        
+        modified = cached_gemini_call('modify_recipe', prompt, generate, use_cache=use_cache, model=client.model_name,
+                                      user=user)
+        if modified is not None:
+            return modified
         else:
             return "죄송합니다. AI가 응답을 생성하지 못했습니다."
 
+    except LLMBudgetExceededError as e:
+        print(f"💸 (GenAI) 레시피 변형 생략: {e}")
+        return "오늘 AI 레시피 변형 한도를 모두 사용했습니다. 내일 다시 시도해주세요."
     except Exception as e:
         print(f"❌ (GenAI) 레시피 변형 실패: {e}")
         return "오류가 발생했습니다."
@@ -757,17 +4122,221 @@ def modify_recipe_with_gemini(api_key, recipe_title, ingredients_json, modificat
 # [신규 추가] 2순위: 동적 키워드 추출 (AI 핀포인트)
 # -----------------------------------------------------------------
 
-def extract_keywords_with_gemini(api_key, user_input):
+# --- 로컬 키워드 확장 (LLM 없이) ---
+# "면류가 먹고 싶어", "비 와서 국물 땡겨" 같은 흔한 요청은 네트워크 왕복 없이 사전으로 바로 확장합니다.
+# 1. 정규화(NFKC, 소문자, 특수문자 제거) -> 서술어('먹고 싶어', '땡겨', '해줘'...) 제거 -> 조사 떼기
+# 2. 단어마다: 군말·연결 어미(무시) / 상황 힌트(비 -> 국물) / 카테고리(면류 -> 국수 파스타...) /
+#    카탈로그의 요리명(CKG_NM)·재료명·조리법 -> 인식, 그 밖은 '모르는 단어'
+# 3. 인식한 단어 비율(신뢰도)이 LOCAL_KEYWORD_MIN_CONFIDENCE 이상이면 로컬 결과 사용, 아니면 Gemini 호출
+# 카테고리 확장에는 카탈로그에서 그 카테고리 끝말(찌개, 탕, 면, 밥...)로 끝나는 자주 나오는 요리명도 붙입니다.
+
+LOCAL_KEYWORDS_ENABLED = os.getenv("BOBFIT_LOCAL_KEYWORDS", "1") != "0"
+LOCAL_KEYWORD_MIN_CONFIDENCE = 0.75
+LOCAL_KEYWORD_MAX_TERMS = 12
+LOCAL_KEYWORD_CATALOG_DISHES = 4 # 카테고리마다 붙일 카탈로그 요리명 수 (빈도순)
+LOCAL_KEYWORD_MEMO_SIZE = 4096 # 메모이즈할 입력 수 (넘으면 오래된 것부터 삭제)
+
+# 카테고리: (사용자가 쓰는 말, 확장 키워드). 확장 키워드는 카탈로그 요리명의 '끝말' 매칭에도 사용
+KEYWORD_CATEGORIES = {
+    "면": (("면", "면류", "면요리", "누들"),
+          ("면", "국수", "파스타", "라면", "우동", "스파게티", "짬뽕", "짜장면", "냉면")),
+    "국물": (("국물", "국물요리", "국", "탕", "찌개", "전골", "따뜻한", "따뜻하게", "뜨끈한", "뜨끈하게"),
+           ("국물", "탕", "찌개", "전골", "국", "따뜻한", "얼큰한")),
+    "매운": (("매운", "매운거", "매콤", "매콤한", "얼큰", "얼큰한", "맵게", "화끈한"),
+           ("매운", "매콤한", "얼큰한", "떡볶이", "마라", "불닭", "닭발")),
+    "간단": (("간단", "간단하게", "간단한", "간편", "간편한", "초간단", "빨리", "후딱"),
+           ("간편식", "덮밥", "볶음밥", "토스트", "샌드위치")),
+    "고기": (("고기", "육류", "고기요리"),
+           ("고기", "소고기", "돼지고기", "닭고기", "삼겹살", "불고기", "제육")),
+    "해산물": (("해산물", "해물", "생선", "수산물"),
+            ("해물", "새우", "오징어", "조개", "생선", "고등어", "연어")),
+    "밥": (("밥", "밥요리", "든든한", "든든하게"),
+          ("밥", "덮밥", "볶음밥", "비빔밥", "김밥")),
+    "가벼운": (("가벼운", "가볍게", "다이어트", "저칼로리", "건강한", "건강하게"),
+            ("샐러드", "닭가슴살", "두부", "채소", "곤약")),
+    "달콤": (("달콤", "달콤한", "단거", "디저트", "간식", "달달한", "달달"),
+           ("달콤한", "디저트", "케이크", "쿠키", "과일")),
+    "시원한": (("시원한", "시원하게", "차가운", "차갑게"),
+            ("시원한", "냉면", "냉국", "콩국수", "샐러드")),
+}
+
+# 상황(날씨/기분) 단어 -> 카테고리
+KEYWORD_CONTEXT_HINTS = {
+    "비": "국물", "비오는": "국물", "추워": "국물", "추운": "국물", "쌀쌀": "국물", "쌀쌀한": "국물", "해장": "국물",
+    "더워": "시원한", "더운": "시원한", "스트레스": "매운", "우울": "달콤", "우울해": "달콤",
+}
+
+# '먹고 싶어', '땡겨', '해줘' 같은 서술어 (정규화한 문장에서 통째로 제거)
+KEYWORD_PREDICATE_PATTERN = re.compile(
+    r"먹고\s*싶(?:어요|어|다|네|은데|을까)?|먹을래|먹자|땡기(?:네|는데|는|다)|땡겨(?:요)?|땡긴다|당겨(?:요)?|당기는"
+    r"|해\s*주세요|해\s*줘(?:요)?|만들어\s*줘|알려\s*줘|추천\s*해?\s*줘|주세요|싶어(?:요)?|싶다|싶은데|좋겠어|없을까"
+)
+# 뜻 없는 군말 (무시, 신뢰도 계산에서도 제외)
+KEYWORD_FILLER_WORDS = {
+    "오늘", "지금", "좀", "조금", "뭔가", "그냥", "진짜", "정말", "너무", "많이", "아무거나", "뭐", "뭐가", "뭘",
+    "요리", "음식", "메뉴", "거", "것", "같은", "느낌", "날", "날씨", "이라", "라서", "와서", "오니까", "와", "오는",
+    "해서", "이니까", "니까", "그런", "종류", "쪽", "위주", "위주로", "하나", "한번", "먹고", "먹을", "먹는",
+    "아침", "점심", "저녁", "밤", "야식", "혼자", "같이", "나", "내가", "저", "제가", "기분", "기분이", "하고",
+}
+# 이유/상황을 잇는 어미 ('받아서', '중이라', '추우니까'...). 모르는 단어가 이걸로 끝나면 군말로 처리
+KEYWORD_CONNECTIVE_ENDINGS = ("아서", "어서", "워서", "와서", "해서", "라서", "파서", "나서", "려서", "져서",
+                              "이라", "니까", "으니", "는데", "지만")
+# 단어 끝에 붙는 조사/어미 (긴 것부터, '더워서' -> '더워'처럼 떼고 다시 찾아봄)
+KEYWORD_PARTICLES = ("으로", "이랑", "하고", "에서", "처럼", "가", "이", "을", "를", "은", "는", "도", "랑", "로", "에", "만", "류",
+                     "서")
+
+def normalize_keyword_input(text):
+    """자율 입력 정규화: NFKC + 소문자 + 한글/영문/숫자 외 문자 제거 + 서술어 제거"""
+    text = unicodedata.normalize('NFKC', text or "").lower()
+    text = re.sub(r"[^0-9a-z가-힣\s]", " ", text)
+    text = KEYWORD_PREDICATE_PATTERN.sub(" ", text)
+    return " ".join(text.split())
+
+class KeywordExpander:
+    """
+    카탈로그 어휘(요리명/재료명/조리법) + KEYWORD_CATEGORIES로 만든 로컬 키워드 확장 사전.
+    - expand(text) -> (키워드 문자열, 신뢰도 0~1). 같은 (정규화된) 입력은 메모이즈
+    """
+    def __init__(self, catalog):
+        self.catalog_version = catalog.version
+        frame = catalog.frame
+        dish_counts = frame['CKG_NM'].dropna().astype(str).str.strip().value_counts()
+        dish_counts = dish_counts[dish_counts.index.str.len() > 1]
+        self.vocabulary = set(dish_counts.index)
+        self.vocabulary.update(name.strip() for name in catalog.ingredient_vocabulary() if len(name.strip()) > 1)
+        self.vocabulary.update(frame['CKG_MTH_ACTO_NM'].dropna().astype(str).str.strip())
+        
+        self.aliases = {}
+        self.expansions = {}
+        for category, (aliases, terms) in KEYWORD_CATEGORIES.items():
+            for alias in aliases:
+                self.aliases.setdefault(alias, category)
+            # 카탈로그 요리명 중 이 카테고리 끝말로 끝나는 것 (빈도순)
+            dishes = [dish for dish in dish_counts.index if dish.endswith(terms) and dish not in terms]
+            self.expansions[category] = list(terms) + dishes[:LOCAL_KEYWORD_CATALOG_DISHES]
+        self._memo = {}
+    
+    def _lookup(self, token):
+        """단어 하나 -> ('filler' | 'category' | 'term' | None, 값)"""
+        candidates = [token] + [token[:-len(particle)] for particle in KEYWORD_PARTICLES
+                                if token.endswith(particle) and len(token) > len(particle)]
+        for word in candidates:
+            if word in KEYWORD_FILLER_WORDS:
+                return 'filler', word
+            if word in KEYWORD_CONTEXT_HINTS:
+                return 'category', KEYWORD_CONTEXT_HINTS[word]
+            if word in self.aliases:
+                return 'category', self.aliases[word]
+            if word in self.vocabulary:
+                return 'term', word
+        if token.endswith(KEYWORD_CONNECTIVE_ENDINGS):
+            return 'filler', token
+        return None, token
+    
+    def expand(self, text):
+        key = normalize_keyword_input(text)
+        cached = self._memo.get(key)
+        if cached is not None:
+            return cached + (True,)
+        
+        terms = []
+        categories = []
+        n_known = n_unknown = 0
+        for token in key.split():
+            kind, value = self._lookup(token)
+            if kind == 'filler':
+                continue
+            if kind is None:
+                n_unknown += 1
+                continue
+            n_known += 1
+            if kind == 'category':
+                if value not in categories:
+                    categories.append(value)
+            elif value not in terms:
+                terms.append(value)
+        for category in categories:
+            terms.extend(term for term in self.expansions[category] if term not in terms)
+        
+        confidence = n_known / (n_known + n_unknown) if n_known else 0.0
+        result = (" ".join(terms[:LOCAL_KEYWORD_MAX_TERMS]), confidence)
+        if len(self._memo) >= LOCAL_KEYWORD_MEMO_SIZE:
+            self._memo.pop(next(iter(self._memo)), None)
+        self._memo[key] = result
+        return result + (False,)
+
+_KEYWORD_EXPANDER = None
+_KEYWORD_EXPANDER_LOCK = threading.Lock()
+_KEYWORD_STATS = {'requests': 0, 'memo_hits': 0, 'local': 0, 'llm': 0}
+
+def get_keyword_expander(catalog=None):
+    """현재 카탈로그 버전의 KeywordExpander (카탈로그가 바뀌면 다시 만듦)"""
+    global _KEYWORD_EXPANDER
+    if catalog is None:
+        catalog = get_recipe_catalog()
+    expander = _KEYWORD_EXPANDER
+    if expander is not None and expander.catalog_version == catalog.version:
+        return expander
+    with _KEYWORD_EXPANDER_LOCK:
+        if _KEYWORD_EXPANDER is None or _KEYWORD_EXPANDER.catalog_version != catalog.version:
+            _KEYWORD_EXPANDER = KeywordExpander(catalog)
+        return _KEYWORD_EXPANDER
+
+def expand_keywords_locally(user_input, min_confidence=None):
+    """
+    자율 입력 -> 로컬 확장 키워드 (신뢰도가 낮거나 인식한 단어가 없으면 None = Gemini로 넘김)
+    처리 결과는 keyword_expansion_stats()에 집계됩니다.
+    """
+    min_confidence = LOCAL_KEYWORD_MIN_CONFIDENCE if min_confidence is None else min_confidence
+    try:
+        keywords, confidence, memo_hit = get_keyword_expander().expand(user_input)
+    except Exception as e:
+        print(f"⚠️ (로컬 키워드) 사전 준비 실패, Gemini로 넘깁니다: {e}")
+        keywords, confidence, memo_hit = "", 0.0, False
+    
+    is_local = bool(keywords) and confidence >= min_confidence
+    with _KEYWORD_EXPANDER_LOCK:
+        _KEYWORD_STATS['requests'] += 1
+        _KEYWORD_STATS['memo_hits'] += int(memo_hit)
+        _KEYWORD_STATS['local' if is_local else 'llm'] += 1
+        stats = dict(_KEYWORD_STATS)
+    print(f"🔎 (로컬 키워드) 신뢰도 {confidence:.2f} -> {'로컬 처리' if is_local else 'Gemini 호출'} "
+          f"| 로컬 처리율 {stats['local'] / stats['requests']:.0%}, 메모 적중률 {stats['memo_hits'] / stats['requests']:.0%} "
+          f"({stats['requests']}건)")
+    return keywords if is_local else None
+
+def keyword_expansion_stats():
+    """(지표) 로컬 키워드 확장 요청 수, 메모 적중, 로컬 처리/ Gemini 호출 횟수와 비율"""
+    with _KEYWORD_EXPANDER_LOCK:
+        stats = dict(_KEYWORD_STATS)
+    requests = stats['requests']
+    stats['local_rate'] = stats['local'] / requests if requests else 0.0
+    stats['memo_hit_rate'] = stats['memo_hits'] / requests if requests else 0.0
+    return stats
+
+def extract_keywords_with_gemini(api_key, user_input, use_cache=True, deadline=None, use_local=True, user=None):
     """
     사용자의 자율 입력(문장)에서 검색에 사용할 핵심 식재료/요리 키워드를 추출합니다.
     예: "비 오니까 따뜻한 국물 땡겨" -> "국물 요리 따뜻한 전골 찌개"
+    (같은 입력은 Gemini 응답 캐시에서 재사용, deadline: 재시도 포함 전체 제한 시간(초))
+    - use_local: 흔한 요청은 로컬 사전으로 먼저 확장하고, 신뢰도가 낮을 때만 Gemini 호출
+    - 오늘 사용 한도를 넘었으면 Gemini 없이 로컬 확장 결과만 사용 (신뢰도가 낮아도)
     """
     if not user_input or len(user_input) < 2:
         return ""
+    
+    budget_reason = llm_budget_exceeded(user)
+    if (use_local and LOCAL_KEYWORDS_ENABLED) or budget_reason:
+        keywords = expand_keywords_locally(user_input, min_confidence=0.0 if budget_reason else None)
+        if keywords is not None:
+            print(f"🔍 사용자 입력 '{user_input}' -> 키워드 확장(로컬): '{keywords}'")
+            return keywords
+        if budget_reason:
+            print(f"💸 키워드 추출 생략: {budget_reason}")
+            return ""
         
     try:
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel('models/gemini-flash-latest')
+        client = get_gemini_client(api_key)
         
         prompt = f"""
         역할: 레시피 데이터베이스 검색을 위한 '스마트 키워드 추출기'
@@ -790,8 +4359,12 @@ def extract_keywords_with_gemini(api_key, user_input):
         오직 공백으로 구분된 키워드만 한 줄로 출력하세요. (특수문자 제외)
         """
         
-        response = model.generate_content(prompt)
-        keywords = response.text.strip()
+        def generate():
+            return generate_with_retry(client, prompt, deadline=deadline, label="키워드 추출", user=user,
+                                       call_site='extract_keywords').text.strip()
+        
+        keywords = cached_gemini_call('extract_keywords', prompt, generate, use_cache=use_cache, model=client.model_name,
+                                      user=user)
         print(f"🔍 사용자 입력 '{user_input}' -> 키워드 추출: '{keywords}'")
         return keywords
         
@@ -799,12 +4372,8 @@ def extract_keywords_with_gemini(api_key, user_input):
         print(f"❌ 키워드 추출 실패: {e}")
         return ""
     
-def get_smart_candidates(profile, filtered_recipes_df, top_n=100, dynamic_keywords=""):
-    """
-    (ML) 사용자 프로필 + [동적 키워드]와 가장 유사한 레시피 선정
-    """
-    print(f"🤖 (ML) '취향 저격' 후보군 선정을 시작합니다... (대상: {len(filtered_recipes_df)}개)")
-    
+def _build_user_text(profile, dynamic_keywords=""):
+    """(HELPER) 사용자 프로필 + [동적 키워드] -> TF-IDF 검색용 쿼리 텍스트"""
     # [핵심 수정] 사용자 프로필 텍스트에 동적 키워드를 '가중치'로 추가
     # (키워드를 3번 반복해서 넣어주면 검색 중요도가 확 올라갑니다)
     user_text = profile['preferences'] + " " + profile['goals']
@@ -813,52 +4382,726 @@ def get_smart_candidates(profile, filtered_recipes_df, top_n=100, dynamic_keywor
         weighted_keywords = (dynamic_keywords + " ") * 3 # 가중치 3배 증폭
         user_text += " " + weighted_keywords
         print(f"✨ (ML) 동적 가중치 적용됨: {weighted_keywords}")
+    return user_text
+
+def _top_k_indices(scores, k):
+    """
+    (HELPER) 점수 상위 k개의 위치를 '점수 내림차순'으로 반환합니다.
+    전체 정렬(argsort) 대신 argpartition으로 상위 k개만 고른 뒤 그 k개만 정렬합니다.
+    (동점이면 앞쪽 행이 먼저)
+    """
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.array([], dtype=np.int64)
+    if k < len(scores):
+        top = np.argpartition(-scores, k - 1)[:k]
+    else:
+        top = np.arange(len(scores))
+    return top[np.lexsort((top, -scores[top]))]
+
+# 후보군 채점 방식: 'tfidf' = 필터링된 행 전체와 코사인 계산 / 'inverted' = 역색인 top-k 검색
+#                  'lsa' = 제목/요리명까지 반영한 밀집 임베딩 (build-lsa로 미리 생성 필요)
+DEFAULT_RANKING = 'tfidf'
+
+def get_smart_candidates_batch(profile, filtered_recipes_df, keyword_variants, top_n=20,
+                               exclude_ids=None, exclude_selected=True, ranking=None):
+    """
+    (ML) 여러 쿼리(프로필만 / 프로필+기분 키워드 / ...)를 한 번에 채점해서
+    쿼리별 상위 top_n개 레시피 DataFrame 리스트를 반환합니다. (유사도 점수 = ml_score 컬럼)
+    - keyword_variants: 쿼리별 동적 키워드 (""이면 프로필만 사용)
+    - exclude_ids: 처음부터 제외할 RCP_SNO 목록
+    - exclude_selected: True면 앞 쿼리에서 뽑힌 레시피는 뒤 쿼리에서 제외 (중복 없는 후보군)
+    - ranking: 'tfidf'(희소 행렬 곱 한 번으로 전체 채점), 'inverted'(역색인 top-k),
+               'lsa'(밀집 임베딩, 인덱스가 없으면 'tfidf'로 대체)
+    """
+    ranking = ranking or DEFAULT_RANKING
+    print(f"🤖 (ML) '취향 저격' 후보군 선정을 시작합니다... (대상: {len(filtered_recipes_df)}개, 쿼리 {len(keyword_variants)}개, 방식: {ranking})")
     
-    # 2. 레시피 재료 텍스트 생성 (비교 대상)
-    # (이 작업은 수천~수만 건이므로 시간이 조금 걸릴 수 있음)
-    recipe_texts = filtered_recipes_df['ingredients_json'].apply(_extract_ingredients_text)
+    user_texts = [_build_user_text(profile, keywords) for keywords in keyword_variants]
+    excluded = np.zeros(len(filtered_recipes_df), dtype=bool)
+    if exclude_ids is not None and len(filtered_recipes_df):
+        excluded |= filtered_recipes_df['RCP_SNO'].isin(list(exclude_ids)).to_numpy()
     
-    if recipe_texts.empty:
-        print("⚠️ (ML) 재료 텍스트를 추출할 수 없습니다. 랜덤 샘플링으로 대체합니다.")
-        sample_size = min(top_n, len(filtered_recipes_df))
-        return filtered_recipes_df.sample(n=sample_size, random_state=42)
+    if filtered_recipes_df.empty:
+        print("⚠️ (ML) 후보 레시피가 없습니다.")
+        return [filtered_recipes_df for _ in user_texts]
         
-    # 3. TF-IDF 벡터화
+    # 1~2. 미리 학습된 TF-IDF 인덱스 사용
+    select_top = None
     try:
-        vectorizer = TfidfVectorizer()
+        catalog = get_recipe_catalog()
+        tfidf_index = get_tfidf_index(catalog)
         
-        # 3-1. 레시피(재료) 전체로 TF-IDF 어휘 사전 학습
-        tfidf_matrix_recipes = vectorizer.fit_transform(recipe_texts)
+        # 1. 모든 쿼리 텍스트를 동일한 어휘 사전으로 변환 -> [num_queries, vocab]
+        tfidf_matrix_users = tfidf_index.transform(user_texts)
+        positions = catalog.positions(filtered_recipes_df['RCP_SNO'].to_numpy())
         
-        # 3-2. 사용자 프로필 텍스트를 동일한 어휘 사전으로 변환
-        tfidf_vector_user = vectorizer.transform([user_text])
+        lsa_index = get_lsa_index(catalog) if ranking == 'lsa' and (positions >= 0).all() else None
+        
+        if lsa_index is not None:
+            # 2-L. LSA 밀집 벡터: 쿼리 임베딩 x 필터링된 행 벡터 (NumPy 행렬 곱 한 번)
+            dense_sims = lsa_index.score(user_texts, positions)
+            
+            def select_top(query_no, eligible):
+                top = eligible[_top_k_indices(dense_sims[query_no][eligible], top_n)]
+                return top, dense_sims[query_no][top]
+        elif ranking == 'inverted' and (positions >= 0).all():
+            # 2-A. 역색인: 쿼리 단어의 postings만 훑어서 top-k (필터링 결과 = 허용 마스크)
+            # (본 세그먼트 + delta 세그먼트를 각각 검색해서 합침)
+            row_of_position = np.full(catalog.n_rows, -1, dtype=np.int64)
+            row_of_position[positions] = np.arange(len(positions))
+            
+            def select_top(query_no, eligible):
+                allow = np.zeros(catalog.n_rows, dtype=bool)
+                allow[positions[eligible]] = True
+                top_positions, top_scores = tfidf_index.search(tfidf_matrix_users[query_no], top_n, allow)
+                return row_of_position[top_positions], top_scores
+        else:
+            # 2-B. 필터링된 행만 '한 번' 잘라서 희소 행렬 곱 한 번으로 모든 쿼리 채점
+            # (모두 L2 정규화되어 있으므로 내적 = 코사인, 결과 shape: [num_queries, num_recipes])
+            tfidf_matrix_recipes = _tfidf_rows_for(tfidf_index, catalog, filtered_recipes_df)
+            cosine_sims = (tfidf_matrix_users @ tfidf_matrix_recipes.T).toarray()
+            
+            def select_top(query_no, eligible):
+                top = eligible[_top_k_indices(cosine_sims[query_no][eligible], top_n)]
+                return top, cosine_sims[query_no][top]
         
-        # 4. 코사인 유사도 계산
-        # (결과 shape: [1, num_recipes])
-        cosine_sims = cosine_similarity(tfidf_vector_user, tfidf_matrix_recipes)
+    except Exception as e:
+        print(f"❌ (ML) TF-IDF/유사도 계산 실패: {e}. 랜덤 샘플링으로 대체합니다.")
+        rng = np.random.default_rng(42)
         
-        # 5. 유사도 점수가 가장 높은 top_n개의 *인덱스* 찾기
-        # [0]으로 1D 배열로 만들고, argsort로 정렬 후, 상위 top_n개 선택
-        # (유사도가 0인 레시피가 많을 수 있으므로, 실제 개수(len)와 top_n 중 작은 값을 택함)
-        num_candidates = min(top_n, len(cosine_sims[0]))
-        top_indices = np.argsort(cosine_sims[0])[-num_candidates:][::-1]
+        def select_top(query_no, eligible):
+            top = rng.choice(eligible, size=min(top_n, len(eligible)), replace=False)
+            return top, np.full(len(top), np.nan)
+    
+    # 3. 쿼리별 상위 top_n개 선택 (이미 뽑힌 레시피는 제외)
+    # (유사도 점수는 ml_score 컬럼으로 함께 반환 -> 프롬프트 토큰 예산을 넘으면 낮은 점수부터 제외)
+    results = []
+    for query_no in range(len(user_texts)):
+        top_indices, top_scores = select_top(query_no, np.flatnonzero(~excluded))
+        results.append(filtered_recipes_df.iloc[top_indices].assign(ml_score=top_scores))
+        if exclude_selected:
+            excluded[top_indices] = True
+    
+    print(f"✅ (ML) '취향 저격' 후보군 {[len(df) for df in results]}개 선정 완료.")
+    return results
+
+def get_smart_candidates(profile, filtered_recipes_df, top_n=100, dynamic_keywords="", ranking=None):
+    """
+    (ML) 사용자 프로필 + [동적 키워드]와 가장 유사한 레시피 선정
+    (쿼리 1개짜리 get_smart_candidates_batch)
+    """
+    return get_smart_candidates_batch(
+        profile, filtered_recipes_df, [dynamic_keywords], top_n=top_n, ranking=ranking
+    )[0]
+    
+    
+# --- 6. [신규 추가] 추천 요청 파이프라인 (asyncio) ---
+# 필터링(DB) -> 키워드 추출(Gemini) -> 후보군(ML) -> 식단 작성(Gemini)을 순서대로 기다리던 것을,
+# 서로 의존하지 않는 단계는 동시에 실행합니다.
+#   - 키워드 추출은 필터링 결과가 필요 없으므로 맨 처음 띄워 두고
+#   - 그동안 필터링 + '프로필만' 후보군 채점을 먼저 끝낸 뒤, 키워드가 오면 '기분' 후보군만 추가 채점
+# 각 단계는 전용 스레드 풀에서 실행되고, 단계별 제한 시간(PIPELINE_STAGE_TIMEOUTS)을 넘기면
+# 키워드 추출은 '키워드 없이' 진행, 나머지 단계는 오류로 처리합니다.
+
+PIPELINE_STAGE_TIMEOUTS = { # 초
+    'filter': 15,
+    'keywords': 8,
+    'candidates': 15,
+    'recommendation': 90,
+}
+
+# 후보군 구성: 취향(프로필) 20 + 기분(키워드) 20 + 의외성(랜덤) 10 = 50
+CANDIDATE_TOP_N = 20
+CANDIDATE_RANDOM_COUNT = 10
+CANDIDATE_TARGET_TOTAL = 50
+
+# asyncio.run()은 종료 시 기본 실행기의 스레드를 모두 기다리므로,
+# 제한 시간을 넘긴 호출이 응답을 붙잡지 않도록 별도 스레드 풀을 사용
+_PIPELINE_EXECUTOR = ThreadPoolExecutor(max_workers=8, thread_name_prefix="bobfit-pipeline")
+
+def mix_candidates(filtered_recipes_df, candidates_base, candidates_mood,
+                   random_count=CANDIDATE_RANDOM_COUNT, target_total=CANDIDATE_TARGET_TOTAL):
+    """
+    (후보군 밸런싱) A. 취향 + B. 기분 + C. 의외성(랜덤)을 합쳐서 target_total개로 맞춥니다.
+    """
+    # C. [의외성 추천] 완전 랜덤 (10개) - 킬링 파트!
+    # (이미 A, B에서 뽑힌 건 제외하고 뽑아야 함)
+    current_selected_ids = pd.concat([candidates_base, candidates_mood])['RCP_SNO']
+    remaining_for_random = filtered_recipes_df[~filtered_recipes_df['RCP_SNO'].isin(current_selected_ids)]
+    
+    if not remaining_for_random.empty:
+        # 남은 것 중 10개 랜덤 (부족하면 남은 거 다)
+        random_count = min(random_count, len(remaining_for_random))
+        candidates_random = remaining_for_random.sample(n=random_count, random_state=None) # random_state 없어야 매번 바뀜
+    else:
+        candidates_random = pd.DataFrame()
+
+    # D. 최종 합치기 (20 + 20 + 10 = 50개)
+    candidates_mixed = pd.concat([
+        candidates_base, 
+        candidates_mood, 
+        candidates_random
+    ]).drop_duplicates(subset=['RCP_SNO'])
+    
+    # (혹시라도 중복 제거 후 50개가 안 되면 채우는 안전장치)
+    if len(candidates_mixed) < target_total:
+        remaining = filtered_recipes_df[~filtered_recipes_df['RCP_SNO'].isin(candidates_mixed['RCP_SNO'])]
+        if not remaining.empty:
+            fill_count = min(target_total - len(candidates_mixed), len(remaining))
+            fill = remaining.sample(n=fill_count, random_state=42)
+            candidates_mixed = pd.concat([candidates_mixed, fill])
+    else:
+        candidates_mixed = candidates_mixed.head(target_total)
+    return candidates_mixed
+
+def _filter_recipes_for(profile):
+    """(스레드에서 실행) 1차 필터링 (sqlite 연결은 만든 스레드에서만 쓸 수 있으므로 그 스레드의 공유 연결 사용)"""
+    return recommend_recipes_by_filter(get_db_connection(), profile, parse_restrictions(profile))
+
+async def _run_stage(name, timeout, timings, func, *args, **kwargs):
+    """동기 함수 func를 파이프라인 스레드 풀에서 실행 (timeout초를 넘기면 TimeoutError)"""
+    loop = asyncio.get_running_loop()
+    start = time.perf_counter()
+    try:
+        return await asyncio.wait_for(
+            loop.run_in_executor(_PIPELINE_EXECUTOR, functools.partial(func, *args, **kwargs)),
+            timeout=timeout,
+        )
+    except asyncio.TimeoutError:
+        raise TimeoutError(f"'{name}' 단계가 제한 시간({timeout}초)을 넘었습니다.") from None
+    finally:
+        timings[name] = (time.perf_counter() - start) * 1000
+
+async def _await_keywords(keywords_task):
+    """키워드 추출 결과 (입력이 없거나, 실패/시간 초과면 키워드 없이 진행)"""
+    if keywords_task is None:
+        return ""
+    try:
+        return await keywords_task or ""
+    except Exception as e:
+        print(f"키워드 추출 실패 (무시함): {e}")
+        return ""
+
+async def run_recommendation_pipeline(api_key, profile, today_str, mood, free_text, timeouts=None, on_stage=None,
+                                      stream=False):
+    """
+    (추천 요청 전체) 필터링 + 키워드 추출 + 후보군 선정 + Gemini 식단 작성.
+    - timeouts: 단계별 제한 시간 덮어쓰기 (예: {'recommendation': 30})
+    - on_stage: 단계가 바뀔 때 안내 문구를 받을 콜백 (UI 진행 상황 표시용)
+    - stream: True면 식단 작성은 실행하지 않고, 호출한 쪽이 조각 단위로 받아 갈
+              제너레이터(stream_gemini_recommendation)를 'recommendation_stream'에 담아 반환
+    - Gemini 서킷 브레이커가 열려 있거나 식단 응답을 못 받으면 ML 상위 후보로 만든 간이 식단(degraded)을 반환
+    반환: {'filtered', 'keywords', 'candidates', 'recommendation', 'meal_plan', 'recommendation_stream',
+           'degraded', 'llm_health', 'timings', 'error'}
+          (meal_plan: JSON 응답을 해석한 식단, Markdown 응답이면 None / error: 사용자에게 보여줄 오류 메시지
+           llm_health: gemini_resilience_stats() 스냅샷)
+    """
+    timeouts = {**PIPELINE_STAGE_TIMEOUTS, **(timeouts or {})}
+    notify = on_stage or (lambda message: None)
+    timings = {}
+    result = {
+        'filtered': pd.DataFrame(), 'keywords': "", 'candidates': pd.DataFrame(),
+        'recommendation': None, 'meal_plan': None, 'recommendation_stream': None, 'degraded': False,
+        'llm_health': None, 'timings': timings, 'error': None,
+    }
+    pipeline_start = time.perf_counter()
+    
+    # [단계 2] 키워드 추출(네트워크)은 필터링과 무관하므로 가장 먼저 시작
+    keywords_task = None
+    if free_text:
+        keywords_task = asyncio.ensure_future(_run_stage(
+            'keywords', timeouts['keywords'], timings, extract_keywords_with_gemini, api_key, free_text,
+            deadline=timeouts['keywords'], user=profile.get('user_id')
+        ))
+    
+    try:
+        # [단계 1] 1차 필터링
+        notify("1. 기본 데이터 필터링 중...")
+        filtered = await _run_stage('filter', timeouts['filter'], timings, _filter_recipes_for, profile)
+        result['filtered'] = filtered
+        if filtered.empty:
+            result['error'] = "1차 필터링 결과, 추천할 레시피가 없습니다."
+            return result
         
-        # 6. 상위 top_n개 레시피 DataFrame 반환
-        smart_candidates_df = filtered_recipes_df.iloc[top_indices]
+        # [단계 3] 후보군 선정
+        # A. [이성적 추천] 프로필 기반 / B. [감성적 추천] 동적 키워드 기반 (A에서 뽑힌 건 제외)
+        notify("2. 최적의 후보군(ML) + 의외의 발견(Random) 선정 중...")
+        if keywords_task is None or keywords_task.done():
+            # 키워드가 이미 준비됨 -> 두 쿼리를 한 번의 행렬 곱으로 채점
+            keywords = await _await_keywords(keywords_task)
+            candidates_base, candidates_mood = await _run_stage(
+                'candidates', timeouts['candidates'], timings,
+                get_smart_candidates_batch, profile, filtered, ["", keywords], top_n=CANDIDATE_TOP_N
+            )
+        else:
+            # 키워드를 기다리는 동안 A를 먼저 채점
+            (candidates_base,) = await _run_stage(
+                'candidates', timeouts['candidates'], timings,
+                get_smart_candidates_batch, profile, filtered, [""], top_n=CANDIDATE_TOP_N
+            )
+            notify("3. AI가 기분을 분석하는 중... 🧠")
+            keywords = await _await_keywords(keywords_task)
+            (candidates_mood,) = await _run_stage(
+                'candidates_mood', timeouts['candidates'], timings,
+                get_smart_candidates_batch, profile, filtered, [keywords], top_n=CANDIDATE_TOP_N,
+                exclude_ids=candidates_base['RCP_SNO'].tolist()
+            )
+        result['keywords'] = keywords
         
-        print(f"✅ (ML) '취향 저격' 후보군 {len(smart_candidates_df)}개 선정 완료.")
-        return smart_candidates_df
+        # C + D. 랜덤 추가 + 합치기 (+ 화면/조리법/레시피 변형에서 쓸 재료 dict는 카탈로그 사전에서 복원)
+        candidates_mixed = attach_ingredients(mix_candidates(filtered, candidates_base, candidates_mood))
+        result['candidates'] = candidates_mixed
+        print(f"🚀 최종 Gemini 전송 개수: {len(candidates_mixed)}개 (취향20+기분20+랜덤10)")
         
+        # [단계 4] 최종 Gemini 추천
+        if not gemini_available():
+            # 브레이커 open -> 제한 시간까지 기다리지 않고 바로 간이 식단
+            notify("4. AI 영양사 연결이 원활하지 않아 간이 식단을 준비합니다...")
+            result['meal_plan'] = build_fallback_meal_plan(candidates_mixed)
+            result['degraded'] = True
+            return result
+        budget_reason = llm_budget_exceeded(profile.get('user_id'))
+        if budget_reason:
+            print(f"💸 (파이프라인) {budget_reason} -> 간이 식단")
+            notify("4. 오늘 AI 사용 한도를 모두 사용해 간이 식단을 준비합니다...")
+            result['meal_plan'] = build_fallback_meal_plan(candidates_mixed)
+            result['degraded'] = True
+            return result
+        if stream:
+            # (UI 갱신은 화면 스레드에서만 가능하므로, 스트림 소비는 호출한 쪽에서)
+            result['recommendation_stream'] = stream_gemini_recommendation(
+                api_key, profile, candidates_mixed, today_str, mood, free_text,
+                timeout=timeouts['recommendation']
+            )
+            return result
+        notify("4. AI 영양사가 식단을 작성 중입니다... 🥗")
+        try:
+            result['recommendation'] = await _run_stage(
+                'recommendation', timeouts['recommendation'], timings,
+                get_gemini_recommendation, api_key, profile, candidates_mixed, today_str, mood, free_text,
+                deadline=timeouts['recommendation']
+            )
+        except TimeoutError as e:
+            print(f"⚠️ (파이프라인) {e}")
+        result['meal_plan'] = resolve_meal_plan(result['recommendation'], candidates_mixed)
+        result['degraded'] = bool(result['meal_plan'] and result['meal_plan']['degraded'])
+        return result
+    
     except Exception as e:
-        print(f"❌ (ML) TF-IDF/유사도 계산 실패: {e}. 랜덤 샘플링으로 대체합니다.")
-        sample_size = min(top_n, len(filtered_recipes_df))
-        return filtered_recipes_df.sample(n=sample_size, random_state=42)
+        result['error'] = f"추천 생성 중 오류: {e}"
+        return result
+    
+    finally:
+        if keywords_task is not None and not keywords_task.done():
+            keywords_task.cancel()
+        result['llm_health'] = gemini_resilience_stats()
+        stage_log = ", ".join(f"{name} {ms:.0f}ms" for name, ms in timings.items())
+        print(f"⏱️ (파이프라인) {stage_log} | 전체 {(time.perf_counter() - pipeline_start) * 1000:.0f}ms")
+
+def recommend_meal_plan(api_key, profile, today_str, mood, free_text, timeouts=None, on_stage=None, stream=False):
+    """(동기 진입점) 이벤트 루프가 없는 곳(Streamlit 스크립트 등)에서 추천 파이프라인 실행"""
+    return asyncio.run(run_recommendation_pipeline(
+        api_key, profile, today_str, mood, free_text, timeouts=timeouts, on_stage=on_stage, stream=stream
+    ))
+    
+    
+# -----------------------------------------------------------------
+# [신규 추가] 레시피 일괄 적재 (CSV / JSONL)
+# -----------------------------------------------------------------
+# python recommend_gemini.py ingest recipes.csv more.jsonl [--chunk-size 20000]
+# 1. 원본을 chunk 단위로 읽음 (파일 전체를 메모리에 올리지 않음)
+# 2. chunk마다 검사/정규화: RCP_SNO(정수)/제목 필수, ingredients_json -> {"재료명": "양"} JSON,
+#    파생 컬럼(cook_minutes, servings, price_per_serving)은 트리거 대신 pandas로 한 번에 계산
+# 3. 재료를 재료 사전 ID 배열(ingredient_ids / ingredient_amount_ids)로 인코딩 (새 재료명/양은 사전에 추가)
+# 4. INSERT ... ON CONFLICT(RCP_SNO) DO UPDATE (executemany)로 upsert, INGEST_COMMIT_ROWS행마다 commit
+#    (제목/재료가 바뀐 레시피는 저장된 조리법(recipe_steps)을 비움, --drop-json이면 ingredients_json은 비워서 저장)
+# 적재하는 동안 행 단위 트리거(카탈로그 버전/파생 컬럼)와 필터 인덱스는 잠시 내려 두고, 끝나면 다시 만든 뒤
+# 카탈로그 버전을 한 번만 올리고 TF-IDF 인덱스를 다시 학습합니다. (변경 기록 대신 전체 재생성)
+
+INGEST_CHUNK_SIZE = 20000
+INGEST_COMMIT_ROWS = 100000 # 이 행 수마다 commit (큰 트랜잭션)
+INGEST_COLUMNS = RECIPE_COLUMNS + ['cook_minutes', 'servings', 'price_per_serving']
+INGEST_WRITE_COLUMNS = INGEST_COLUMNS + ['ingredient_ids', 'ingredient_amount_ids']
+INGEST_TEXT_COLUMNS = ['RCP_TTL', 'CKG_NM', 'CKG_MTH_ACTO_NM', 'CKG_TIME_NM', 'CKG_INBUN_NM']
+# 적재 중 잠시 내려 두는 행 단위 트리거 / 필터 인덱스 (끝나면 ensure_* 함수로 다시 생성)
+INGEST_SUSPENDED_TRIGGERS = [
+    'trg_recipes_version_insert', 'trg_recipes_version_delete', 'trg_recipes_version_update',
+    'trg_recipes_cook_minutes_insert', 'trg_recipes_cook_minutes_update',
+    'trg_recipes_servings_insert', 'trg_recipes_servings_update', 'trg_recipes_ingredients_stale',
+]
+INGEST_SUSPENDED_INDEXES = ['idx_recipes_cook_minutes', 'idx_recipes_estimated_price']
+
+def iter_recipe_chunks(path, chunk_size=INGEST_CHUNK_SIZE):
+    """CSV(.csv) / JSON Lines(.jsonl, .ndjson) 파일을 DataFrame chunk로 읽음"""
+    if path.lower().endswith(('.jsonl', '.ndjson')):
+        reader = pd.read_json(path, lines=True, chunksize=chunk_size, dtype=False)
+    else:
+        reader = pd.read_csv(path, chunksize=chunk_size, dtype=str, keep_default_na=False, encoding='utf-8-sig')
+    with reader:
+        yield from reader
+
+# 재료 항목 끝의 양 ("다진 마늘 1큰술" -> "다진 마늘" + "1큰술"): 숫자/분수로 시작하거나 '약간' 같은 말로 된 마지막 부분
+_INGREDIENT_AMOUNT_PATTERN = re.compile(r'^(.+?)\s+((?:[\d½¼¾⅓⅔]|(?:약간|적당량|조금)(?=\s|$)).*)$')
+
+def normalize_ingredients_json(value):
+    """
+    재료 값 -> 정규화한 JSON 문자열 ({"재료명": "양"}, 한글 그대로) / 재료가 없거나 해석할 수 없으면 None
+    - dict, dict/list 모양의 JSON 문자열, 재료명 리스트, "두부 1모, 대파 1단" 같은 쉼표 구분 텍스트를 받음
+    - 리스트/텍스트 항목은 끝의 양만 떼어냄 ("다진 마늘 1큰술" -> "다진 마늘": "1큰술", 양이 없으면 항목 전체가 재료명)
+    """
+    if isinstance(value, str):
+        text = unicodedata.normalize('NFC', value).strip()
+        if not text:
+            return None
+        if text[0] in '{[':
+            try:
+                value = json.loads(text)
+            except json.JSONDecodeError:
+                return None
+        else:
+            value = [item for item in text.split(',')]
+    if isinstance(value, list):
+        pairs = []
+        for item in value:
+            item = str(item).strip()
+            match = _INGREDIENT_AMOUNT_PATTERN.match(item)
+            pairs.append(match.groups() if match else (item, ""))
+    elif isinstance(value, dict):
+        pairs = list(value.items())
+    else:
+        return None
+    ingredients = {}
+    for name, amount in pairs:
+        name = unicodedata.normalize('NFC', str(name)).strip()
+        if name:
+            ingredients[name] = "" if amount is None else unicodedata.normalize('NFC', str(amount)).strip()
+    return json.dumps(ingredients, ensure_ascii=False) if ingredients else None
+
+def normalize_recipe_chunk(chunk):
+    """
+    원본 chunk -> (INGEST_COLUMNS 순서의 DataFrame, 제외 사유별 개수)
+    파생 컬럼은 COOK_MINUTES_SQL / SERVINGS_SQL / PRICE_PER_SERVING_SQL과 같은 규칙으로 계산합니다.
+    """
+    rejected = {}
+    df = pd.DataFrame(index=chunk.index)
+    for col in INGEST_TEXT_COLUMNS:
+        values = chunk[col] if col in chunk else pd.Series("", index=chunk.index)
+        df[col] = values.fillna("").astype(str).str.strip()
+    
+    df['RCP_SNO'] = pd.to_numeric(chunk['RCP_SNO'], errors='coerce') if 'RCP_SNO' in chunk else np.nan
+    df['ingredients_json'] = (chunk['ingredients_json'] if 'ingredients_json' in chunk
+                              else pd.Series(None, index=chunk.index)).map(normalize_ingredients_json)
+    price = pd.to_numeric(chunk['estimated_price'], errors='coerce') if 'estimated_price' in chunk else np.nan
+    df['estimated_price'] = pd.Series(price, index=chunk.index).round()
+    
+    keep = pd.Series(True, index=df.index)
+    for reason, bad in (
+        ("RCP_SNO 없음/숫자 아님", df['RCP_SNO'].isna() | (df['RCP_SNO'] % 1 != 0)),
+        ("제목 없음", df['RCP_TTL'] == ""),
+        ("재료 정보 없음/형식 오류", df['ingredients_json'].isna()),
+    ):
+        bad &= keep # 행마다 첫 번째 사유로만 집계
+        if bad.any():
+            rejected[reason] = int(bad.sum())
+            keep &= ~bad
+    df = df[keep]
+    duplicated = df['RCP_SNO'].duplicated(keep='last') # 같은 chunk 안 중복은 마지막 행
+    if duplicated.any():
+        rejected["같은 RCP_SNO 중복(마지막 행 사용)"] = int(duplicated.sum())
+        df = df[~duplicated]
+    
+    # 파생 컬럼: '10분이내' -> 10, '2시간이내' -> 120, '2시간이상' -> 121 / '2인분' -> 2
+    time_text = df['CKG_TIME_NM']
+    minutes = pd.to_numeric(time_text.str.extract(r'^\s*(\d+)', expand=False), errors='coerce')
+    minutes = minutes.where(~time_text.str.contains('시간'), minutes * 60).replace(0, np.nan)
+    df['cook_minutes'] = minutes + time_text.str.contains('이상').astype(int)
+    servings = pd.to_numeric(df['CKG_INBUN_NM'].str.extract(r'^\s*(\d+)', expand=False), errors='coerce')
+    df['servings'] = servings.replace(0, np.nan)
+    per_serving = (df['estimated_price'] / df['servings']).round()
+    df['price_per_serving'] = per_serving.where((df['estimated_price'] > 0) & (df['servings'] > 0))
+    
+    df = df[INGEST_COLUMNS].astype(object)
+    df = df.where(df.notna(), None)
+    for col in ('RCP_SNO', 'estimated_price', 'cook_minutes', 'servings', 'price_per_serving'):
+        df[col] = df[col].map(lambda value: None if value is None else int(value))
+    return df, rejected
+
+def _ensure_recipes_table(conn):
+    """recipes 테이블이 없으면 만들고, upsert용 RCP_SNO 유일 인덱스를 준비합니다."""
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS recipes (
+        RCP_SNO INTEGER PRIMARY KEY, RCP_TTL TEXT, CKG_NM TEXT, CKG_MTH_ACTO_NM TEXT,
+        CKG_TIME_NM TEXT, CKG_INBUN_NM TEXT, ingredients_json TEXT,
+        estimated_price INTEGER, recipe_steps TEXT
+    );
+    """)
+    conn.commit()
+    run_migrations(conn)
+    rcp_sno_is_rowid = any(
+        name == 'RCP_SNO' and pk and col_type.upper() == 'INTEGER'
+        for _, name, col_type, _, _, pk in conn.execute("PRAGMA table_info(recipes)")
+    )
+    if not rcp_sno_is_rowid:
+        # (ON CONFLICT(RCP_SNO)에는 유일 인덱스가 필요. 기존 데이터에 중복이 있으면 여기서 실패 -> 먼저 정리)
+        conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_recipes_rcp_sno_unique ON recipes (RCP_SNO)")
+        conn.execute("DROP INDEX IF EXISTS idx_recipes_rcp_sno") # 유일 인덱스가 대신함
+        conn.commit()
+
+def ingest_recipes(conn, paths, chunk_size=INGEST_CHUNK_SIZE, commit_rows=INGEST_COMMIT_ROWS, rebuild_index=True,
+                   keep_json=True):
+    """
+    레시피 원본 파일들을 recipes 테이블에 upsert합니다.
+    - keep_json=False: 재료는 사전 ID 배열로만 저장 (ingredients_json = NULL)
+    반환: {'read', 'upserted', 'inserted', 'updated', 'rejected': {사유: 개수}, 'seconds', 'rows_per_sec'}
+    """
+    _ensure_recipes_table(conn)
+    update_columns = [col for col in INGEST_WRITE_COLUMNS if col != 'RCP_SNO']
+    upsert_sql = f"""
+    INSERT INTO recipes ({", ".join(INGEST_WRITE_COLUMNS)}) VALUES ({", ".join("?" * len(INGEST_WRITE_COLUMNS))})
+    ON CONFLICT(RCP_SNO) DO UPDATE SET
+        {", ".join(f"{col} = excluded.{col}" for col in update_columns)},
+        recipe_steps = CASE WHEN recipes.RCP_TTL IS excluded.RCP_TTL
+                             AND ((recipes.ingredient_ids IS excluded.ingredient_ids
+                                   AND recipes.ingredient_amount_ids IS excluded.ingredient_amount_ids)
+                                  OR (excluded.ingredients_json IS NOT NULL
+                                      AND recipes.ingredients_json IS excluded.ingredients_json))
+                            THEN recipes.recipe_steps END
+    """
+    codec = IngredientCodec()
+    codec.sync_from_db(conn)
+    stats = {'read': 0, 'upserted': 0, 'inserted': 0, 'updated': 0, 'rejected': {}}
+    rows_before = conn.execute("SELECT COUNT(*) FROM recipes").fetchone()[0]
+    start = time.perf_counter()
+    
+    for name in INGEST_SUSPENDED_TRIGGERS:
+        conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+    for name in INGEST_SUSPENDED_INDEXES:
+        conn.execute(f"DROP INDEX IF EXISTS {name}")
+    conn.commit()
+    try:
+        uncommitted = 0
+        for path in paths:
+            for chunk in iter_recipe_chunks(path, chunk_size):
+                rows, rejected = normalize_recipe_chunk(chunk)
+                blobs = codec.encode_to_db(conn, rows['ingredients_json'].tolist())
+                rows['ingredient_ids'] = [ids for ids, _ in blobs]
+                rows['ingredient_amount_ids'] = [amounts for _, amounts in blobs]
+                if not keep_json:
+                    rows['ingredients_json'] = None
+                conn.executemany(upsert_sql, rows.itertuples(index=False, name=None))
+                stats['read'] += len(chunk)
+                stats['upserted'] += len(rows)
+                for reason, count in rejected.items():
+                    stats['rejected'][reason] = stats['rejected'].get(reason, 0) + count
+                uncommitted += len(rows)
+                if uncommitted >= commit_rows:
+                    conn.commit()
+                    uncommitted = 0
+                elapsed = time.perf_counter() - start
+                print(f"📥 (적재) {os.path.basename(path)}: 누적 {stats['read']:,}행 읽음, {stats['upserted']:,}행 반영 "
+                      f"({stats['read'] / max(elapsed, 1e-9):,.0f} rows/s)")
+        conn.commit()
+    finally:
+        if conn.in_transaction:
+            conn.rollback()
+        # 트리거/인덱스 복구 + 이번 적재를 카탈로그 버전 1번의 '전체 변경'으로 기록
+        ensure_catalog_versioning(conn)
+        ensure_recipe_columns(conn)
+        ensure_serving_columns(conn)
+        ensure_ingredient_encoding(conn)
+        conn.execute("UPDATE catalog_meta SET value = value + 1 WHERE key = ?", (CATALOG_VERSION_KEY,))
+        conn.execute("DELETE FROM catalog_changes")
+        conn.execute(
+            "UPDATE catalog_meta SET value = (SELECT value FROM catalog_meta WHERE key = ?) WHERE key = ?",
+            (CATALOG_VERSION_KEY, CATALOG_CHANGES_PRUNED_KEY)
+        )
+        conn.commit()
+        conn.execute("PRAGMA optimize")
     
+    stats['inserted'] = conn.execute("SELECT COUNT(*) FROM recipes").fetchone()[0] - rows_before
+    stats['updated'] = stats['upserted'] - stats['inserted']
+    stats['seconds'] = time.perf_counter() - start
+    stats['rows_per_sec'] = stats['read'] / max(stats['seconds'], 1e-9)
     
-# --- 6. 메인 코드 실행(api 호출 테스트용) ---
+    if rebuild_index and stats['upserted']:
+        rebuild_tfidf_index(get_recipe_catalog(conn))
+    return stats
+
+
+# --- 7. 관리 명령 (인덱스 재생성 등) ---
+
+def _cmd_rebuild_index(args):
+    """python recommend_gemini.py rebuild-index [--db recipe_db.sqlite]"""
+    conn = sqlite3.connect(args.db)
+    try:
+        catalog = get_recipe_catalog(conn)
+    finally:
+        conn.close()
+    index_dir = get_index_dir(catalog.db_file)
+    stale = TfidfIndex.load(index_dir)
+    if stale is not None and stale.is_current(catalog) and not args.force:
+        print(f"✅ (TF-IDF) '{index_dir}' 인덱스가 이미 최신입니다. (카탈로그 v{catalog.version}, --force로 강제 재생성)")
+        return
+    rebuild_tfidf_index(catalog)
+    print(f"💾 (TF-IDF) '{index_dir}'에 저장 완료.")
+
+def _cmd_build_lsa(args):
+    """python recommend_gemini.py build-lsa [--db recipe_db.sqlite] [--components 128]"""
+    conn = sqlite3.connect(args.db)
+    try:
+        catalog = get_recipe_catalog(conn)
+    finally:
+        conn.close()
+    build_lsa_index(catalog, args.components)
+    print(f"💾 (LSA) '{get_index_dir(catalog.db_file, 'lsa')}'에 저장 완료.")
+
+def _cmd_cache_stats(args):
+    """python recommend_gemini.py cache-stats"""
+    cache = GeminiResponseCache()
+    stats = cache.stats()
+    if not stats:
+        print(f"(LLM 캐시) '{cache.path}'에 기록이 없습니다.")
+        return
+    print(f"(LLM 캐시) '{cache.path}' (최대 {cache.max_entries}개)")
+    print(f"{'func':<18} {'entries':>8} {'hits':>8} {'misses':>8} {'hit rate':>9}")
+    for func, row in sorted(stats.items()):
+        total = row['hits'] + row['misses']
+        hit_rate = f"{row['hits'] / total:.1%}" if total else "-"
+        print(f"{func:<18} {row['entries']:>8} {row['hits']:>8} {row['misses']:>8} {hit_rate:>9}")
+
+def _cmd_cache_clear(args):
+    """python recommend_gemini.py cache-clear [--expired]"""
+    deleted = GeminiResponseCache().clear(expired_only=args.expired)
+    print(f"🧹 (LLM 캐시) {deleted}개 항목 삭제 완료.")
+
+def _cmd_ingest(args):
+    """python recommend_gemini.py ingest recipes.csv [more.jsonl ...] [--db recipe_db.sqlite] [--chunk-size 20000] [--drop-json]"""
+    with contextlib.closing(sqlite3.connect(args.db)) as conn:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        stats = ingest_recipes(conn, args.sources, chunk_size=args.chunk_size, rebuild_index=not args.skip_index,
+                               keep_json=not args.drop_json)
+    rejected = sum(stats['rejected'].values())
+    print(f"✅ (적재) {stats['read']:,}행 읽음 -> 추가 {stats['inserted']:,} / 갱신 {stats['updated']:,} / 제외 {rejected:,}, "
+          f"{stats['seconds']:.1f}초 ({stats['rows_per_sec']:,.0f} rows/s)")
+    for reason, count in stats['rejected'].items():
+        print(f"   - 제외: {reason} {count:,}행")
+
+def _cmd_encode_ingredients(args):
+    """python recommend_gemini.py encode-ingredients [--db recipe_db.sqlite] [--drop-json]"""
+    with contextlib.closing(sqlite3.connect(args.db)) as conn:
+        run_migrations(conn)
+        encoded = ensure_ingredient_encoding(conn)
+        n_names, n_amounts, n_pending = conn.execute(
+            "SELECT (SELECT COUNT(*) FROM ingredient_vocab), (SELECT COUNT(*) FROM ingredient_amounts), "
+            "(SELECT COUNT(*) FROM recipes WHERE ingredient_ids IS NULL OR ingredient_amount_ids IS NULL)"
+        ).fetchone()
+        print(f"✅ (재료 사전) 새로 인코딩 {encoded:,}개, 재료명 {n_names:,}개 / 양 {n_amounts:,}개, "
+              f"인코딩 못 한 레시피(재료 정보 없음/형식 오류) {n_pending:,}개")
+        if args.drop_json:
+            size_before = os.path.getsize(args.db)
+            cleared = drop_ingredients_json(conn)
+            conn.execute("VACUUM")
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)") # WAL 모드면 VACUUM 결과가 본 파일에 반영되도록
+            print(f"🧹 (재료 사전) ingredients_json {cleared:,}개 비움, DB {size_before / 2**20:,.1f}MB -> "
+                  f"{os.path.getsize(args.db) / 2**20:,.1f}MB")
+
+def _cmd_migrate(args):
+    """python recommend_gemini.py migrate [--db recipe_db.sqlite]"""
+    with contextlib.closing(sqlite3.connect(args.db)) as conn:
+        version = run_migrations(conn)
+    print(f"✅ (DB 마이그레이션) '{args.db}' 스키마 v{version} (최신 v{SCHEMA_MIGRATIONS[-1][0]})")
+
+def _cmd_check_plans(args):
+    """python recommend_gemini.py check-plans [--db recipe_db.sqlite] (전체 스캔이 있으면 종료 코드 1)"""
+    with contextlib.closing(sqlite3.connect(args.db)) as conn:
+        run_migrations(conn)
+        problems = check_query_plans(conn)
+    if problems:
+        print(f"❌ (쿼리 계획) 인덱스를 타지 않는 조회 {len(problems)}건: " +
+              ", ".join(f"{name} ({detail})" for name, detail in problems))
+        sys.exit(1)
+    print("✅ (쿼리 계획) 모든 조회가 인덱스를 사용합니다.")
+
+def _cmd_usage_report(args):
+    """python recommend_gemini.py usage-report [--by call_site,user,day] [--days 7]"""
+    group_by = [name.strip() for name in args.by.split(",") if name.strip()]
+    unknown = [name for name in group_by if name not in LLMUsageStore.REPORT_COLUMNS]
+    if unknown:
+        print(f"❌ 알 수 없는 집계 기준: {', '.join(unknown)} (가능: {', '.join(LLMUsageStore.REPORT_COLUMNS)})")
+        return
+    since_day = time.strftime('%Y-%m-%d', time.localtime(time.time() - (args.days - 1) * 86400)) if args.days else None
+    report = LLMUsageStore(args.path).report(group_by, since_day=since_day)
+    if report.empty:
+        print(f"(LLM 사용량) '{args.path}'에 기록이 없습니다.")
+        return
+    print(f"(LLM 사용량) '{args.path}'" + (f" {since_day}부터" if since_day else " 전체"))
+    print(report.to_string(index=False, float_format=lambda value: f"{value:,.4f}"))
+    print(f"합계: {int(report['calls'].sum())}회, {int(report['total_tokens'].sum()):,} 토큰, "
+          f"${report['cost_usd'].sum():.4f} (추정)")
+
+def run_admin_command(argv):
+    """명령줄 인자가 있으면 추천 테스트 대신 관리 명령을 실행합니다."""
+    parser = argparse.ArgumentParser(prog="recommend_gemini.py", description="BobFit 백엔드 관리 명령")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    p_rebuild = subparsers.add_parser("rebuild-index", help="TF-IDF 인덱스 재학습 (오래된 경우만, --force로 강제)")
+    p_rebuild.add_argument("--db", default=DB_PATH)
+    p_rebuild.add_argument("--force", action="store_true")
+    p_rebuild.set_defaults(func=_cmd_rebuild_index)
+
+    p_lsa = subparsers.add_parser("build-lsa", help="LSA 밀집 임베딩 인덱스 생성 (오프라인 작업)")
+    p_lsa.add_argument("--db", default=DB_PATH)
+    p_lsa.add_argument("--components", type=int, default=LSA_COMPONENTS)
+    p_lsa.set_defaults(func=_cmd_build_lsa)
+
+    p_cache_stats = subparsers.add_parser("cache-stats", help="Gemini 응답 캐시 적중률/항목 수")
+    p_cache_stats.set_defaults(func=_cmd_cache_stats)
+
+    p_cache_clear = subparsers.add_parser("cache-clear", help="Gemini 응답 캐시 비우기 (--expired면 만료 항목만)")
+    p_cache_clear.add_argument("--expired", action="store_true")
+    p_cache_clear.set_defaults(func=_cmd_cache_clear)
+
+    p_ingest = subparsers.add_parser("ingest", help="레시피 CSV/JSONL 일괄 적재 (RCP_SNO 기준 upsert)")
+    p_ingest.add_argument("sources", nargs="+", help="원본 파일 (.csv / .jsonl)")
+    p_ingest.add_argument("--db", default=DB_PATH)
+    p_ingest.add_argument("--chunk-size", type=int, default=INGEST_CHUNK_SIZE)
+    p_ingest.add_argument("--skip-index", action="store_true", help="TF-IDF 인덱스 재학습 생략")
+    p_ingest.add_argument("--drop-json", action="store_true", help="재료는 사전 ID 배열로만 저장 (ingredients_json 비움)")
+    p_ingest.set_defaults(func=_cmd_ingest)
+
+    p_encode = subparsers.add_parser("encode-ingredients", help="재료를 사전 ID 배열로 인코딩 (--drop-json이면 JSON 비우고 VACUUM)")
+    p_encode.add_argument("--db", default=DB_PATH)
+    p_encode.add_argument("--drop-json", action="store_true")
+    p_encode.set_defaults(func=_cmd_encode_ingredients)
+
+    p_migrate = subparsers.add_parser("migrate", help="스키마 마이그레이션 적용 (schema_version 기준)")
+    p_migrate.add_argument("--db", default=DB_PATH)
+    p_migrate.set_defaults(func=_cmd_migrate)
+
+    p_plans = subparsers.add_parser("check-plans", help="자주 쓰는 조회의 EXPLAIN QUERY PLAN 점검 (전체 스캔이면 실패)")
+    p_plans.add_argument("--db", default=DB_PATH)
+    p_plans.set_defaults(func=_cmd_check_plans)
+
+    p_usage = subparsers.add_parser("usage-report", help="Gemini 토큰/비용 사용량 집계 (호출 위치/사용자/날짜별)")
+    p_usage.add_argument("--by", default="call_site", help="집계 기준 (쉼표 구분: call_site,user,day,model)")
+    p_usage.add_argument("--days", type=int, default=7, help="최근 며칠 (0이면 전체)")
+    p_usage.add_argument("--path", default=LLM_USAGE_PATH)
+    p_usage.set_defaults(func=_cmd_usage_report)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+# --- 8. 메인 코드 실행(api 호출 테스트용) ---
 
 if __name__ == "__main__":
     
+    # [신규] 관리 명령 (예: python recommend_gemini.py rebuild-index)
+    if len(sys.argv) > 1:
+        run_admin_command(sys.argv[1:])
+        sys.exit()
+    
     if "YOUR_API_KEY" in YOUR_API_KEY:
         print("="*50)
         print("❌ 오류: 스크립트 10줄의 YOUR_API_KEY를")